@@ -5,20 +5,24 @@ import keyboard
 import shutil
 import logging
 import traceback
+import threading
 from PyQt5.QtWidgets import (QApplication, QWidget, QPushButton, QVBoxLayout, QLabel, 
                              QRadioButton, QHBoxLayout, QDialog, QComboBox, QDialogButtonBox,
                              QFrame, QGridLayout, QListWidget, QListWidgetItem, QMessageBox,
                              QCheckBox, QScrollArea, QButtonGroup, QLineEdit, QSplashScreen)
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont, QIcon, QPalette, QColor
 
 # Add parent directory to path for shared modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from shared.recorder.screen import start_screen_recording, stop_screen_recording, set_region
+from shared.recorder.screen import start_screen_recording, stop_screen_recording, set_region, get_ffmpeg_path
 from shared.recorder.audio import start_audio_recording, stop_audio_recording, list_audio_devices, set_audio_device
 from shared.recorder.input_logger import start_logging, stop_logging
 from shared.utils.screenshot import select_region, select_window
+from shared.guide.incremental_guide import IncrementalGuideBuilder
+from shared.transcription.providers import get_provider
+from shared.utils.keyframes import select_recording_keyframes
 
 def setup_logging():
     """Setup comprehensive error logging"""
@@ -381,6 +385,14 @@ class SettingsDialog(QDialog):
         return self.audio_combo.currentText()
 
 class RecorderApp(QWidget):
+    # Emitted from hotkey/mouse listener threads; delivered on the Qt thread
+    capture_added = pyqtSignal()
+    guide_status = pyqtSignal(str)
+    guide_update_finished = pyqtSignal()
+    
+    # Wait this long after the last capture before describing new steps
+    GUIDE_DEBOUNCE_MS = 3000
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Hallmark Scribble - How-To Creator")
@@ -391,6 +403,17 @@ class RecorderApp(QWidget):
         self.screenshot_count = 0
         self.base_output_folder = None
         
+        # Incremental guide generation during screenshot mode
+        self.guide_builder = None
+        self.guide_thread = None
+        self.guide_update_pending = False
+        self.guide_timer = QTimer(self)
+        self.guide_timer.setSingleShot(True)
+        self.guide_timer.timeout.connect(self.run_incremental_guide_update)
+        self.capture_added.connect(self.schedule_incremental_guide_update)
+        self.guide_status.connect(self.on_guide_status)
+        self.guide_update_finished.connect(self.on_incremental_guide_update_finished)
+        
         # Load output folder from config if available
         self.load_output_folder_from_config()
         
@@ -624,6 +647,7 @@ class RecorderApp(QWidget):
             self.current_output_dir = self.create_output_directory()
             self.screenshot_count = 0
             self.is_screenshot_mode = True
+            self.guide_builder = None
             self.update_screenshot_counter()
             
             # Start mouse listener for click captures with callback
@@ -663,6 +687,7 @@ class RecorderApp(QWidget):
             
             self.update_screenshot_counter()
             self.status_label.setText(f"✓ Captured screenshot {self.screenshot_count} - Click or Shift+Alt+H for next")
+            self.capture_added.emit()
     
     def on_window_mode_toggled(self, checked):
         """Handle window mode radio button toggle"""
@@ -743,142 +768,120 @@ class RecorderApp(QWidget):
         else:
             self.status_label.setText("Screenshot session ended (no captures)")
     
-    def auto_generate_screenshot_transcript(self):
-        """Automatically generate transcript file for screenshots with AI-generated steps"""
+    def load_api_key(self):
+        """Copy GEMINI_API_KEY from config.txt into the environment if it isn't set"""
+        if os.getenv('GEMINI_API_KEY'):
+            return
+        config_path = self.get_config_path()
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                for line in f:
+                    if line.startswith('GEMINI_API_KEY='):
+                        api_key = line.split('=', 1)[1].strip()
+                        if api_key:
+                            os.environ['GEMINI_API_KEY'] = api_key
+                        break
+    
+    def get_guide_builder(self):
+        """Incremental guide builder for the current session, or None without an API key"""
         if not self.current_output_dir:
+            return None
+        if self.guide_builder and self.guide_builder.scribble_dir == self.current_output_dir:
+            return self.guide_builder
+        
+        self.load_api_key()
+        provider = get_provider()
+        if not provider.is_configured():
+            return None
+        model = provider.get_model('gemini-2.0-flash')
+        self.guide_builder = IncrementalGuideBuilder(self.current_output_dir, model, progress=self.guide_status.emit)
+        return self.guide_builder
+    
+    def schedule_incremental_guide_update(self):
+        """Restart the debounce timer; rapid captures are described together once they pause"""
+        if self.is_screenshot_mode:
+            self.guide_timer.start(self.GUIDE_DEBOUNCE_MS)
+    
+    def run_incremental_guide_update(self):
+        """Describe new or changed screenshots in the background"""
+        if self.guide_thread and self.guide_thread.is_alive():
+            # Run again when the current update finishes
+            self.guide_update_pending = True
             return
         
-        try:
-            transcript_path = os.path.join(self.current_output_dir, "transcript.txt")
-            actions_path = os.path.join(self.current_output_dir, "actions.log")
-            
-            # Generate AI-powered step-by-step guide
-            self.status_label.setText("AI analyzing screenshots and actions...")
-            guide_content = self.generate_ai_screenshot_guide(self.current_output_dir, self.screenshot_count)
-            
-            self.status_label.setText("Writing guide to file...")
-            with open(transcript_path, "w", encoding="utf-8") as f:
-                f.write(guide_content)
-                
-        except Exception as e:
-            print(f"Error creating transcript: {e}")
-            self.status_label.setText("Warning: AI generation failed, using basic template")
-            # Fallback to basic transcript
+        builder = self.get_guide_builder()
+        if builder is None:
+            return
+        
+        def work():
             try:
-                with open(transcript_path, "w", encoding="utf-8") as f:
-                    f.write("Screenshot How-To Guide\n\n")
-                    f.write(f"Total Screenshots: {self.screenshot_count}\n\n")
-            except:
-                pass
+                # The newest step waits until its keystrokes are in (next capture or stop)
+                notes, generated = builder.update(hold_last=self.is_screenshot_mode)
+                if generated:
+                    self.guide_status.emit(f"✓ AI described {generated} new step(s) - {len(notes)} total")
+            except Exception as e:
+                logging.error(f"Incremental guide update failed: {e}", exc_info=True)
+            finally:
+                self.guide_update_finished.emit()
+        
+        self.guide_update_pending = False
+        self.guide_thread = threading.Thread(target=work, daemon=True)
+        self.guide_thread.start()
     
-    def generate_ai_screenshot_guide(self, scribble_dir, screenshot_count):
-        """Generate AI-powered step-by-step instructions for screenshots"""
+    def on_incremental_guide_update_finished(self):
+        if self.guide_update_pending and self.is_screenshot_mode:
+            self.run_incremental_guide_update()
+    
+    def on_guide_status(self, message):
+        self.status_label.setText(message)
+    
+    def auto_generate_screenshot_transcript(self):
+        """Bring step descriptions up to date and write the final guide (summary pass runs once, here)"""
+        if not self.current_output_dir:
+            return
         
-        # Validate we have screenshots to analyze
-        if screenshot_count == 0:
-            print("No screenshots to analyze")
-            return "Screenshot How-To Guide\n\nNo screenshots captured yet.\n"
+        transcript_path = os.path.join(self.current_output_dir, "transcript.txt")
+        self.guide_timer.stop()
         
         try:
-            import google.generativeai as genai
-            import glob
-            
-            # Get API key
-            api_key = os.getenv('GEMINI_API_KEY')
-            if not api_key:
-                config_path = self.get_config_path()
-                if os.path.exists(config_path):
-                    with open(config_path, 'r') as f:
-                        for line in f:
-                            if line.startswith('GEMINI_API_KEY='):
-                                api_key = line.split('=', 1)[1].strip()
-                                break
-            
-            if not api_key:
+            builder = self.get_guide_builder()
+            if builder is None:
                 print("No API key found, using basic template")
                 self.status_label.setText("No API key found - using basic template")
-                return f"Screenshot How-To Guide\n\nTotal Screenshots: {screenshot_count}\n\nAdd step descriptions for each screenshot in the editor.\n"
-            
-            print("API key found, generating AI content...")
-            self.status_label.setText("API key found - initializing AI...")
-            QApplication.processEvents()
-            # Read action logs if available
-            actions_log = ""
-            actions_path = os.path.join(scribble_dir, "actions.log")
-            if os.path.exists(actions_path):
-                with open(actions_path, 'r', encoding='utf-8') as f:
-                    actions_log = f.read()
-            
-            print("Configuring AI model...")
-            self.status_label.setText("Configuring AI model...")
-            QApplication.processEvents()
-            genai.configure(api_key=api_key)
-            
-            # Use Gemini 2.0 Flash which supports vision
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            
-            # Get all screenshot files
-            screenshots = sorted([f for f in os.listdir(scribble_dir) 
-                                if f.startswith("screenshot_") and f.endswith(".png")])
-            
-            if len(screenshots) == 0:
-                print("No screenshot files found in directory")
-                return f"Screenshot How-To Guide\n\nTotal Screenshots: {screenshot_count}\n\nScreenshots will appear here once captured.\n"
-            
-            print(f"Found {len(screenshots)} screenshots to analyze")
-            self.status_label.setText(f"Found {len(screenshots)} screenshots - loading images...")
-            QApplication.processEvents()
+                with open(transcript_path, "w", encoding="utf-8") as f:
+                    f.write(f"Screenshot How-To Guide\n\nTotal Screenshots: {self.screenshot_count}\n\nAdd step descriptions for each screenshot in the editor.\n")
+                return
             
-            # Load images for AI analysis
-            from PIL import Image
-            images = []
-            for idx, screenshot_file in enumerate(screenshots[:screenshot_count], 1):  # Only analyze actual screenshots
-                img_path = os.path.join(scribble_dir, screenshot_file)
-                if os.path.exists(img_path):
-                    images.append(Image.open(img_path))
-                    self.status_label.setText(f"Loading image {idx}/{screenshot_count}...")
+            # Let a background update finish so steps are not described twice
+            if self.guide_thread and self.guide_thread.is_alive():
+                self.status_label.setText("Waiting for AI step descriptions...")
+                while self.guide_thread.is_alive():
                     QApplication.processEvents()
+                    self.guide_thread.join(0.1)
             
-            actions_context = f"\n\nUser actions during capture:\n{actions_log}" if actions_log else ""
-            
-            prompt = f"""You are analyzing {screenshot_count} screenshots to create a professional step-by-step how-to guide.
-
-{actions_context}
-
-Carefully examine each screenshot image and create a detailed, educational guide with:
-
-1. A clear, engaging title for the tutorial based on what you see
-2. A brief introduction explaining what will be accomplished
-3. Step-by-step instructions (one for each screenshot):
-   - Start with "Step 1:", "Step 2:", etc.
-   - Describe exactly what you SEE in each screenshot
-   - Identify specific UI elements, buttons, menus, text fields visible
-   - Explain what action should be taken ("Click on...", "Type in...", "Select...")
-   - Explain WHY each step matters
-   - Use professional but friendly language
-4. A brief conclusion or next steps
-
-Analyze the visual content of each screenshot carefully. Reference specific elements you can see like button labels, menu items, window titles, etc.
-
-Write in a natural, human-like style - as if an expert is explaining this to a colleague while showing them the screenshots. Be clear, educational, and encouraging. Keep each step concise but informative (2-4 sentences per step).
-
-IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
-
-            print("Sending screenshots to AI for analysis...")
-            self.status_label.setText("Sending to AI for analysis (this may take a moment)...")
+            self.status_label.setText("AI finishing guide...")
             QApplication.processEvents()
-            response = model.generate_content([prompt] + images)
-            guide_text = response.text.strip()
+            result = {}
+            worker = threading.Thread(target=lambda: result.update(text=builder.finalize()), daemon=True)
+            worker.start()
+            while worker.is_alive():
+                QApplication.processEvents()
+                worker.join(0.1)
             
+            guide_text = result.get('text', '')
             print(f"AI generated {len(guide_text)} characters of content")
             self.status_label.setText(f"AI analysis complete - {len(guide_text)} characters generated")
-            QApplication.processEvents()
-            return guide_text if guide_text else f"Screenshot How-To Guide\n\nTotal Screenshots: {screenshot_count}\n\n"
-            
+                
         except Exception as e:
-            print(f"AI guide generation failed: {e}")
-            self.status_label.setText(f"AI generation failed: {str(e)}")
-            return f"Screenshot How-To Guide\n\nTotal Screenshots: {screenshot_count}\n\n"
+            print(f"Error creating transcript: {e}")
+            self.status_label.setText("Warning: AI generation failed, using basic template")
+            # Fallback to basic transcript
+            try:
+                with open(transcript_path, "w", encoding="utf-8") as f:
+                    f.write("Screenshot How-To Guide\n\n")
+                    f.write(f"Total Screenshots: {self.screenshot_count}\n\n")
+            except:
+                pass
     
     def hotkey_capture_screenshot(self):
         """Capture screenshot when Ctrl+Alt+S is pressed"""
@@ -921,8 +924,8 @@ IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
                 log_time = datetime.now().strftime("%H:%M:%S")
                 f.write(f"[{log_time}] Screenshot {self.screenshot_count} captured\n")
             
-            # Auto-generate transcript after each capture
-            self.auto_generate_screenshot_transcript()
+            # Describe the new step once captures pause
+            self.capture_added.emit()
         except Exception as e:
             print(f"Screenshot error: {e}")
             self.status_label.setText(f"Screenshot error: {str(e)}")
@@ -1342,7 +1345,7 @@ IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
             print(f"Editor error: {e}")
     
     def generate_video_guide(self):
-        """Generate AI guide directly from video file using Gemini vision"""
+        """Generate AI guide from the recording's keyframes (frames before each click plus scene changes)"""
         if not self.current_output_dir:
             self.status_label.setText("Error: No recording found. Record first.")
             return
@@ -1352,56 +1355,33 @@ IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
             self.status_label.setText("Error: No video file found.")
             return
         
-        self.status_label.setText("Uploading video to AI for analysis...")
-        QApplication.processEvents()
-        
         try:
-            import google.generativeai as genai
-            
-            # Get API key
-            api_key = os.getenv('GEMINI_API_KEY')
-            if not api_key:
-                config_path = self.get_config_path()
-                if os.path.exists(config_path):
-                    with open(config_path, 'r') as f:
-                        for line in f:
-                            if line.startswith('GEMINI_API_KEY='):
-                                api_key = line.split('=', 1)[1].strip()
-                                break
-            
-            if not api_key:
+            self.load_api_key()
+            provider = get_provider()
+            if not provider.is_configured():
                 self.status_label.setText("Error: No API key found. Go to Tools → Settings to add your API key")
                 return
             
-            self.status_label.setText("Configuring AI model...")
-            QApplication.processEvents()
-            
-            genai.configure(api_key=api_key)
-            
-            # Upload video file
-            self.status_label.setText("Uploading video file to Gemini...")
+            self.status_label.setText("Selecting keyframes from video...")
             QApplication.processEvents()
             
-            video_file = genai.upload_file(path=video_path)
-            
-            self.status_label.setText("Processing video with AI (this may take a minute)...")
-            QApplication.processEvents()
+            keyframes = select_recording_keyframes(self.current_output_dir, get_ffmpeg_path(), budget=10)
+            if not keyframes:
+                raise ValueError("No frames could be extracted from video")
             
-            # Wait for file to be processed
-            import time
-            while video_file.state.name == "PROCESSING":
-                time.sleep(2)
-                video_file = genai.get_file(video_file.name)
-            
-            if video_file.state.name == "FAILED":
-                raise ValueError("Video processing failed")
+            from PIL import Image
+            import io
             
-            # Use Gemini 2.0 Flash with video analysis
-            model = genai.GenerativeModel('gemini-2.0-flash')
+            contents = []
+            for i, frame in enumerate(keyframes, 1):
+                action = "just before a click" if frame.reason == 'click' else "screen change"
+                contents.append(f"Frame {i} at {frame.time:.1f}s ({action}):")
+                contents.append(Image.open(io.BytesIO(frame.png)))
             
-            prompt = """You are analyzing this screen recording video to create a professional step-by-step how-to guide.
+            prompt = f"""You are analyzing {len(keyframes)} keyframes from a screen recording to create a professional step-by-step how-to guide.
+Each frame is labeled with its time in the video; frames marked "just before a click" show the screen right before the user clicked.
 
-Watch the video carefully and create a detailed tutorial guide with:
+Create a detailed tutorial guide with:
 
 1. A clear, engaging title for the tutorial based on what you see
 2. A brief introduction explaining what will be accomplished
@@ -1412,14 +1392,15 @@ Watch the video carefully and create a detailed tutorial guide with:
    - Why each step matters
 4. A brief conclusion or next steps
 
-Write in a natural, professional but friendly style. Be clear and educational. Focus on WHAT you SEE happening in the video - describe the visual actions and UI interactions.
+Write in a natural, professional but friendly style. Be clear and educational. Focus on WHAT you SEE happening in the frames - describe the visual actions and UI interactions.
 
 IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
 
-            self.status_label.setText("Analyzing video with AI...")
+            self.status_label.setText(f"Analyzing {len(keyframes)} keyframes with AI...")
             QApplication.processEvents()
             
-            response = model.generate_content([video_file, prompt])
+            model = provider.get_model('gemini-2.0-flash')
+            response = model.generate_content(contents + [prompt])
             guide_text = response.text.strip()
             
             # Save to transcript.txt
@@ -2,31 +2,42 @@
 Simple HTTP server to handle HTML editor save requests
 """
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit, parse_qs
 import json
 import os
 import base64
 import threading
 
+from shared.utils.http_files import plan_file_response, iter_file
+
 class EditorHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         # Serve image files
-        if self.path.startswith('/image/'):
+        url = urlsplit(self.path)
+        if url.path.startswith('/image/'):
             try:
                 # Extract filepath from URL and decode it
-                from urllib.parse import unquote
-                filepath = self.path[7:]  # Remove '/image/'
+                filepath = url.path[7:]  # Remove '/image/'
                 filepath = unquote(filepath)  # Decode URL encoding
                 filepath = filepath.replace('/', os.sep)
                 
                 if os.path.exists(filepath):
-                    with open(filepath, 'rb') as f:
-                        img_data = f.read()
+                    # Versioned URLs (?v= or ?t=) never change, so they can be cached for good
+                    query = parse_qs(url.query)
+                    status, headers, body = plan_file_response(
+                        filepath, self.headers, 'image/png',
+                        immutable='v' in query or 't' in query,
+                        method=self.command
+                    )
                     
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'image/png')
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
                     self.send_header('Access-Control-Allow-Origin', '*')
                     self.end_headers()
-                    self.wfile.write(img_data)
+                    if body is not None:
+                        for block in iter_file(filepath, *body):
+                            self.wfile.write(block)
                 else:
                     self.send_response(404)
                     self.end_headers()
@@ -38,6 +49,9 @@ class EditorHandler(BaseHTTPRequestHandler):
             self.send_response(404)
             self.end_headers()
     
+    def do_HEAD(self):
+        self.do_GET()
+    
     def do_POST(self):
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
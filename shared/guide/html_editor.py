@@ -3,6 +3,14 @@ import json
 import logging
 from urllib.parse import quote
 
+
+def image_version(path):
+    """Short version string for an image URL, changing whenever the file does"""
+    try:
+        return f"{os.stat(path).st_mtime_ns:x}"
+    except OSError:
+        return '0'
+
 def create_html_editor(scribble_dir):
     """Create an interactive HTML editor for the guide"""
     
@@ -64,9 +72,10 @@ def create_html_editor(scribble_dir):
     else:
         actions = []
     
-    # Parse AI transcript into steps (split by common delimiters)
-    transcript_steps = []
-    if transcript and transcript != "[No transcript generated yet]":
+    # Parse AI transcript into steps (split by common delimiters), unless the guide
+    # generator already saved per-step notes
+    transcript_steps = [note['note'] for note in saved_notes if isinstance(note, dict) and note.get('note')]
+    if not transcript_steps and transcript and transcript != "[No transcript generated yet]":
         # Check if transcript contains error messages or setup instructions
         error_keywords = [
             "AI Analysis not available",
@@ -585,6 +594,8 @@ def create_html_editor(scribble_dir):
                 <input type="file" id="fileInput" accept="image/*" style="display: none;">
                 <button class="upload-btn" onclick="document.getElementById('fileInput').click()">📁 Upload Image</button>
                 <button class="upload-btn" onclick="addTextStep()">📝 Add Text</button>
+                <button class="upload-btn" id="streamGuideBtn" onclick="streamGuideIntoEditor()" style="background: #27ae60;">🤖 Generate Guide (Live)</button>
+                <button class="upload-btn" id="batchInstructionsBtn" onclick="generateAllStepInstructions()" style="background: #27ae60;">🤖 Generate All Step Instructions</button>
                 <p style="color: #666; margin-top: 10px; font-size: 14px;">Upload images or add text-only steps</p>
             </div>
             
@@ -699,10 +710,11 @@ def create_html_editor(scribble_dir):
                 continue
             
             screenshot_path = os.path.join(scribble_dir, screenshot_file).replace(chr(92), "/")
-            encoded_path = quote(screenshot_path, safe='')
+            # Version the URL by mtime so the browser can cache the image until it is re-annotated
+            encoded_path = quote(screenshot_path, safe='') + f"?v={image_version(screenshot_path)}"
             
             html_content += f"""
-                <div class="screenshot-item" draggable="true" data-step="{i}" data-type="screenshot" data-filename="{screenshot_file}">
+                <div class="screenshot-item" draggable="true" data-step="{i}" data-type="screenshot" data-filename="{screenshot_file}" data-image-path="{screenshot_path}">
                     <div class="drag-handle">⋮⋮ Drag</div>
                     <button class="delete-btn" onclick="deleteStep(this)">🗑️ Delete</button>
                     <div class="screenshot-number">Step {i}</div>
@@ -1903,6 +1915,163 @@ h1 {{ color: #333; }}
             }});
         }}
         
+        // Run a long operation as a server-side background job and poll until it finishes
+        async function runBackgroundJob(url, payload) {{
+            const response = await fetch(url, {{
+                method: 'POST',
+                headers: {{'Content-Type': 'application/json'}},
+                body: JSON.stringify(Object.assign({{}}, payload, {{background: true}}))
+            }});
+            const submitted = await response.json();
+            if (!submitted.job_id) {{
+                return submitted;  // Answered synchronously
+            }}
+            
+            const finished = ['completed', 'failed', 'cancelled', 'interrupted'];
+            while (true) {{
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const jobResponse = await fetch(`/api/jobs/${{submitted.job_id}}`);
+                if (!jobResponse.ok) throw new Error(`Server error: ${{jobResponse.status}}`);
+                const job = (await jobResponse.json()).job;
+                if (finished.includes(job.status)) {{
+                    return job.result || {{success: false, error: job.error || `Job ${{job.status}}`}};
+                }}
+            }}
+        }}
+        
+        // Generate the whole guide with AI, filling in each step's note as soon as it is written
+        function streamGuideIntoEditor() {{
+            const button = document.getElementById('streamGuideBtn');
+            button.disabled = true;
+            button.textContent = '⏳ Writing guide...';
+            
+            const source = new EventSource(`/api/generate_guide_stream?output_dir=${{encodeURIComponent(scribbleDir)}}`);
+            let stepsReady = 0;
+            
+            const finish = () => {{
+                source.close();
+                button.disabled = false;
+                button.textContent = '🤖 Generate Guide (Live)';
+            }};
+            
+            source.addEventListener('step', e => {{
+                const step = JSON.parse(e.data);
+                const noteDiv = document.getElementById(`note-${{step.step}}`);
+                if (noteDiv) {{
+                    noteDiv.innerText = step.note;
+                    saveNoteContent(step.step);
+                }}
+                stepsReady++;
+                button.textContent = `⏳ ${{stepsReady}} step(s) written...`;
+            }});
+            source.addEventListener('status', e => showToast('⏳ ' + JSON.parse(e.data).message, 'info', 3000));
+            source.addEventListener('done', e => {{
+                const data = JSON.parse(e.data);
+                finish();
+                if (data.title) {{
+                    document.getElementById('titleEditor').value = data.title;
+                    localStorage.setItem('guideTitle', data.title);
+                }}
+                const seconds = data.metrics && data.metrics.time_to_first_step;
+                showToast(`✅ Guide generated (${{data.notes_count}} steps${{seconds ? `, first step after ${{seconds}}s` : ''}})`, 'success', 4000);
+            }});
+            source.addEventListener('error', e => {{
+                finish();
+                if (e.data) {{
+                    const data = JSON.parse(e.data);
+                    if (data.error_type === 'rate_limit' || data.error_type === 'cooldown') {{
+                        showToast('⚠️ ' + data.error, 'error', 5000);
+                    }} else if (data.error_type === 'safety') {{
+                        showToast('⚠️ Content blocked by safety filters.', 'error', 5000);
+                    }} else {{
+                        showToast('❌ ' + (data.error || 'Failed to generate guide'), 'error', 5000);
+                    }}
+                }} else {{
+                    showToast('❌ Lost connection to server', 'error', 5000);
+                }}
+            }});
+        }}
+        
+        // Generate instructions for every image step in one request; results stream back per step
+        async function generateAllStepInstructions() {{
+            const button = document.getElementById('batchInstructionsBtn');
+            const steps = [];
+            document.querySelectorAll('.screenshot-item').forEach(item => {{
+                const noteDiv = item.querySelector('.screenshot-note');
+                const img = item.querySelector('.screenshot-img');
+                if (!noteDiv || !img) return;  // Text-only step
+                const step = {{step: noteDiv.id.replace('note-', '')}};
+                if (img.src.startsWith('data:')) {{
+                    step.image_data = img.src;
+                }} else if (item.dataset.imagePath) {{
+                    step.image_path = item.dataset.imagePath;
+                }} else {{
+                    return;
+                }}
+                steps.push(step);
+            }});
+            if (!steps.length) {{
+                showToast('No image steps to describe', 'info');
+                return;
+            }}
+            
+            button.disabled = true;
+            button.textContent = `⏳ 0/${{steps.length}} steps...`;
+            let finished = 0;
+            let failed = 0;
+            
+            try {{
+                const response = await fetch('/api/generate_step_instructions_batch', {{
+                    method: 'POST',
+                    headers: {{'Content-Type': 'application/json'}},
+                    body: JSON.stringify({{steps: steps}})
+                }});
+                if (!response.headers.get('Content-Type').includes('ndjson')) {{
+                    const data = await response.json();
+                    throw new Error(data.error || `Server error: ${{response.status}}`);
+                }}
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {{
+                    const {{value, done}} = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, {{stream: true}});
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();
+                    lines.filter(line => line.trim()).forEach(line => {{
+                        const result = JSON.parse(line);
+                        if (result.done) return;
+                        finished++;
+                        if (result.success) {{
+                            const noteDiv = document.getElementById(`note-${{result.step}}`);
+                            if (noteDiv) {{
+                                noteDiv.innerHTML = result.instructions;
+                                saveNoteContent(result.step);
+                            }}
+                        }} else {{
+                            failed++;
+                            console.error(`Step ${{result.step}} failed:`, result.error);
+                        }}
+                        button.textContent = `⏳ ${{finished}}/${{steps.length}} steps...`;
+                    }});
+                }}
+                
+                if (failed) {{
+                    showToast(`⚠️ ${{finished - failed}} of ${{steps.length}} steps generated, ${{failed}} failed`, 'error', 5000);
+                }} else {{
+                    showToast(`✅ Instructions generated for ${{steps.length}} steps`, 'success', 3000);
+                }}
+            }} catch (err) {{
+                console.error('Batch generation error:', err);
+                showToast('❌ ' + err.message, 'error', 5000);
+            }} finally {{
+                button.disabled = false;
+                button.textContent = '🤖 Generate All Step Instructions';
+            }}
+        }}
+        
         function generateSOP() {{
             const title = document.getElementById('titleEditor').value || 'Procedure';
             const screenshots = document.querySelectorAll('.screenshot-item');
@@ -1919,16 +2088,11 @@ h1 {{ color: #333; }}
             showToast('⏳ Generating formal SOP with AI...', 'info', 2000);
             
             // Call backend API
-            fetch('/api/generate_sop', {{
-                method: 'POST',
-                headers: {{'Content-Type': 'application/json'}},
-                body: JSON.stringify({{
-                    title: title,
-                    guide_content: guideContent,
-                    output_dir: '{scribble_dir.replace(chr(92), chr(92)+chr(92))}'
-                }})
+            runBackgroundJob('/api/generate_sop', {{
+                title: title,
+                guide_content: guideContent,
+                output_dir: '{scribble_dir.replace(chr(92), chr(92)+chr(92))}'
             }})
-            .then(response => response.json())
             .then(data => {{
                 if (data.success) {{
                     // Download the complete HTML SOP with embedded screenshots
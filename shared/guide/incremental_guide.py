@@ -0,0 +1,331 @@
+"""
+Incremental guide generation for screenshot sessions
+
+Instead of sending every screenshot to the model after each capture, each
+step is described once and cached by the screenshot's content hash
+(step_cache.json in the recording folder). Updates only describe new or
+changed screenshots; the title/introduction/conclusion pass runs once when
+the session stops. Each step is sent with the click it was captured on and
+the keystrokes that followed, from actions.log.
+
+LiveGuideAnnotator runs these updates in the background while recording, so
+by the time the session stops only the summary pass is left.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from contextlib import nullcontext
+
+from shared.transcription.context_budget import (budget_actions, actions_per_step, truncate_text,
+                                                 log_prompt_tokens, ACTIONS_TOKEN_BUDGET, GUIDE_TOKEN_BUDGET)
+from shared.utils.singleflight import recording_lock
+
+STEP_PROMPT = """This screenshot is step {step} of a how-to guide being recorded.
+{previous}{actions}
+Describe exactly what the user should do in this step:
+- Identify specific UI elements visible (buttons, menus, fields, window titles)
+- State the action to take ("Click on...", "Type in...", "Select...")
+- Briefly explain why this step matters
+
+Write 2-4 sentences in a professional but friendly tone, as if guiding a colleague.
+
+IMPORTANT: Write ONLY the instructions. Do NOT include any meta-commentary or labels like "Step 1:"."""
+
+SUMMARY_PROMPT = """Below are the steps of a how-to guide, written from screenshots of a user's screen.
+{actions}
+{steps}
+
+Write the framing for this guide in exactly this format:
+TITLE: <a clear, engaging title for the tutorial>
+INTRODUCTION: <2-3 sentences explaining what will be accomplished>
+CONCLUSION: <1-2 sentences of wrap-up or next steps>"""
+
+DEFAULT_TITLE = "Screenshot How-To Guide"
+
+# Limit for one step's click and keystroke context
+STEP_ACTIONS_TOKEN_BUDGET = 200
+
+_TIMESTAMP = re.compile(r"^[\d.]+\s+")
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IncrementalGuideBuilder:
+    """
+    Builds a screenshot guide step by step.
+
+    Args:
+        scribble_dir: Recording folder containing screenshot_*.png
+        model: Model with generate_content() (see shared.transcription.providers)
+        progress: Optional callback taking a status message
+        rate_limiter: Optional RateLimiter every model call goes through
+        low_priority: Use low-priority rate limiter slots (for background work)
+    """
+
+    CACHE_FILE = 'step_cache.json'
+
+    def __init__(self, scribble_dir, model, progress=None, rate_limiter=None, low_priority=False):
+        self.scribble_dir = scribble_dir
+        self.model = model
+        self.progress = progress or (lambda message: None)
+        self.rate_limiter = rate_limiter
+        self.low_priority = low_priority
+        self.cache_path = os.path.join(scribble_dir, self.CACHE_FILE)
+        self.notes = []
+        self._lock = threading.Lock()
+        self._cache = self._load_cache()
+
+    def _slot(self):
+        if self.rate_limiter is None:
+            return nullcontext()
+        return self.rate_limiter.slot(low_priority=self.low_priority)
+
+    def _load_cache(self):
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable step cache {self.cache_path}: {e}")
+        return {}
+
+    def _save_cache(self):
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._cache, f, indent=2)
+        os.replace(temp_path, self.cache_path)
+
+    def screenshots(self):
+        return sorted(f for f in os.listdir(self.scribble_dir)
+                      if f.startswith("screenshot_") and f.endswith(".png"))
+
+    def _step_actions(self):
+        """Click and keystroke lines for each step, without timestamps"""
+        actions_path = os.path.join(self.scribble_dir, "actions.log")
+        if not os.path.exists(actions_path):
+            return []
+        with open(actions_path, 'r', encoding='utf-8', errors='replace') as f:
+            steps = actions_per_step(f.read())
+        return ['\n'.join(_TIMESTAMP.sub('', event) for event in events) for events in steps]
+
+    def _describe_step(self, path, step, previous_note, actions=''):
+        from PIL import Image
+
+        with Image.open(path) as img:
+            image = img.copy()
+        previous = f"\nThe previous step was: {previous_note}\n" if previous_note else ""
+        if actions:
+            actions = (f"\nWhat the user did on this screen (click position, then keystrokes):\n"
+                       f"{truncate_text(actions, STEP_ACTIONS_TOKEN_BUDGET, label='actions')}\n")
+        contents = [STEP_PROMPT.format(step=step, previous=previous, actions=actions), image]
+        log_prompt_tokens(f"guide step {step}", contents)
+        with self._slot():
+            response = self.model.generate_content(contents)
+        return response.text.strip()
+
+    def update(self, hold_last=False):
+        """
+        Describe any new or changed screenshots and rewrite notes.json and a draft transcript.
+
+        Args:
+            hold_last: Leave the newest screenshot for later (while recording, its
+                keystrokes are still being typed)
+
+        Returns:
+            (notes, generated) - all step notes, and how many were generated by this call
+        """
+        with self._lock:
+            notes = []
+            generated = 0
+            previous_note = ''
+            files = self.screenshots()
+            step_actions = self._step_actions()
+            for step, filename in enumerate(files, 1):
+                path = os.path.join(self.scribble_dir, filename)
+                key = file_hash(path)
+                entry = self._cache.get(key)
+                if entry is None and hold_last and step == len(files):
+                    note = ''
+                elif entry is None:
+                    self.progress(f"AI describing step {step}/{len(files)}...")
+                    try:
+                        actions = step_actions[step - 1] if step <= len(step_actions) else ''
+                        note = self._describe_step(path, step, previous_note, actions)
+                    except Exception as e:
+                        # Not cached, so the next update retries this step
+                        logging.warning(f"Could not describe {filename}: {e}")
+                        note = ''
+                    else:
+                        entry = {'file': filename, 'note': note}
+                        self._cache[key] = entry
+                        self._save_cache()
+                        generated += 1
+                else:
+                    note = entry['note']
+                notes.append({'step': str(step), 'note': note, 'type': 'screenshot', 'file': filename})
+                previous_note = note
+
+            self._write_outputs(notes, self._assemble(DEFAULT_TITLE, '', notes, ''))
+            self.notes = notes
+            logging.info(f"Incremental guide update: {len(notes)} steps, {generated} generated")
+            return notes, generated
+
+    def finalize(self):
+        """
+        Bring all steps up to date, then run the single summary pass for title,
+        introduction and conclusion.
+
+        Returns:
+            The final guide text
+        """
+        notes, _ = self.update()
+        title, introduction, conclusion = DEFAULT_TITLE, '', ''
+
+        if any(note['note'] for note in notes):
+            self.progress("AI writing title and summary...")
+            steps_text = '\n'.join(f"Step {note['step']}: {note['note']}" for note in notes)
+            steps_text = truncate_text(steps_text, GUIDE_TOKEN_BUDGET, label='steps')
+            prompt = SUMMARY_PROMPT.format(actions=self._actions_context(), steps=steps_text)
+            log_prompt_tokens("guide summary", prompt)
+            try:
+                with self._slot():
+                    response = self.model.generate_content(prompt)
+                title, introduction, conclusion = self._parse_summary(response.text, title)
+            except Exception as e:
+                logging.warning(f"Guide summary pass failed, keeping step text only: {e}")
+
+        guide_text = self._assemble(title, introduction, notes, conclusion)
+        with self._lock:
+            self._write_outputs(notes, guide_text, title)
+        return guide_text
+
+    def _actions_context(self, max_tokens=ACTIONS_TOKEN_BUDGET):
+        actions_path = os.path.join(self.scribble_dir, "actions.log")
+        if not os.path.exists(actions_path):
+            return ''
+        with open(actions_path, 'r', encoding='utf-8', errors='replace') as f:
+            actions = budget_actions(f.read(), max_tokens)
+        if not actions:
+            return ''
+        return f"\nUser actions during capture:\n{actions}\n"
+
+    @staticmethod
+    def _parse_summary(text, default_title):
+        fields = {'TITLE': default_title, 'INTRODUCTION': '', 'CONCLUSION': ''}
+        for line in text.splitlines():
+            line = line.strip().replace('**', '')
+            for field in fields:
+                if line.upper().startswith(field + ':'):
+                    fields[field] = line.split(':', 1)[1].strip() or fields[field]
+        return fields['TITLE'], fields['INTRODUCTION'], fields['CONCLUSION']
+
+    @staticmethod
+    def _assemble(title, introduction, notes, conclusion):
+        parts = [title, '']
+        if introduction:
+            parts += [introduction, '']
+        for note in notes:
+            parts += [f"Step {note['step']}: {note['note']}", '']
+        if conclusion:
+            parts.append(conclusion)
+        return '\n'.join(parts).strip() + '\n'
+
+    def _write_outputs(self, notes, guide_text, title=None):
+        with recording_lock(self.scribble_dir):
+            with open(os.path.join(self.scribble_dir, "transcript.txt"), 'w', encoding='utf-8') as f:
+                f.write(guide_text)
+            with open(os.path.join(self.scribble_dir, "notes.json"), 'w', encoding='utf-8') as f:
+                json.dump(notes, f, indent=2)
+            if title:
+                with open(os.path.join(self.scribble_dir, "title.txt"), 'w', encoding='utf-8') as f:
+                    f.write(title)
+
+
+class LiveGuideAnnotator:
+    """
+    Describes steps in the background while a screenshot session is recording.
+
+    Call notify() after each capture. One worker thread runs builder.update();
+    captures arriving while it is busy are picked up by one more pass, so
+    updates never pile up. The newest step waits for the next capture (or stop)
+    so its keystrokes are complete.
+
+    Args:
+        builder: IncrementalGuideBuilder for the recording
+        call_context: Optional callable returning a context manager the worker
+            runs each update in (e.g. AI ledger attribution)
+    """
+
+    def __init__(self, builder, call_context=None):
+        self.builder = builder
+        self.call_context = call_context or nullcontext
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = False
+        self._recording = True
+        self._described = 0
+        self._steps = 0
+        self._error = None
+
+    def notify(self, stopped=False):
+        """A screenshot was captured (or, with stopped=True, recording ended)"""
+        with self._lock:
+            if stopped:
+                self._recording = False
+            if self._thread and self._thread.is_alive():
+                self._pending = True
+                return
+            self._pending = False
+            self._thread = threading.Thread(target=self._run, daemon=True, name='live-annotation')
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                hold_last = self._recording
+            try:
+                with self.call_context():
+                    notes, _ = self.builder.update(hold_last=hold_last)
+                with self._lock:
+                    self._steps = len(notes)
+                    self._described = sum(1 for note in notes if note['note'])
+                    self._error = None
+            except Exception as e:
+                logging.warning(f"Live annotation update failed: {e}")
+                with self._lock:
+                    self._error = str(e)
+            with self._lock:
+                if not self._pending:
+                    return
+                self._pending = False
+
+    def finish(self, timeout=None):
+        """Wait for background updates to finish; returns False on timeout"""
+        while True:
+            with self._lock:
+                thread = self._thread
+            if thread is None or not thread.is_alive():
+                return True
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+
+    def status(self):
+        with self._lock:
+            return {
+                'recording': self._recording,
+                'running': bool(self._thread and self._thread.is_alive()),
+                'steps': self._steps,
+                'described': self._described,
+                'error': self._error
+            }
@@ -1,8 +1,58 @@
 import os
+import re
 import sys
+import math
+import time
+import wave
+import array
+import shutil
+import asyncio
+import hashlib
+import importlib.util
+import threading
+import functools
 import subprocess
 from pathlib import Path
 
+from shared.utils import ffmpeg_runner
+from shared.utils.keyframes import read_click_times, read_recording_start
+from shared.transcription.model_catalog import ModelCatalog
+
+DEFAULT_VOICE = "en-US-AriaNeural"
+DEFAULT_RATE = "+20%"
+
+# Chunks are synthesized concurrently, at most this many requests at a time
+TTS_MAX_CONCURRENT = 4
+# Paragraphs longer than this are split at sentence boundaries
+CHUNK_MAX_CHARS = 400
+
+TTS_CACHE_DIR = "tts_cache"
+
+# Backends tried in this order unless TTS_BACKENDS is set in config.txt
+DEFAULT_TTS_BACKENDS = "edge,gtts"
+# A backend that fails is skipped for this long (doubling while it keeps failing)
+TTS_FAILURE_COOLDOWN = 300
+
+# Each step's narration starts slightly before its click
+NARRATION_LEAD_SECONDS = 0.3
+# A step may be sped up at most this much to finish before the next step's click
+MAX_TIMELINE_TEMPO = 1.25
+# gTTS speaks slowly, so its audio is played 15% faster
+GTTS_TEMPO = 1.15
+
+_STEP_CHUNK = re.compile(r'^Step (\d+):')
+
+# The edge-tts voice list is fetched over the network, so it is cached on disk for a day
+VOICE_CACHE_FILE = "voices_cache.json"
+VOICE_CACHE_SECONDS = 86400
+
+# MPEG audio bitrates (kbps) for Layer III: MPEG-1, then MPEG-2/2.5
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
 def get_config_path():
     """Get the path to config.txt in a persistent location"""
     # If running as EXE, store config next to the executable
@@ -15,6 +65,18 @@ def get_config_path():
     
     return os.path.join(app_dir, "config.txt")
 
+def load_narration_config():
+    """Read KEY=value settings from config.txt"""
+    config = {}
+    config_path = get_config_path()
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            for line in f:
+                if '=' in line and not line.strip().startswith('#'):
+                    key, value = line.strip().split('=', 1)
+                    config[key] = value
+    return config
+
 def enhance_transcript_for_narration(transcript_text, scribble_dir):
     """
     Use AI to enhance the transcript into a proper narration script
@@ -39,12 +101,15 @@ def enhance_transcript_for_narration(transcript_text, scribble_dir):
             # Fallback to original transcript if no API key
             return transcript_text
         
-        # Read action logs if available
+        from shared.transcription.context_budget import (budget_actions, truncate_text, log_prompt_tokens,
+                                                         ACTIONS_TOKEN_BUDGET, TRANSCRIPT_TOKEN_BUDGET)
+        
+        # Read action logs if available, condensed and sampled to fit the prompt
         actions_log = ""
         actions_path = os.path.join(scribble_dir, "actions.log")
         if os.path.exists(actions_path):
-            with open(actions_path, 'r', encoding='utf-8') as f:
-                actions_log = f.read()
+            with open(actions_path, 'r', encoding='utf-8', errors='replace') as f:
+                actions_log = budget_actions(f.read(), ACTIONS_TOKEN_BUDGET)
         
         genai.configure(api_key=api_key)
         model = genai.GenerativeModel('gemini-2.0-flash-exp')
@@ -54,7 +119,7 @@ def enhance_transcript_for_narration(transcript_text, scribble_dir):
         prompt = f"""You are creating a professional video narration for a screen recording tutorial.
 
 Speech transcript (what was said during recording):
-{transcript_text}
+{truncate_text(transcript_text, TRANSCRIPT_TOKEN_BUDGET, label='transcript')}
 {actions_context}
 
 Create a narration script that:
@@ -67,6 +132,7 @@ Create a narration script that:
 Focus on VISUAL DESCRIPTION - what viewers see happening on screen, not just what was said.
 Keep it conversational and tutorial-style. Write ONLY the narration script."""
 
+        log_prompt_tokens('enhance_transcript_for_narration', prompt)
         response = model.generate_content(prompt)
         enhanced_text = response.text.strip()
         
@@ -76,14 +142,475 @@ Keep it conversational and tutorial-style. Write ONLY the narration script."""
         print(f"AI enhancement failed, using original transcript: {e}")
         return transcript_text
 
-def add_narration_to_video(scribble_dir, transcript_path=None, output_name="narrated_video.mp4"):
+def clean_narration_script(transcript_text):
+    """Strip markdown formatting and special characters so TTS reads plain sentences"""
+    narration_script = transcript_text
+    narration_script = re.sub(r'\*\*([^*]+)\*\*', r'\1', narration_script)  # Remove bold **text**
+    narration_script = re.sub(r'\*([^*]+)\*', r'\1', narration_script)      # Remove italic *text*
+    narration_script = re.sub(r'`([^`]+)`', r'\1', narration_script)        # Remove code `text`
+    narration_script = re.sub(r'#{1,6}\s+', '', narration_script)           # Remove headers ###
+    narration_script = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', narration_script)  # Remove links [text](url)
+    narration_script = re.sub(r'^\s*[-*+]\s+', '', narration_script, flags=re.MULTILINE)  # Remove bullet points
+    narration_script = re.sub(r'^\s*\d+\.\s+', '', narration_script, flags=re.MULTILINE)  # Remove numbered lists
+    
+    # Clean up extra whitespace
+    narration_script = re.sub(r'\n{3,}', '\n\n', narration_script)  # Max 2 newlines
+    return narration_script.strip()
+
+def split_narration_chunks(narration_script, max_chars=CHUNK_MAX_CHARS):
+    """
+    Split a narration script into chunks that are synthesized separately.
+    
+    Each paragraph (usually one guide step) is a chunk; long paragraphs are
+    split at sentence boundaries. Editing one step only changes its chunk.
+    """
+    chunks = []
+    for paragraph in re.split(r'\n\s*\n|\n(?=Step \d+:)', narration_script):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            chunks.append(paragraph)
+            continue
+        current = ''
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}".strip()
+        if current:
+            chunks.append(current)
+    return chunks
+
+class TTSBackend:
+    """
+    A text-to-speech engine. Subclasses implement synthesize(), a coroutine
+    that writes one chunk's audio to a file.
+    """
+    
+    name = 'base'
+    extension = 'mp3'
+    tempo = 1.0  # Playback speed applied when the audio is mixed into the video
+    
+    def is_available(self):
+        """True when the engine's module or program is installed"""
+        return True
+    
+    def cache_tag(self):
+        """Everything that changes how a chunk sounds (part of its cache key)"""
+        return self.name
+    
+    async def synthesize(self, text, path):
+        raise NotImplementedError
+
+class EdgeTTSBackend(TTSBackend):
+    """Microsoft Edge neural voices through edge-tts (online)"""
+    
+    name = 'edge'
+    
+    def __init__(self, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        self.voice = voice
+        self.rate = rate
+    
+    def is_available(self):
+        return importlib.util.find_spec('edge_tts') is not None
+    
+    def cache_tag(self):
+        return f"edge|{self.voice}|{self.rate}"
+    
+    async def synthesize(self, text, path):
+        import edge_tts
+        
+        await edge_tts.Communicate(text, self.voice, rate=self.rate).save(path)
+
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS through gTTS (online)"""
+    
+    name = 'gtts'
+    tempo = GTTS_TEMPO
+    
+    def __init__(self, lang='en', tld='com'):
+        self.lang = lang
+        self.tld = tld
+    
+    def is_available(self):
+        return importlib.util.find_spec('gtts') is not None
+    
+    def cache_tag(self):
+        return f"gtts|{self.lang}|{self.tld}"
+    
+    async def synthesize(self, text, path):
+        from gtts import gTTS
+        
+        # gTTS is blocking, so each chunk runs on a worker thread
+        tts = gTTS(text=text, lang=self.lang, slow=False, tld=self.tld)
+        await asyncio.get_running_loop().run_in_executor(None, tts.save, path)
+
+class LocalTTSBackend(TTSBackend):
+    """
+    Offline engine run as a subprocess, with text on stdin: espeak-ng (or
+    espeak) by default, or piper.
+    
+    Args:
+        command: Program name or path ('espeak-ng', 'espeak' or 'piper')
+        voice: espeak voice name, or the .onnx voice model for piper
+        words_per_minute: espeak speaking rate
+    """
+    
+    name = 'local'
+    extension = 'wav'
+    
+    def __init__(self, command='espeak-ng', voice='en-us', words_per_minute=175):
+        self.command = command
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+    
+    def _is_piper(self):
+        return 'piper' in os.path.basename(self.command).lower()
+    
+    def is_available(self):
+        return shutil.which(self.command) is not None or os.path.isfile(self.command)
+    
+    def cache_tag(self):
+        return f"local|{os.path.basename(self.command)}|{self.voice}|{self.words_per_minute}"
+    
+    async def synthesize(self, text, path):
+        if self._is_piper():
+            args = [self.command, '--model', self.voice, '--output_file', path]
+        else:
+            args = [self.command, '-v', self.voice, '-s', str(self.words_per_minute), '-w', path, '--stdin']
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+        )
+        _, stderr = await process.communicate(text.encode('utf-8'))
+        if process.returncode != 0:
+            raise RuntimeError(f"{os.path.basename(self.command)} failed: {stderr.decode('utf-8', 'replace')[-300:]}")
+
+class StubTTSBackend(TTSBackend):
+    """
+    Deterministic offline stand-in: a quiet tone whose length follows the text
+    (chars_per_second) and whose pitch depends on it. For tests and benchmarks.
+    """
+    
+    name = 'stub'
+    extension = 'wav'
+    
+    def __init__(self, chars_per_second=15.0, sample_rate=16000, latency=0.0):
+        self.chars_per_second = chars_per_second
+        self.sample_rate = sample_rate
+        self.latency = latency
+    
+    def cache_tag(self):
+        return f"stub|{self.chars_per_second}|{self.sample_rate}"
+    
+    async def synthesize(self, text, path):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        frame_count = int(len(text) / self.chars_per_second * self.sample_rate)
+        frequency = 200 + int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:4], 16) % 400
+        step = 2 * math.pi * frequency / self.sample_rate
+        samples = array.array('h', (int(3000 * math.sin(step * i)) for i in range(frame_count)))
+        with wave.open(path, 'wb') as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sample_rate)
+            out.writeframes(samples.tobytes())
+
+def create_tts_backend(name, config=None):
+    """Build a backend by name ('edge', 'gtts', 'local' or 'stub') from TTS_* settings"""
+    config = config or {}
+    if name == 'edge':
+        return EdgeTTSBackend(config.get('TTS_VOICE', DEFAULT_VOICE), config.get('TTS_RATE', DEFAULT_RATE))
+    if name == 'gtts':
+        return GTTSBackend(config.get('TTS_GTTS_LANG', 'en'))
+    if name == 'local':
+        return LocalTTSBackend(config.get('TTS_LOCAL_COMMAND', 'espeak-ng'), config.get('TTS_LOCAL_VOICE', 'en-us'),
+                               int(config.get('TTS_LOCAL_WPM', 175)))
+    if name == 'stub':
+        return StubTTSBackend()
+    raise ValueError(f"Unknown TTS backend: {name}")
+
+class TTSBackendChain:
+    """
+    TTS backends in order of preference, with health-based failover.
+    
+    A backend that fails is skipped for `cooldown` seconds (doubling while it
+    keeps failing, up to an hour) and the next one is used; once the cooldown
+    runs out it is tried first again. Uninstalled backends are skipped.
+    """
+    
+    def __init__(self, backends, cooldown=TTS_FAILURE_COOLDOWN):
+        self.backends = list(backends)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._health = {b.name: {'failures': 0, 'skip_until': 0, 'last_error': None} for b in self.backends}
+    
+    def candidates(self):
+        """Installed backends to try, healthy ones first in configured order"""
+        now = time.time()
+        with self._lock:
+            installed = [b for b in self.backends if b.is_available()]
+            healthy = [b for b in installed if self._health[b.name]['skip_until'] <= now]
+            resting = sorted((b for b in installed if self._health[b.name]['skip_until'] > now),
+                             key=lambda b: self._health[b.name]['skip_until'])
+        # Backends in cooldown are still a last resort
+        return healthy + resting
+    
+    def record_success(self, backend):
+        with self._lock:
+            self._health[backend.name].update(failures=0, skip_until=0, last_error=None)
+    
+    def record_failure(self, backend, error):
+        with self._lock:
+            health = self._health[backend.name]
+            health['failures'] += 1
+            health['last_error'] = str(error)[:200]
+            health['skip_until'] = time.time() + min(self.cooldown * 2 ** (health['failures'] - 1), 3600)
+    
+    def status(self):
+        now = time.time()
+        with self._lock:
+            return [{
+                'name': b.name,
+                'installed': b.is_available(),
+                'healthy': self._health[b.name]['skip_until'] <= now,
+                'failures': self._health[b.name]['failures'],
+                'last_error': self._health[b.name]['last_error']
+            } for b in self.backends]
+
+_backend_chains = {}
+_backend_chains_lock = threading.Lock()
+
+def get_tts_backends(config=None):
     """
-    Generate AI narration from transcript and merge with video using FFmpeg and edge-tts
+    Backend chain from TTS_BACKENDS (comma-separated, default "edge,gtts"),
+    created once per distinct TTS_* settings so health carries across calls.
+    
+    Args:
+        config: Settings dict; read from config.txt when None
+    """
+    config = load_narration_config() if config is None else config
+    settings = tuple(sorted((k, v) for k, v in config.items() if k.startswith('TTS_')))
+    with _backend_chains_lock:
+        if settings not in _backend_chains:
+            names = [n.strip().lower() for n in config.get('TTS_BACKENDS', DEFAULT_TTS_BACKENDS).split(',') if n.strip()]
+            _backend_chains[settings] = TTSBackendChain([create_tts_backend(name, config) for name in names])
+        return _backend_chains[settings]
+
+def chunk_cache_path(cache_dir, backend, text):
+    """Cache file for one chunk's audio, keyed by the backend's settings and the text"""
+    key = hashlib.sha256(f"{backend.cache_tag()}\n{text}".encode('utf-8')).hexdigest()[:24]
+    return os.path.join(cache_dir, f"{backend.name}_{key}.{backend.extension}")
+
+async def _synthesize_chunks(backend, chunks, cache_dir, max_concurrent):
+    """Synthesize chunks concurrently; returns (path, cached) per chunk, repeated texts synthesized once"""
+    semaphore = asyncio.Semaphore(max_concurrent)
+    
+    async def synthesize(text):
+        path = chunk_cache_path(cache_dir, backend, text)
+        if os.path.exists(path):
+            return path, True
+        async with semaphore:
+            temp_path = path + '.part'
+            await backend.synthesize(text, temp_path)
+            os.replace(temp_path, path)
+        return path, False
+    
+    # Repeated texts ("Click Next.") share a cache file, so only one task may write it
+    unique = list(dict.fromkeys(chunks))
+    results = dict(zip(unique, await asyncio.gather(*(synthesize(text) for text in unique))))
+    return [results[text] for text in chunks]
+
+def audio_duration(path):
+    """Duration in seconds of a WAV or MP3 file"""
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as audio:
+            return audio.getnframes() / float(audio.getframerate())
+    return mp3_duration(path)
+
+def mp3_duration(path):
+    """Duration in seconds of an MP3 file, from its frame headers (no FFmpeg call)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos, duration = 0, 0.0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        pos = 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+            pos += 1
+            continue
+        version_bits = (data[pos + 1] >> 3) & 0x03
+        layer_bits = (data[pos + 1] >> 1) & 0x03
+        bitrate_index = data[pos + 2] >> 4
+        rate_index = (data[pos + 2] >> 2) & 0x03
+        padding = (data[pos + 2] >> 1) & 0x01
+        if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1  # Not a Layer III frame header
+            continue
+        mpeg1 = version_bits == 3
+        bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version_bits][rate_index]
+        samples = 1152 if mpeg1 else 576
+        duration += samples / sample_rate
+        pos += samples // 8 * bitrate // sample_rate + padding
+    return duration
+
+def plan_narration_timeline(chunks, durations, click_times, tempo=1.0):
+    """
+    Place narration chunks on the video timeline.
+    
+    A chunk starting with "Step N:" is placed just before click N; other chunks
+    (introduction, the rest of a long step, conclusion) follow the chunk before
+    them. Nothing overlaps: a step that can't start on time starts when the
+    previous one ends. A step that would run past the next step's click is sped
+    up, at most to MAX_TIMELINE_TEMPO.
+    
+    Args:
+        chunks: Chunk texts, in narration order
+        durations: Audio duration of each chunk (seconds at normal speed)
+        click_times: Click times in seconds from the start of the video
+        tempo: Base playback speed for every chunk (e.g. GTTS_TEMPO)
+    
+    Returns:
+        One dict per chunk: offset (seconds into the joined narration audio),
+        duration, delay (video time it starts at) and tempo
+    """
+    anchors = []
+    for text in chunks:
+        match = _STEP_CHUNK.match(text)
+        step = int(match.group(1)) if match else 0
+        anchors.append(max(0.0, click_times[step - 1] - NARRATION_LEAD_SECONDS)
+                       if 0 < step <= len(click_times) else None)
+    
+    placements = []
+    offset, cursor = 0.0, 0.0
+    for i, duration in enumerate(durations):
+        start = max(anchors[i] if anchors[i] is not None else cursor, cursor)
+        # Time until the next anchored chunk, minus the unanchored chunks in between
+        chunk_tempo = tempo
+        following = 0.0
+        for j in range(i + 1, len(chunks)):
+            if anchors[j] is not None:
+                available = anchors[j] - start - following
+                if available > 0 and duration / tempo > available:
+                    chunk_tempo = min(MAX_TIMELINE_TEMPO, duration / available)
+                break
+            following += durations[j] / tempo
+        placements.append({'offset': offset, 'duration': duration, 'delay': start, 'tempo': chunk_tempo})
+        offset += duration
+        cursor = start + duration / chunk_tempo
+    return placements
+
+def build_timeline_filter(placements, volume=2.0):
+    """
+    filter_complex graph that cuts each chunk out of the joined narration audio
+    (input 1), delays it to its place on the timeline and mixes them into [aout]
+    """
+    count = len(placements)
+    parts = [f"[1:a]asplit={count}" + ''.join(f"[s{i}]" for i in range(count))]
+    for i, placement in enumerate(placements):
+        chain = (f"[s{i}]atrim=start={placement['offset']:.3f}:end={placement['offset'] + placement['duration']:.3f},"
+                 f"asetpts=PTS-STARTPTS")
+        if abs(placement['tempo'] - 1.0) > 0.001:
+            chain += f",atempo={placement['tempo']:.3f}"
+        delay_ms = int(round(placement['delay'] * 1000))
+        chain += f",adelay={delay_ms}|{delay_ms}[d{i}]"
+        parts.append(chain)
+    inputs = ''.join(f"[d{i}]" for i in range(count))
+    parts.append(f"{inputs}amix=inputs={count}:normalize=0:dropout_transition=0,volume={volume},apad[aout]")
+    return ';'.join(parts)
+
+_PCM_FORMATS = {1: 'u8', 2: 's16le', 4: 's32le'}
+
+def chunk_input_args(chunk_paths):
+    """
+    FFmpeg input options for chunk audio fed through stdin by stream_chunks():
+    MP3 frames as-is, WAV chunks as raw PCM in the first chunk's format
+    """
+    if not chunk_paths[0].lower().endswith('.wav'):
+        return ["-f", "mp3", "-i", "pipe:0"]
+    with wave.open(chunk_paths[0], 'rb') as chunk:
+        return ["-f", _PCM_FORMATS[chunk.getsampwidth()], "-ar", str(chunk.getframerate()),
+                "-ac", str(chunk.getnchannels()), "-i", "pipe:0"]
+
+def stream_chunks(chunk_paths, pipe):
+    """Write chunk audio to FFmpeg's stdin in order, then close it"""
+    try:
+        for path in chunk_paths:
+            if path.lower().endswith('.wav'):
+                with wave.open(path, 'rb') as chunk:
+                    pipe.write(chunk.readframes(chunk.getnframes()))
+            else:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, pipe)
+    except (BrokenPipeError, OSError):
+        # FFmpeg stopped reading; its exit code and stderr say why
+        pass
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+def synthesize_narration(narration_script, cache_dir, backends=None, max_concurrent=TTS_MAX_CONCURRENT):
+    """
+    Synthesize a narration script chunk by chunk, reusing cached chunk audio.
+    
+    Backends are tried in order (see TTSBackendChain); every chunk comes from
+    the same backend so the chunks stream into FFmpeg as one format.
+    
+    Args:
+        narration_script: Cleaned script text
+        cache_dir: Folder holding per-chunk audio
+        backends: TTSBackendChain (default: get_tts_backends())
+        max_concurrent: Chunks synthesized at the same time
+    
+    Returns:
+        (backend, chunks) - backend used and (text, audio path) for each chunk in order
+    """
+    chunks = split_narration_chunks(narration_script)
+    if not chunks:
+        raise ValueError("Narration script is empty")
+    os.makedirs(cache_dir, exist_ok=True)
+    backends = backends or get_tts_backends()
+    
+    candidates = backends.candidates()
+    if not candidates:
+        names = ', '.join(b.name for b in backends.backends)
+        raise ImportError(f"No TTS backend installed (tried {names}); edge_tts not found. Install with: pip install edge-tts")
+    
+    errors = []
+    for backend in candidates:
+        try:
+            results = asyncio.run(_synthesize_chunks(backend, chunks, cache_dir, max_concurrent))
+        except Exception as tts_error:
+            # Fall back to the next backend and rest this one for a while
+            print(f"{backend.name} TTS error: {tts_error}")
+            backends.record_failure(backend, tts_error)
+            errors.append(f"{backend.name}: {tts_error}")
+            continue
+        backends.record_success(backend)
+        
+        reused = sum(1 for _, cached in results if cached)
+        print(f"✓ Narration audio generated with {backend.name}: {len(chunks)} chunks ({reused} from cache)")
+        return backend, [(text, path) for text, (path, _) in zip(chunks, results)]
+    
+    raise RuntimeError(f"All TTS backends failed: {'; '.join(errors)}")
+
+def add_narration_to_video(scribble_dir, transcript_path=None, output_name="narrated_video.mp4", config=None):
+    """
+    Generate AI narration from transcript and merge with video using FFmpeg and a TTS backend
     
     Args:
         scribble_dir: Directory containing recording.mp4 and transcript.txt
         transcript_path: Path to transcript file (optional, defaults to scribble_dir/transcript.txt)
         output_name: Name for the output narrated video file
+        config: Settings with the TTS_* keys (optional, defaults to config.txt)
     
     Returns:
         Path to the narrated video file
@@ -104,101 +631,57 @@ def add_narration_to_video(scribble_dir, transcript_path=None, output_name="narr
         raise ValueError("Transcript is empty")
     
     # Clean up markdown formatting and special characters for TTS
-    import re
-    
-    # Remove markdown formatting
-    narration_script = transcript_text
-    narration_script = re.sub(r'\*\*([^*]+)\*\*', r'\1', narration_script)  # Remove bold **text**
-    narration_script = re.sub(r'\*([^*]+)\*', r'\1', narration_script)      # Remove italic *text*
-    narration_script = re.sub(r'`([^`]+)`', r'\1', narration_script)        # Remove code `text`
-    narration_script = re.sub(r'#{1,6}\s+', '', narration_script)           # Remove headers ###
-    narration_script = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', narration_script)  # Remove links [text](url)
-    narration_script = re.sub(r'^\s*[-*+]\s+', '', narration_script, flags=re.MULTILINE)  # Remove bullet points
-    narration_script = re.sub(r'^\s*\d+\.\s+', '', narration_script, flags=re.MULTILINE)  # Remove numbered lists
-    
-    # Clean up extra whitespace
-    narration_script = re.sub(r'\n{3,}', '\n\n', narration_script)  # Max 2 newlines
-    narration_script = narration_script.strip()
+    narration_script = clean_narration_script(transcript_text)
     
     print(f"Cleaned narration script: {narration_script[:150]}...")
     
     # Paths
     video_path = os.path.join(scribble_dir, "recording.mp4")
-    narration_audio_path = os.path.join(scribble_dir, "narration.mp3")
     output_video_path = os.path.join(scribble_dir, output_name)
     
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video not found at {video_path}")
     
-    # Generate narration audio using edge-tts (Microsoft Edge TTS - free and high quality)
-    try:
-        import edge_tts
-        import asyncio
-        
-        print("✓ edge-tts module imported successfully")
-        
-        async def generate_audio():
-            # Use natural voice with faster speaking rate
-            # en-US-AriaNeural (female), en-US-GuyNeural (male), en-US-JennyNeural (female)
-            # Add rate parameter: +20% faster for more natural pacing
-            communicate = edge_tts.Communicate(
-                narration_script, 
-                "en-US-AriaNeural",
-                rate="+20%"
-            )
-            await communicate.save(narration_audio_path)
-        
-        try:
-            asyncio.run(generate_audio())
-            print(f"✓ Narration audio generated with edge-tts: {narration_audio_path}")
-        except Exception as tts_error:
-            # If edge-tts fails, try gTTS with faster speed
-            error_msg = str(tts_error).lower()
-            print(f"edge-tts error: {tts_error}")
-            if "401" in error_msg or "invalid response" in error_msg or "wss://" in error_msg:
-                print("Falling back to gTTS due to edge-tts connection error...")
-                try:
-                    from gtts import gTTS
-                    # Use gTTS with slower=False for faster, more natural speech
-                    tts = gTTS(text=narration_script, lang='en', slow=False, tld='com')
-                    tts.save(narration_audio_path)
-                    print(f"✓ Narration audio generated with gTTS (fallback): {narration_audio_path}")
-                    
-                    # Speed up the audio by 15% using FFmpeg
-                    temp_path = narration_audio_path.replace(".mp3", "_temp.mp3")
-                    os.rename(narration_audio_path, temp_path)
-                    
-                    ffmpeg_path_local = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ffmpeg", "bin", "ffmpeg.exe")
-                    subprocess.run([
-                        ffmpeg_path_local,
-                        "-i", temp_path,
-                        "-filter:a", "atempo=1.15",  # Speed up 15%
-                        "-y",
-                        narration_audio_path
-                    ], capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-                    
-                    os.remove(temp_path)
-                except ImportError as gtts_err:
-                    raise ImportError(f"Both edge-tts and gTTS failed. gTTS error: {gtts_err}. Install gTTS: pip install gtts")
-            else:
-                raise tts_error
-        
-    except ImportError as import_err:
-        raise ImportError(f"edge-tts module not found: {import_err}. Install with: pip install edge-tts")
+    # Generate narration audio with the first healthy TTS backend (edge-tts by default),
+    # one chunk per step/paragraph, cached so an edit only re-synthesizes the changed chunks
+    # en-US-AriaNeural (female), en-US-GuyNeural (male), en-US-JennyNeural (female); +20% for natural pacing
+    backend, chunks = synthesize_narration(
+        narration_script,
+        os.path.join(scribble_dir, TTS_CACHE_DIR),
+        backends=get_tts_backends(config)
+    )
+    
+    # Place each step's audio at its click when the recording has click timestamps
+    click_times = read_click_times(os.path.join(scribble_dir, "actions.log"), read_recording_start(scribble_dir))
+    timeline_filter = None
+    if click_times and any(_STEP_CHUNK.match(text) for text, _ in chunks):
+        placements = plan_narration_timeline(
+            [text for text, _ in chunks],
+            [audio_duration(path) for _, path in chunks],
+            click_times,
+            tempo=backend.tempo
+        )
+        timeline_filter = build_timeline_filter(placements)
+        print(f"✓ Narration aligned to {len(click_times)} clicks ({len(placements)} chunks)")
+    
+    if timeline_filter is None:
+        # Continuous narration: speed up (gTTS) and boost volume 2x, padded to the video length
+        tempo = f"atempo={backend.tempo}," if backend.tempo != 1.0 else ""
+        timeline_filter = f"[1:a]{tempo}volume=2.0,apad[aout]"
     
-    # Get video duration to check if we need to adjust narration speed
     ffmpeg_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ffmpeg", "bin", "ffmpeg.exe")
+    chunk_paths = [path for _, path in chunks]
     
-    # Merge narration with video
-    # Strategy: Add narration audio to video with volume boost
+    # Merge narration with video in one pass: the cached chunks stream into FFmpeg's stdin,
+    # and tempo, volume, padding (or the timeline placement) and muxing all happen here,
+    # so no joined or sped-up narration file is written
     try:
-        # Try adding audio with volume normalization
-        result = subprocess.run(
+        ffmpeg_runner.run(
             [
                 ffmpeg_path,
                 "-i", video_path,
-                "-i", narration_audio_path,
-                "-filter_complex", "[1:a]volume=2.0[narr];[narr]apad[aout]",  # Boost volume 2x and pad
+                *chunk_input_args(chunk_paths),
+                "-filter_complex", timeline_filter,
                 "-map", "0:v",
                 "-map", "[aout]",
                 "-c:v", "copy",
@@ -208,63 +691,99 @@ def add_narration_to_video(scribble_dir, transcript_path=None, output_name="narr
                 "-y",
                 output_video_path
             ],
-            capture_output=True,
-            text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+            stdin=lambda pipe: stream_chunks(chunk_paths, pipe)
         )
         
-        if result.returncode != 0:
-            # Fallback: simple audio replacement
-            result = subprocess.run(
-                [
-                    ffmpeg_path,
-                    "-i", video_path,
-                    "-i", narration_audio_path,
-                    "-map", "0:v",
-                    "-map", "1:a",
-                    "-c:v", "copy",
-                    "-c:a", "aac",
-                    "-b:a", "192k",
-                    "-shortest",
-                    "-y",
-                    output_video_path
-                ],
-                capture_output=True,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-            )
-        
-        if result.returncode != 0:
-            raise Exception(f"FFmpeg error: {result.stderr}")
-        
         return output_video_path
         
     except Exception as e:
         raise Exception(f"Failed to merge narration with video: {str(e)}")
 
 
-def list_available_voices():
-    """List all available edge-tts voices"""
-    try:
-        import edge_tts
-        import asyncio
-        
-        async def get_voices():
-            voices = await edge_tts.list_voices()
-            return voices
-        
-        voices = asyncio.run(get_voices())
-        
-        # Filter to English voices
-        en_voices = [v for v in voices if v['Locale'].startswith('en-')]
-        
-        return [
-            {
-                'name': v['ShortName'],
-                'gender': v['Gender'],
-                'locale': v['Locale']
-            }
-            for v in en_voices
-        ]
-    except ImportError:
-        return []
+def fetch_edge_voices():
+    """Fetch the English edge-tts voices (network call)"""
+    import edge_tts
+    
+    voices = asyncio.run(edge_tts.list_voices())
+    return [
+        {
+            'name': v['ShortName'],
+            'gender': v['Gender'],
+            'locale': v['Locale'],
+            'backend': 'edge'
+        }
+        for v in voices if v['Locale'].startswith('en-')
+    ]
+
+@functools.lru_cache(maxsize=8)
+def _espeak_voices(command):
+    """English voices reported by espeak / espeak-ng (run once per command)"""
+    result = subprocess.run([command, '--voices=en'], capture_output=True, text=True, timeout=10,
+                            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+    voices = []
+    # Columns: Pty Language Age/Gender VoiceName File [Other Languages]
+    for line in result.stdout.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) >= 4:
+            gender = {'M': 'Male', 'F': 'Female'}.get(parts[2].split('/')[-1], '')
+            voices.append({'name': parts[1], 'gender': gender, 'locale': parts[1],
+                           'display_name': parts[3].replace('_', ' '), 'backend': 'local'})
+    return tuple(voices)
+
+def offline_voices(config=None):
+    """
+    Voices of the offline backends, found without network access: the local
+    engine's voices (espeak voices, or the piper .onnx models next to
+    TTS_LOCAL_VOICE) and the stub
+    """
+    local = create_tts_backend('local', config)
+    voices = []
+    if local.is_available():
+        try:
+            if local._is_piper():
+                model_dir = os.path.dirname(os.path.abspath(local.voice))
+                for filename in sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []:
+                    if filename.endswith('.onnx'):
+                        # Piper models are named like en_US-lessac-medium.onnx
+                        locale = filename.split('-', 1)[0].replace('_', '-')
+                        voices.append({'name': os.path.join(model_dir, filename), 'gender': '', 'locale': locale,
+                                       'display_name': filename[:-5], 'backend': 'local'})
+            else:
+                voices.extend(dict(v) for v in _espeak_voices(local.command))
+        except Exception as e:
+            print(f"Could not list {local.command} voices: {e}")
+    voices.append({'name': 'stub', 'gender': '', 'locale': 'en-US', 'display_name': 'Test tone', 'backend': 'stub'})
+    return voices
+
+_voice_catalog = None
+_voice_catalog_lock = threading.Lock()
+
+def get_voice_catalog():
+    """Voice catalog cached next to config.txt (the web app keeps its own next to the log file)"""
+    global _voice_catalog
+    with _voice_catalog_lock:
+        if _voice_catalog is None:
+            _voice_catalog = ModelCatalog(os.path.join(os.path.dirname(get_config_path()), VOICE_CACHE_FILE),
+                                          fetch_edge_voices, ttl=VOICE_CACHE_SECONDS, label='Voice list')
+        return _voice_catalog
+
+def list_available_voices(config=None, catalog=None):
+    """
+    List narration voices: edge-tts voices from the on-disk catalog, then the
+    offline backends' voices. A stale catalog is returned immediately and
+    refreshed in the background; only a cold cache waits for the network.
+    
+    Args:
+        config: Settings with the TTS_* keys (optional, defaults to config.txt)
+        catalog: ModelCatalog holding the edge-tts voices (default: get_voice_catalog())
+    
+    Returns:
+        (voices, info) - list of dicts with name, gender, locale and backend;
+        info has 'cached', 'stale' and 'fetched_at' for the edge-tts list
+    """
+    config = load_narration_config() if config is None else config
+    voices, info = [], {'cached': False, 'stale': False, 'fetched_at': None}
+    if EdgeTTSBackend().is_available():
+        voices, info = (catalog or get_voice_catalog()).get('edge')
+        voices = voices or []
+    return voices + offline_voices(config), info
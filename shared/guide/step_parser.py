@@ -0,0 +1,105 @@
+"""
+Parse AI guide text into per-step notes
+
+The parser is incremental: feed() it text as it arrives from a streaming
+model response and it returns each step as soon as the next "Step N:"
+header (or the end of the text) shows that the step is complete.
+"""
+
+
+class StepParser:
+    """Incrementally split guide text into notes.json step entries"""
+
+    def __init__(self, step_type='screenshot'):
+        self.step_type = step_type
+        self.text = ''
+        self._pending = ''
+        self._current_step = 0
+        self._current_note = []
+
+    def feed(self, chunk):
+        """
+        Add a chunk of guide text.
+
+        Args:
+            chunk: Next piece of text from the model
+
+        Returns:
+            List of step notes completed by this chunk (may be empty)
+        """
+        self.text += chunk
+        self._pending += chunk
+        completed = []
+        # Only whole lines are parsed; the trailing partial line waits for more text
+        while '\n' in self._pending:
+            line, self._pending = self._pending.split('\n', 1)
+            note = self._parse_line(line)
+            if note:
+                completed.append(note)
+        return completed
+
+    def finish(self):
+        """
+        Flush the remaining text at the end of the response.
+
+        Returns:
+            List of the final step notes (may be empty)
+        """
+        completed = []
+        if self._pending:
+            note = self._parse_line(self._pending)
+            self._pending = ''
+            if note:
+                completed.append(note)
+        note = self._close_step()
+        if note:
+            completed.append(note)
+        return completed
+
+    def _parse_line(self, line):
+        line_stripped = line.strip()
+        # Remove markdown bold markers and headers
+        line_clean = line_stripped.replace('**', '').lstrip('#').strip()
+
+        # Check if this is a step header (e.g., "Step 1:", "### Step 2:", etc.)
+        if line_clean.startswith('Step ') and ':' in line_clean:
+            # A new header completes the previous step
+            completed = self._close_step()
+            self._current_step += 1
+            # Keep the step line without the "Step X:" prefix
+            self._current_note.append(line_clean.split(':', 1)[1].strip())
+            return completed
+
+        # Skip horizontal rules (---) and image references (![...)
+        if self._current_step > 0 and line_stripped and not line_stripped.startswith('---') and not line_stripped.startswith('!['):
+            if line_clean:
+                self._current_note.append(line_clean)
+        return None
+
+    def _close_step(self):
+        note = None
+        if self._current_note and self._current_step > 0:
+            note = {
+                'step': str(self._current_step),
+                'note': '\n'.join(self._current_note).strip(),
+                'type': self.step_type
+            }
+        self._current_note = []
+        return note
+
+
+def parse_guide_notes(guide_text, step_type='screenshot'):
+    """Parse a complete guide into notes.json step entries"""
+    parser = StepParser(step_type)
+    notes = parser.feed(guide_text)
+    notes.extend(parser.finish())
+    return notes
+
+
+def extract_guide_title(guide_text, default="How-To Guide"):
+    """Take the guide title from the first lines of the guide"""
+    for line in guide_text.split('\n')[:5]:  # Check first 5 lines
+        line_clean = line.strip().lstrip('#').strip()
+        if line_clean and not line_clean.startswith('Welcome') and not line_clean.startswith('This guide'):
+            return line_clean
+    return default
@@ -0,0 +1,157 @@
+"""
+Schema-constrained guide output
+
+Models that support JSON mode are asked for the guide as an object
+(title, introduction, steps with the screenshot they describe, conclusion)
+so notes.json, title.txt and guide.txt are built directly from fields
+instead of scanning free text for "Step N:" lines. parse_structured_guide()
+is tolerant of code fences and surrounding prose and returns None when the
+response isn't a usable guide, so callers can fall back to StepParser.
+"""
+import os
+import json
+import logging
+
+# Gemini response_schema (OpenAPI subset)
+GUIDE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'title': {'type': 'STRING'},
+        'introduction': {'type': 'STRING'},
+        'steps': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'screenshot': {'type': 'INTEGER'},
+                    'instruction': {'type': 'STRING'}
+                },
+                'required': ['screenshot', 'instruction']
+            }
+        },
+        'conclusion': {'type': 'STRING'}
+    },
+    'required': ['title', 'introduction', 'steps', 'conclusion']
+}
+
+STRUCTURED_GUIDE_PROMPT = """You are analyzing {screenshot_count} screenshots to create a professional step-by-step how-to guide.
+
+Carefully examine each screenshot image and return the guide as JSON with:
+- "title": a clear, engaging title for the tutorial based on what you see
+- "introduction": 2-3 sentences explaining what will be accomplished
+- "steps": one entry per screenshot, in order, each with
+  - "screenshot": the 1-based number of the screenshot the step describes
+  - "instruction": 2-4 sentences that describe exactly what you SEE, name the specific UI elements
+    (buttons, menus, text fields, window titles), state the action to take ("Click on...", "Type in...",
+    "Select...") and explain WHY the step matters. Do not start with "Step N:"
+- "conclusion": 1-2 sentences of wrap-up or next steps
+
+Write in a natural, human-like style - as if an expert is explaining this to a colleague while showing them the screenshots. Be clear, educational, and encouraging.
+
+IMPORTANT: Return ONLY the JSON object. Do NOT include any meta-commentary."""
+
+
+def guide_generation_config():
+    """generation_config that asks the model for GUIDE_SCHEMA JSON"""
+    return {
+        'response_mime_type': 'application/json',
+        'response_schema': GUIDE_SCHEMA
+    }
+
+
+def is_schema_unsupported_error(error_msg):
+    """True when a model rejected JSON mode / response_schema rather than the request itself"""
+    lowered = error_msg.lower()
+    return any(marker in lowered for marker in (
+        'response_schema', 'response_mime_type', 'json mode is not enabled', 'responseschema'
+    ))
+
+
+def _clean_text(value):
+    return value.strip() if isinstance(value, str) else ''
+
+
+def parse_structured_guide(text, screenshot_count=None):
+    """
+    Parse a JSON guide response.
+
+    Args:
+        text: Model response text
+        screenshot_count: Number of screenshots sent; out-of-range indexes fall back to step order
+
+    Returns:
+        Dict with title, introduction, steps [{screenshot, instruction}] and conclusion,
+        or None if the text isn't a usable guide
+    """
+    text = (text or '').strip()
+    if text.startswith('```'):
+        # ```json ... ``` from models that ignore the mime type
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError as e:
+        logging.warning(f"Structured guide is not valid JSON: {e}")
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('steps'), list):
+        return None
+
+    steps = []
+    for position, step in enumerate(data['steps'], 1):
+        if isinstance(step, str):
+            step = {'instruction': step}
+        if not isinstance(step, dict):
+            continue
+        instruction = _clean_text(step.get('instruction') or step.get('text'))
+        if not instruction:
+            continue
+        try:
+            screenshot = int(step.get('screenshot'))
+        except (TypeError, ValueError):
+            screenshot = position
+        if screenshot < 1 or (screenshot_count and screenshot > screenshot_count):
+            screenshot = position
+        steps.append({'screenshot': screenshot, 'instruction': instruction})
+    if not steps:
+        return None
+
+    return {
+        'title': _clean_text(data.get('title')),
+        'introduction': _clean_text(data.get('introduction')),
+        'steps': steps,
+        'conclusion': _clean_text(data.get('conclusion'))
+    }
+
+
+def structured_guide_notes(guide, screenshot_files=None, step_type='screenshot'):
+    """
+    notes.json entries for a parsed guide.
+
+    Args:
+        guide: Result of parse_structured_guide()
+        screenshot_files: Screenshot paths in the order they were sent, so each note
+            can name its file; None when the images weren't files (video keyframes)
+    """
+    notes = []
+    for number, step in enumerate(guide['steps'], 1):
+        note = {'step': str(number), 'note': step['instruction'], 'type': step_type}
+        index = step['screenshot'] - 1
+        if screenshot_files and 0 <= index < len(screenshot_files):
+            note['file'] = os.path.basename(screenshot_files[index])
+        notes.append(note)
+    return notes
+
+
+def render_guide_text(guide, default_title="How-To Guide"):
+    """guide.txt text in the same "Step N:" layout as free-text guides"""
+    parts = [f"# {guide['title'] or default_title}", '']
+    if guide['introduction']:
+        parts += [guide['introduction'], '']
+    for number, step in enumerate(guide['steps'], 1):
+        parts += [f"Step {number}: {step['instruction']}", '']
+    if guide['conclusion']:
+        parts.append(guide['conclusion'])
+    return '\n'.join(parts).strip()
@@ -1,6 +1,9 @@
 import subprocess
 import os
 import re
+
+from shared.utils import ffmpeg_runner
+
 audio_process = None
 selected_audio_device = None
 
@@ -22,13 +25,11 @@ def list_audio_devices():
     """Get list of available audio devices"""
     ffmpeg_cmd = get_ffmpeg_path()
     try:
-        result = subprocess.run(
+        # Exits with an error by design ("dummy" input); the device list is on stderr
+        result = ffmpeg_runner.run(
             [ffmpeg_cmd, "-list_devices", "true", "-f", "dshow", "-i", "dummy"],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='ignore',
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+            check=False,
+            timeout=15
         )
         output = result.stderr
         
@@ -57,22 +58,12 @@ def start_audio_recording(output="assets/audio.wav"):
     
     ffmpeg_cmd = get_ffmpeg_path()
     command = [ffmpeg_cmd, "-y", "-f", "dshow", "-i", f"audio={selected_audio_device}", output]
-    # Hide console window on Windows
-    creation_flags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-    audio_process = subprocess.Popen(command, stdin=subprocess.PIPE, creationflags=creation_flags)
+    audio_process = ffmpeg_runner.start(command, priority=ffmpeg_runner.LIVE, stdin=subprocess.PIPE)
 
 def stop_audio_recording():
     global audio_process
     if audio_process:
         try:
-            audio_process.stdin.write(b'q')
-            audio_process.stdin.close()
-            audio_process.wait(timeout=5)
-        except:
-            try:
-                audio_process.terminate()
-                audio_process.wait(timeout=2)
-            except:
-                audio_process.kill()
+            audio_process.stop(timeout=5)
         finally:
             audio_process = None
@@ -31,6 +31,7 @@ def start_logging(output="assets/actions.log", screenshot_dir_path="assets", cli
     # Create log file
     with open(log_file, "w") as f:
         f.write(f"# Actions Log - {time.ctime()}\n")
+        f.write(f"# Started at {time.time()}\n")
     
     listener_mouse = mouse.Listener(on_click=on_click)
     listener_keyboard = keyboard.Listener(on_press=on_key)
@@ -1,7 +1,11 @@
 import subprocess
 import os
+import json
+import time
 import logging
 
+from shared.utils import ffmpeg_runner
+
 ffmpeg_process = None
 region = None
 
@@ -122,20 +126,23 @@ def start_screen_recording(output="assets/recording.mp4", full_screen=True):
         ffmpeg_log = os.path.join(log_dir, "ffmpeg_output.log")
         logging.info(f"FFmpeg output will be logged to: {ffmpeg_log}")
         
-        # Hide console window on Windows
-        creation_flags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-        
-        # Open stdin as PIPE so we can send 'q' to stop gracefully
-        with open(ffmpeg_log, 'w') as log_file:
-            ffmpeg_process = subprocess.Popen(
-                command, 
-                stdin=subprocess.PIPE, 
-                stderr=log_file, 
-                stdout=log_file, 
-                creationflags=creation_flags
-            )
+        # Live capture starts immediately and takes precedence over queued FFmpeg work;
+        # stdin is a pipe so we can send 'q' to stop gracefully
+        ffmpeg_process = ffmpeg_runner.start(
+            command,
+            priority=ffmpeg_runner.LIVE,
+            stdin=subprocess.PIPE,
+            log_path=ffmpeg_log
+        )
         
         logging.info(f"FFmpeg process started with PID: {ffmpeg_process.pid}")
+        
+        # Record when capture began so actions.log clicks can be mapped to video time
+        try:
+            with open(os.path.join(log_dir, "recording_meta.json"), 'w') as meta_file:
+                json.dump({'started_at': time.time()}, meta_file)
+        except Exception as e:
+            logging.warning(f"Could not write recording metadata: {e}")
     except Exception as e:
         logging.error(f"Failed to start FFmpeg: {e}", exc_info=True)
         raise
@@ -145,25 +152,10 @@ def stop_screen_recording():
     if ffmpeg_process:
         logging.info(f"Stopping FFmpeg process (PID: {ffmpeg_process.pid})...")
         try:
-            # Send 'q' to stdin to gracefully stop
-            if ffmpeg_process.stdin and not ffmpeg_process.stdin.closed:
-                ffmpeg_process.stdin.write(b'q')
-                ffmpeg_process.stdin.flush()
-                ffmpeg_process.stdin.close()
-            # Wait for process to finish - give it more time to write moov atom
-            ffmpeg_process.wait(timeout=10)
-            logging.info("FFmpeg stopped gracefully")
-        except Exception as e:
-            logging.warning(f"Graceful stop failed: {e}, forcing termination...")
-            # Force terminate if graceful stop fails
-            try:
-                ffmpeg_process.terminate()
-                ffmpeg_process.wait(timeout=5)
-                logging.info("FFmpeg terminated")
-            except Exception as e2:
-                logging.error(f"Terminate failed: {e2}, killing process...")
-                ffmpeg_process.kill()
-                logging.info("FFmpeg killed")
+            # Send 'q' to stdin to gracefully stop, giving it time to write the moov atom;
+            # terminates or kills the process if that fails
+            returncode = ffmpeg_process.stop(timeout=10)
+            logging.info(f"FFmpeg stopped (exit code {returncode})")
         finally:
             ffmpeg_process = None
     else:
@@ -0,0 +1,173 @@
+"""
+Circuit breaker for AI provider calls
+
+When the provider is down or the key's quota is exhausted, every caller would
+otherwise run its own retry/backoff loop before failing. The breaker counts
+consecutive provider failures across all callers; once it opens, calls fail
+immediately with CircuitOpenError. After reset_timeout a probe (a cheap
+provider request, e.g. listing models) runs in the background; if it succeeds
+the breaker goes half-open and lets one real call through to confirm recovery.
+"""
+import time
+import logging
+import threading
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the breaker is open"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(0, int(round(retry_after)))
+        super().__init__(f"AI provider unavailable (circuit open), retry in {self.retry_after}s")
+
+
+def is_provider_failure(error_msg):
+    """
+    True for errors that say the provider (not this request) is failing: quota,
+    server errors, timeouts, network and key problems. Safety blocks and invalid
+    model names are request-specific and don't count.
+    """
+    lowered = error_msg.lower()
+    if 'safety' in lowered or 'blocked' in lowered or ('invalid' in lowered and 'model' in lowered):
+        return False
+    markers = ('429', 'quota', 'rate limit', 'resource_exhausted', '500', '502', '503', '504',
+               'unavailable', 'internal', 'deadline', 'timeout', 'timed out', 'connection',
+               'api key', 'api_key', 'permission_denied', 'unauthenticated')
+    return any(marker in lowered for marker in markers)
+
+
+class CircuitBreaker:
+    """
+    Args:
+        failure_threshold: Consecutive provider failures that open the breaker
+        reset_timeout: Seconds the breaker stays open before probing
+        max_reset_timeout: Cap for the timeout, which doubles after each failed probe
+        probe: Optional callable run in the background when the timeout expires;
+            without one the next real call is the probe
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, max_reset_timeout=600, probe=None):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._open_for = reset_timeout
+        self._probe_in_flight = False
+        self._timer = None
+        self._last_error = None
+
+    def configure(self, failure_threshold=None, reset_timeout=None, probe=None):
+        with self._lock:
+            if failure_threshold is not None:
+                self.failure_threshold = max(1, int(failure_threshold))
+            if reset_timeout is not None:
+                self.reset_timeout = self._open_for = reset_timeout
+            if probe is not None:
+                self.probe = probe
+
+    def _retry_after(self):
+        return self._opened_at + self._open_for - time.time()
+
+    def is_open(self):
+        """True while calls would be rejected (does not use up a half-open probe)"""
+        with self._lock:
+            if self._state == OPEN:
+                return self.probe is not None or self._retry_after() > 0
+            return self._state == HALF_OPEN and self._probe_in_flight
+
+    def before_call(self):
+        """Raise CircuitOpenError if a call may not go out now"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN:
+                if self.probe is not None or self._retry_after() > 0:
+                    raise CircuitOpenError(max(self._retry_after(), 1))
+                self._state = HALF_OPEN
+            # Half-open: exactly one real call confirms recovery
+            if self._probe_in_flight:
+                raise CircuitOpenError(1)
+            self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logging.info("AI circuit breaker closed: provider recovered")
+            self._state = CLOSED
+            self._failures = 0
+            self._open_for = self.reset_timeout
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """A call ended without an outcome (e.g. a stream closed early): free the half-open slot"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self, error_msg):
+        """Count a failed call; only provider failures move the breaker"""
+        if not is_provider_failure(error_msg):
+            with self._lock:
+                self._probe_in_flight = False
+                if self._state == HALF_OPEN:
+                    # The provider answered, so it is reachable
+                    self._state = CLOSED
+                    self._failures = 0
+            return
+        with self._lock:
+            self._last_error = error_msg[:200]
+            self._probe_in_flight = False
+            if self._state == HALF_OPEN:
+                self._open_for = min(self._open_for * 2, self.max_reset_timeout)
+                self._open()
+                return
+            self._failures += 1
+            if self._state == CLOSED and self._failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        # Called with the lock held
+        self._state = OPEN
+        self._opened_at = time.time()
+        logging.warning(f"AI circuit breaker open for {self._open_for}s after "
+                        f"{self._failures} failures: {self._last_error}")
+        if self.probe is not None:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self._open_for, self._run_probe)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_probe(self):
+        try:
+            self.probe()
+        except Exception as e:
+            logging.warning(f"AI circuit breaker probe failed: {e}")
+            with self._lock:
+                if self._state == OPEN:
+                    self._open_for = min(self._open_for * 2, self.max_reset_timeout)
+                    self._last_error = str(e)[:200]
+                    self._open()
+            return
+        with self._lock:
+            if self._state == OPEN:
+                logging.info("AI circuit breaker half-open: probe succeeded")
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+
+    def status(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_after': max(0, round(self._retry_after())) if self._state == OPEN else 0,
+                'last_error': self._last_error
+            }
@@ -0,0 +1,172 @@
+"""
+Prompt context budgeting
+
+Long sessions produce actions.log files and guides far larger than a prompt
+needs. These helpers keep prompt context inside a token budget: action logs
+are condensed (keystroke runs become one TYPED line) and then sampled around
+the events screenshots are taken on; other text is cut in the middle. Every
+cut leaves an explicit "[... omitted ...]" marker so the model knows context
+is missing. log_prompt_tokens() records what each call actually sends.
+"""
+import re
+import logging
+
+from shared.transcription.providers import estimate_tokens, IMAGE_TOKENS
+
+# Default budgets, in estimated tokens
+ACTIONS_TOKEN_BUDGET = 1500
+TRANSCRIPT_TOKEN_BUDGET = 6000
+GUIDE_TOKEN_BUDGET = 8000
+
+_KEY_LINE = re.compile(r"^([\d.]+)\s+KEY\s+(.+)$")
+
+# pynput names for keys that stand for a character when typing
+_SPECIAL_KEYS = {'Key.space': ' ', 'Key.enter': '⏎', 'Key.tab': '⇥', 'Key.backspace': '⌫'}
+
+
+def truncate_text(text, max_tokens, label='text'):
+    """
+    Cut text to about max_tokens, keeping the start and the end.
+
+    Returns:
+        The text unchanged if it fits, otherwise head + omission marker + tail
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    keep_chars = max(0, max_tokens * 4 - 80)  # Leave room for the marker
+    head = text[:keep_chars * 2 // 3]
+    tail = text[len(text) - keep_chars // 3:] if keep_chars // 3 else ''
+    omitted = len(text) - len(head) - len(tail)
+    marker = f"\n[... {omitted} characters (~{estimate_tokens(text[len(head):len(text) - len(tail)])} tokens) of {label} omitted ...]\n"
+    return head + marker + tail
+
+
+def _key_char(key):
+    key = key.strip()
+    if len(key) == 3 and key[0] == key[2] == "'":
+        return key[1]
+    return _SPECIAL_KEYS.get(key, f"[{key.replace('Key.', '')}]")
+
+
+def condense_actions(actions_text):
+    """
+    Turn an actions.log into a list of event lines, with each run of
+    keystrokes collapsed into one "<time> TYPED ..." line and comments dropped.
+    """
+    events = []
+    run_start, run_keys = None, []
+
+    def flush():
+        if run_keys:
+            events.append(f"{run_start} TYPED \"{''.join(run_keys)}\" ({len(run_keys)} keys)")
+            run_keys.clear()
+
+    for line in actions_text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = _KEY_LINE.match(line)
+        if match:
+            if not run_keys:
+                run_start = match.group(1)
+            run_keys.append(_key_char(match.group(2)))
+            continue
+        flush()
+        events.append(line)
+    flush()
+    return events
+
+
+def _is_anchor(event):
+    """Events a screenshot is taken on (clicks, hotkey captures)"""
+    return ' CLICK ' in event or 'Screenshot' in event
+
+
+def actions_per_step(actions_text):
+    """
+    Split an actions.log into the events belonging to each screenshot: the
+    click (or capture) it was taken on plus what happened until the next one.
+
+    Returns:
+        List of event lists, one per anchor event, in order
+    """
+    steps = []
+    for event in condense_actions(actions_text or ''):
+        if _is_anchor(event):
+            steps.append([event])
+        elif steps:
+            steps[-1].append(event)
+    return steps
+
+
+def _sample(indexes, count):
+    """Pick `count` indexes spread evenly over the list"""
+    if count >= len(indexes):
+        return list(indexes)
+    if count <= 0:
+        return []
+    step = len(indexes) / count
+    return [indexes[int(i * step)] for i in range(count)]
+
+
+def budget_actions(actions_text, max_tokens=ACTIONS_TOKEN_BUDGET):
+    """
+    Fit an actions.log into max_tokens.
+
+    Keystroke runs are condensed first. If that is still too long, events are
+    sampled: clicks and screenshot captures are kept before anything else
+    (they line up with the screenshots the model sees), and each gap gets an
+    "[... N events omitted ...]" marker.
+
+    Returns:
+        Action text within the budget ('' when there are no events)
+    """
+    if not actions_text:
+        return ''
+    events = condense_actions(actions_text)
+    text = '\n'.join(events)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    # Average event size decides how many fit; markers take some of the room
+    per_event = max(1, estimate_tokens(text) / len(events))
+    capacity = max(1, int(max_tokens * 0.8 / per_event))
+
+    anchors = [i for i, event in enumerate(events) if _is_anchor(event)]
+    others = [i for i, event in enumerate(events) if not _is_anchor(event)]
+    kept = _sample(anchors, capacity)
+    kept += _sample(others, capacity - len(kept))
+    kept.sort()
+
+    lines = []
+    previous = -1
+    for index in kept:
+        if index - previous > 1:
+            lines.append(f"[... {index - previous - 1} events omitted ...]")
+        lines.append(events[index])
+        previous = index
+    if previous < len(events) - 1:
+        lines.append(f"[... {len(events) - 1 - previous} events omitted ...]")
+
+    # Very long single events can still overshoot; the hard cut keeps the budget honest
+    return truncate_text('\n'.join(lines), max_tokens, label='actions')
+
+
+def log_prompt_tokens(operation, contents):
+    """
+    Log the estimated prompt size for one model call.
+
+    Args:
+        operation: Name for the log line (e.g. 'generate_sop')
+        contents: Prompt string or list of strings and images
+
+    Returns:
+        Estimated prompt tokens
+    """
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    text_tokens = sum(estimate_tokens(part) for part in contents if isinstance(part, str))
+    images = sum(1 for part in contents if not isinstance(part, str))
+    total = text_tokens + images * IMAGE_TOKENS
+    logging.info(f"Prompt tokens for {operation}: ~{total} ({text_tokens} text, {images} images)")
+    return total
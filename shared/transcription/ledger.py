@@ -0,0 +1,224 @@
+"""
+AI call ledger
+
+Every model call made through the provider layer is recorded with its model,
+input images (count and bytes), prompt/response tokens, latency, attempt
+number and whether it was served from cache. Calls made inside
+ledger.context(output_dir, operation) are appended to that recording's
+ai_ledger.jsonl; all calls also feed a global rollup (per-recording totals
+and the most expensive calls) used by /api/ai_ledger and ai_report.py.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+LEDGER_FILE = 'ai_ledger.jsonl'
+
+# Approximate list prices in USD per million tokens (input, output), matched by model name prefix
+MODEL_PRICES = [
+    ('gemini-2.5-pro', 1.25, 10.00),
+    ('gemini-2.5-flash-lite', 0.10, 0.40),
+    ('gemini-2.5-flash', 0.30, 2.50),
+    ('gemini-2.0-flash-lite', 0.075, 0.30),
+    ('gemini-2.0-flash', 0.10, 0.40),
+    ('gemini-1.5-pro', 1.25, 5.00),
+    ('gemini-1.5-flash', 0.075, 0.30),
+]
+DEFAULT_PRICE = (0.30, 2.50)
+
+TOP_CALLS = 50
+# Per-recording totals kept in the rollup; the least recently active are dropped first
+MAX_RECORDINGS = 500
+
+
+def estimate_cost(model_name, prompt_tokens, output_tokens, prices=None, provider='gemini'):
+    """Estimated cost in USD from list prices (0 for the fake provider)"""
+    if not model_name or provider == 'fake':
+        return 0.0
+    name = model_name.replace('models/', '')
+    input_price, output_price = prices or next(
+        ((inp, out) for prefix, inp, out in MODEL_PRICES if name.startswith(prefix)), DEFAULT_PRICE)
+    return round((prompt_tokens * input_price + output_tokens * output_price) / 1_000_000, 6)
+
+
+def image_bytes(contents):
+    """Count and approximate in-memory size of the images in a request"""
+    count, size = 0, 0
+    for part in contents:
+        if isinstance(part, str):
+            continue
+        count += 1
+        if isinstance(part, (bytes, bytearray)):
+            size += len(part)
+        elif hasattr(part, 'size') and hasattr(part, 'getbands'):
+            width, height = part.size
+            size += width * height * len(part.getbands())
+    return count, size
+
+
+def _empty_totals():
+    return {'calls': 0, 'errors': 0, 'retries': 0, 'cache_hits': 0, 'images': 0, 'image_bytes': 0,
+            'prompt_tokens': 0, 'output_tokens': 0, 'latency_seconds': 0.0, 'cost_usd': 0.0}
+
+
+def _add_entry(totals, entry):
+    totals['calls'] += 0 if entry.get('cache_hit') else 1
+    totals['cache_hits'] += 1 if entry.get('cache_hit') else 0
+    totals['errors'] += 1 if entry.get('error') else 0
+    totals['retries'] += 1 if entry.get('attempt', 0) > 1 else 0
+    for field in ('images', 'image_bytes', 'prompt_tokens', 'output_tokens'):
+        totals[field] += entry.get(field, 0)
+    totals['latency_seconds'] = round(totals['latency_seconds'] + entry.get('latency_seconds', 0), 3)
+    totals['cost_usd'] = round(totals['cost_usd'] + entry.get('cost_usd', 0), 6)
+
+
+class AILedger:
+    """
+    Args:
+        rollup_path: JSON file with the global rollup
+        prices: Optional (input, output) USD per million tokens overriding MODEL_PRICES
+    """
+
+    def __init__(self, rollup_path, prices=None):
+        self.rollup_path = rollup_path
+        self.prices = prices
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._rollup = self._load()
+
+    def _load(self):
+        if os.path.exists(self.rollup_path):
+            try:
+                with open(self.rollup_path, 'r', encoding='utf-8') as f:
+                    rollup = json.load(f)
+                if 'recordings' in rollup:
+                    self._trim_recordings(rollup['recordings'])
+                    return rollup
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable AI ledger rollup {self.rollup_path}: {e}")
+        return {'totals': _empty_totals(), 'recordings': {}, 'top_calls': []}
+
+    @contextmanager
+    def context(self, output_dir=None, operation=None):
+        """Attribute calls in this block (on this thread) to a recording and operation"""
+        previous = getattr(self._local, 'current', None)
+        self._local.current = {'output_dir': output_dir, 'operation': operation}
+        try:
+            yield
+        finally:
+            self._local.current = previous
+
+    def record_call(self, model_name, contents, usage_metadata=None, latency=0.0, error=None, provider='gemini',
+                    attempt=1):
+        """Record one model call (called by the provider layer); attempt is 2+ for a retry of the same request"""
+        current = getattr(self._local, 'current', None) or {'output_dir': None, 'operation': None}
+        images, size = image_bytes(contents if isinstance(contents, (list, tuple)) else [contents])
+        prompt_tokens = getattr(usage_metadata, 'prompt_token_count', 0) or 0
+        output_tokens = getattr(usage_metadata, 'candidates_token_count', 0) or 0
+        self._record({
+            'operation': current['operation'],
+            'output_dir': current['output_dir'],
+            'provider': provider,
+            'model': model_name,
+            'images': images,
+            'image_bytes': size,
+            'prompt_tokens': prompt_tokens,
+            'output_tokens': output_tokens,
+            'latency_seconds': round(latency, 3),
+            'attempt': attempt,
+            'cache_hit': False,
+            'error': error[:200] if error else None,
+            'cost_usd': estimate_cost(model_name, prompt_tokens, output_tokens, self.prices, provider)
+        })
+
+    def record_cache_hit(self, model_name, operation=None, output_dir=None):
+        """Record a request answered from the response cache"""
+        current = getattr(self._local, 'current', None) or {}
+        self._record({
+            'operation': operation or current.get('operation'),
+            'output_dir': output_dir or current.get('output_dir'),
+            'model': model_name,
+            'images': 0, 'image_bytes': 0, 'prompt_tokens': 0, 'output_tokens': 0,
+            'latency_seconds': 0.0, 'attempt': 0, 'cache_hit': True, 'error': None, 'cost_usd': 0.0
+        })
+
+    def _record(self, entry):
+        entry = dict(entry, timestamp=time.time())
+        output_dir = entry['output_dir']
+        try:
+            if output_dir and os.path.isdir(output_dir):
+                with open(os.path.join(output_dir, LEDGER_FILE), 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+        except Exception as e:
+            logging.warning(f"Could not write AI ledger entry: {e}")
+
+        with self._lock:
+            key = output_dir or '(no recording)'
+            _add_entry(self._rollup['totals'], entry)
+            _add_entry(self._rollup['recordings'].setdefault(key, _empty_totals()), entry)
+            self._rollup['recordings'][key]['last_call'] = entry['timestamp']
+            self._trim_recordings(self._rollup['recordings'])
+
+            if not entry['cache_hit']:
+                top = self._rollup['top_calls']
+                top.append(entry)
+                top.sort(key=lambda e: (e['cost_usd'], e['prompt_tokens'] + e['output_tokens']), reverse=True)
+                del top[TOP_CALLS:]
+            self._save()
+
+    @staticmethod
+    def _trim_recordings(recordings):
+        while len(recordings) > MAX_RECORDINGS:
+            del recordings[min(recordings, key=lambda key: recordings[key].get('last_call', 0))]
+
+    def _save(self):
+        try:
+            temp_path = self.rollup_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._rollup, f)
+            os.replace(temp_path, self.rollup_path)
+        except Exception as e:
+            logging.warning(f"Could not save AI ledger rollup: {e}")
+
+    def report(self, limit=10):
+        """Totals, the most expensive recordings and the most expensive calls"""
+        with self._lock:
+            return build_report(json.loads(json.dumps(self._rollup)), limit)
+
+
+def build_report(rollup, limit=10):
+    """Report dict from a rollup (also used by ai_report.py on the saved file)"""
+    recordings = [dict(totals, output_dir=key) for key, totals in rollup.get('recordings', {}).items()]
+    recordings.sort(key=lambda r: (r['cost_usd'], r['prompt_tokens'] + r['output_tokens']), reverse=True)
+    return {
+        'totals': rollup.get('totals', _empty_totals()),
+        'top_recordings': recordings[:limit],
+        'top_calls': rollup.get('top_calls', [])[:limit]
+    }
+
+
+def read_recording_ledger(output_dir):
+    """All ledger entries for one recording, oldest first"""
+    path = os.path.join(output_dir, LEDGER_FILE)
+    entries = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+    return entries
+
+
+def summarize_entries(entries):
+    """Totals for a list of ledger entries"""
+    totals = _empty_totals()
+    for entry in entries:
+        _add_entry(totals, entry)
+    return totals
@@ -0,0 +1,121 @@
+"""
+Persistent cache of the AI model list (also used for the narration voice list)
+
+The model list rarely changes, so it is kept on disk and served from there.
+Within the TTL the cached list is returned as is; after it, the stale list is
+still returned immediately while one background thread fetches a fresh copy
+(stale-while-revalidate). Only a cold cache waits for the API.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+
+class ModelCatalog:
+    """
+    Args:
+        cache_path: JSON file holding the last fetched list
+        fetch: Callable returning the model list (list of dicts)
+        ttl: Seconds a fetched list counts as fresh
+        retry_after: Seconds to wait after a failed fetch before trying again
+        label: What the list holds, for log messages
+    """
+
+    def __init__(self, cache_path, fetch, ttl=3600, retry_after=300, label='Model list'):
+        self.cache_path = cache_path
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.label = label
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._failed_at = 0
+        self._entry = self._load()
+
+    def _load(self):
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if isinstance(entry.get('models'), list):
+                    return entry
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable {self.label.lower()} cache {self.cache_path}: {e}")
+        return None
+
+    def _save(self, entry):
+        try:
+            temp_path = self.cache_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, indent=2)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            logging.warning(f"Could not save {self.label.lower()} cache: {e}")
+
+    def _refresh(self, key):
+        try:
+            models = self.fetch()
+        except Exception as e:
+            logging.warning(f"{self.label} refresh failed: {e}")
+            with self._lock:
+                self._failed_at = time.time()
+            return None
+        finally:
+            with self._lock:
+                self._refreshing = False
+        entry = {'key': key, 'models': models, 'fetched_at': time.time()}
+        with self._lock:
+            self._entry = entry
+        self._save(entry)
+        logging.info(f"{self.label} refreshed: {len(models)} entries")
+        return entry
+
+    def get(self, key=''):
+        """
+        Return the model list for key (e.g. the provider name).
+
+        Returns:
+            (models, info) - models is None if nothing is cached and the fetch failed;
+            info has 'cached', 'stale' and 'fetched_at'
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entry if self._entry and self._entry.get('key') == key else None
+            age = now - entry['fetched_at'] if entry else None
+            can_refresh = not self._refreshing and now - self._failed_at >= self.retry_after
+            if entry is None or age >= self.ttl:
+                if can_refresh:
+                    self._refreshing = True
+                else:
+                    can_refresh = False
+
+        if entry is not None:
+            stale = age >= self.ttl
+            if stale and can_refresh:
+                threading.Thread(target=self._refresh, args=(key,), daemon=True,
+                                 name='catalog-refresh').start()
+            return entry['models'], {'cached': True, 'stale': stale, 'fetched_at': entry['fetched_at']}
+
+        if not can_refresh:
+            return None, {'cached': False, 'stale': False, 'fetched_at': None}
+        fresh = self._refresh(key)
+        if fresh is None:
+            return None, {'cached': False, 'stale': False, 'fetched_at': None}
+        return fresh['models'], {'cached': False, 'stale': False, 'fetched_at': fresh['fetched_at']}
+
+    def prefetch(self, key=''):
+        """Load or refresh the list in a background thread, so the next get() doesn't wait"""
+        threading.Thread(target=self.get, args=(key,), daemon=True, name='catalog-prefetch').start()
+
+    def invalidate(self):
+        """Forget the cached list (e.g. after the API key changes)"""
+        with self._lock:
+            self._entry = None
+            self._failed_at = 0
+        try:
+            if os.path.exists(self.cache_path):
+                os.remove(self.cache_path)
+        except Exception as e:
+            logging.warning(f"Could not remove {self.label.lower()} cache: {e}")
@@ -0,0 +1,428 @@
+"""
+Pluggable AI providers
+
+The server talks to models through a provider instead of importing
+google.generativeai directly. GeminiProvider is the real thing; FakeProvider
+is a local stand-in that returns deterministic text with configurable
+latency and injected errors, so guide/SOP generation can be benchmarked
+and retry paths exercised without an API key or network.
+
+Models returned by get_model() expose the subset of the Gemini API the app
+uses: generate_content(contents, stream=False, **kwargs), with responses
+(or streamed chunks) that have .text and .usage_metadata. Retry loops pass
+attempt=N so the AI ledger can tell retries from separate calls.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+
+from shared.transcription.circuit_breaker import CircuitBreaker
+
+
+class AIProviderError(Exception):
+    """Raised when a provider can't be used (missing key or dependency)"""
+
+
+class Usage:
+    """Thread-safe request and token counters for a provider"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def record(self, usage_metadata=None, error=False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            if usage_metadata is not None:
+                self.prompt_tokens += getattr(usage_metadata, 'prompt_token_count', 0) or 0
+                self.output_tokens += getattr(usage_metadata, 'candidates_token_count', 0) or 0
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'prompt_tokens': self.prompt_tokens,
+                'output_tokens': self.output_tokens,
+                'total_tokens': self.prompt_tokens + self.output_tokens
+            }
+
+
+class _AccountingModel:
+    """
+    Wraps a provider model and records usage for every call, plus quota
+    counters and ledger entries when the provider has them attached. Calls
+    fail fast with CircuitOpenError while the provider's breaker is open.
+    """
+
+    def __init__(self, model, model_name, provider):
+        self._model = model
+        self._model_name = model_name
+        self._provider_name = provider.name
+        self._usage = provider.usage
+        self._quota = provider.quota
+        self._ledger = provider.ledger
+        self._breaker = provider.breaker
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def generate_content(self, contents, stream=False, attempt=1, **kwargs):
+        self._breaker.before_call()
+        started = time.time()
+        try:
+            response = self._model.generate_content(contents, stream=stream, **kwargs)
+        except Exception as e:
+            self._usage.record(error=True)
+            self._record_call(contents, None, started, attempt, str(e))
+            raise
+        if stream:
+            return self._account_stream(contents, response, started, attempt)
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        self._usage.record(usage_metadata)
+        self._record_call(contents, usage_metadata, started, attempt)
+        return response
+
+    def _record_call(self, contents, usage_metadata, started, attempt, error_msg=None, completed=True):
+        if not completed:
+            # Says nothing about the provider's health, but must not hold the half-open probe
+            self._breaker.release_probe()
+        elif error_msg:
+            self._breaker.record_failure(error_msg)
+        else:
+            self._breaker.record_success()
+        if self._quota is not None:
+            self._quota.record(error_msg)
+        if self._ledger is not None:
+            self._ledger.record_call(self._model_name, contents, usage_metadata,
+                                     latency=time.time() - started, error=error_msg,
+                                     provider=self._provider_name, attempt=attempt)
+
+    def _account_stream(self, contents, chunks, started, attempt):
+        usage_metadata = None
+        finished = False
+        try:
+            for chunk in chunks:
+                # The final chunk carries the totals for the whole response
+                usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+                yield chunk
+            finished = True
+        except Exception as e:
+            finished = True
+            self._usage.record(usage_metadata, error=True)
+            self._record_call(contents, usage_metadata, started, attempt, str(e))
+            raise
+        finally:
+            if not finished:
+                # Closed early: client disconnected, job cancelled or the consumer stopped reading
+                self._usage.record(usage_metadata)
+                self._record_call(contents, usage_metadata, started, attempt, 'Stream closed before completion',
+                                  completed=False)
+        self._usage.record(usage_metadata)
+        self._record_call(contents, usage_metadata, started, attempt)
+
+
+class AIProvider:
+    """Base class for AI providers"""
+
+    name = 'base'
+
+    def __init__(self):
+        self.usage = Usage()
+        self.quota = None  # Optional QuotaTracker (see shared.transcription.quota)
+        self.ledger = None  # Optional AILedger (see shared.transcription.ledger)
+        # Shared by every caller of this provider; list_models() is the half-open probe
+        self.breaker = CircuitBreaker(probe=self.list_models)
+
+    def is_configured(self):
+        """True when the provider can make requests"""
+        raise NotImplementedError
+
+    def get_model(self, model_name):
+        """Return a model object for model_name (with usage accounting)"""
+        return _AccountingModel(self._create_model(model_name), model_name, self)
+
+    def _create_model(self, model_name):
+        raise NotImplementedError
+
+    def list_models(self):
+        """List models; items have name, display_name, description, supported_generation_methods"""
+        raise NotImplementedError
+
+
+class GeminiProvider(AIProvider):
+    """Google Gemini through google.generativeai"""
+
+    name = 'gemini'
+
+    def is_configured(self):
+        return bool(os.environ.get('GEMINI_API_KEY'))
+
+    def _configure(self):
+        import google.generativeai as genai
+
+        api_key = os.environ.get('GEMINI_API_KEY')
+        if not api_key:
+            raise AIProviderError('GEMINI_API_KEY not configured')
+        genai.configure(api_key=api_key)
+        return genai
+
+    def _create_model(self, model_name):
+        return self._configure().GenerativeModel(model_name)
+
+    def list_models(self):
+        return list(self._configure().list_models())
+
+
+class _FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class _FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _FakeModelInfo:
+    def __init__(self, name, display_name, description):
+        self.name = f"models/{name}"
+        self.display_name = display_name
+        self.description = description
+        self.supported_generation_methods = ['generateContent']
+
+
+class _FakeModel:
+    def __init__(self, provider, model_name):
+        self.provider = provider
+        self.model_name = model_name
+
+    def generate_content(self, contents, stream=False, generation_config=None, **kwargs):
+        json_output = (generation_config or {}).get('response_mime_type') == 'application/json'
+        return self.provider._generate(self.model_name, contents, stream, json_output)
+
+
+# Errors are worded like the real API so the app's string matching classifies them
+FAKE_ERRORS = {
+    '429': '429 RESOURCE_EXHAUSTED: Quota exceeded for quota metric (fake provider)',
+    'safety': 'Response was blocked due to SAFETY (fake provider)',
+    'invalid_model': '400 Invalid model name: {model} (fake provider)',
+    'unavailable': '503 UNAVAILABLE: The service is currently unavailable (fake provider)',
+}
+
+# Gemini bills each image as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+
+class FakeProvider(AIProvider):
+    """
+    Local stand-in for Gemini.
+
+    Args:
+        latency: Seconds before a response (or the first streamed chunk)
+        latency_per_image: Extra seconds per image in the request
+        chunk_delay: Seconds between streamed chunks
+        error: Error to inject: '429', 'unavailable', 'safety' or 'invalid_model'
+        error_rate: Probability (0-1) that a request fails with `error`
+        fail_next: Number of upcoming requests that fail with `error`
+        seed: Seed for error_rate, so runs are reproducible
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.5, latency_per_image=0.0, chunk_delay=0.05,
+                 error=None, error_rate=0.0, fail_next=0, seed=0):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.latency = latency
+        self.latency_per_image = latency_per_image
+        self.chunk_delay = chunk_delay
+        self.error = error
+        self.error_rate = error_rate
+        self.fail_next = fail_next
+
+    def configure(self, **settings):
+        """Change latency or error injection at runtime"""
+        with self._lock:
+            for key, value in settings.items():
+                if key == 'seed':
+                    self._random = random.Random(value)
+                elif key in self.settings():
+                    setattr(self, key, value)
+                else:
+                    raise ValueError(f"Unknown fake provider setting: {key}")
+
+    def settings(self):
+        return {
+            'latency': self.latency,
+            'latency_per_image': self.latency_per_image,
+            'chunk_delay': self.chunk_delay,
+            'error': self.error,
+            'error_rate': self.error_rate,
+            'fail_next': self.fail_next
+        }
+
+    def is_configured(self):
+        return True
+
+    def _create_model(self, model_name):
+        return _FakeModel(self, model_name)
+
+    def list_models(self):
+        if self.error == 'unavailable' and (self.fail_next > 0 or self.error_rate >= 1):
+            raise Exception(FAKE_ERRORS['unavailable'])
+        return [
+            _FakeModelInfo('gemini-2.5-flash', 'Gemini 2.5 Flash (fake)', 'Local fake provider'),
+            _FakeModelInfo('gemini-2.0-flash-exp', 'Gemini 2.0 Flash Experimental (fake)', 'Local fake provider'),
+        ]
+
+    def _pick_error(self, model_name):
+        if model_name.startswith('invalid'):
+            return FAKE_ERRORS['invalid_model'].format(model=model_name)
+        if not self.error:
+            return None
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                fail = True
+            else:
+                fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        if fail:
+            return FAKE_ERRORS.get(self.error, self.error).format(model=model_name)
+        return None
+
+    def _generate(self, model_name, contents, stream, json_output=False):
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        prompt = '\n'.join(part for part in contents if isinstance(part, str))
+        images = [part for part in contents if not isinstance(part, str)]
+
+        time.sleep(self.latency + self.latency_per_image * len(images))
+        error = self._pick_error(model_name)
+        if error:
+            raise Exception(error)
+
+        text = fake_response_text(prompt, images, json_output)
+        usage_metadata = _FakeUsageMetadata(
+            estimate_tokens(prompt) + IMAGE_TOKENS * len(images),
+            estimate_tokens(text)
+        )
+        if not stream:
+            return _FakeResponse(text, usage_metadata)
+        return self._stream(text, usage_metadata)
+
+    def _stream(self, text, usage_metadata):
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield _FakeResponse(line, usage_metadata if i == len(lines) - 1 else None)
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token)"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def _image_label(image):
+    """Short stable label for an image, so the same screenshot gets the same text"""
+    try:
+        data = image.tobytes()
+    except Exception:
+        data = repr(image).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:8]
+
+
+def fake_response_text(prompt, images, json_output=False):
+    """Deterministic response text shaped like what the app's prompts ask for"""
+    if json_output:
+        return json.dumps({
+            'title': 'Fake Guide',
+            'introduction': 'This guide was generated by the local fake provider.',
+            'steps': [
+                {'screenshot': i,
+                 'instruction': f"Click the highlighted control in screenshot {i} ({_image_label(image)}). "
+                                "This moves the task forward to the next screen."}
+                for i, image in enumerate(images, 1)
+            ],
+            'conclusion': f"You have completed all {len(images)} steps."
+        })
+
+    if 'Standard Operating Procedure' in prompt:
+        steps = [line.split(':', 1)[1].strip() for line in prompt.splitlines()
+                 if line.strip().startswith('Step ') and ':' in line]
+        items = ''.join(f"<li>{step}</li>\n" for step in steps) or "<li>Follow the guide.</li>\n"
+        return ("<h1>Standard Operating Procedure</h1>\n"
+                "<h2>Purpose</h2>\n<p>Fake SOP generated locally for testing.</p>\n"
+                f"<h2>Procedure</h2>\n<ol>\n{items}</ol>\n")
+
+    if 'TITLE:' in prompt and 'INTRODUCTION:' in prompt:
+        return ("TITLE: Fake Guide\n"
+                "INTRODUCTION: This guide was generated by the local fake provider.\n"
+                "CONCLUSION: You have completed all steps.")
+
+    if len(images) > 1 or 'Step 1:' in prompt:
+        count = max(len(images), 1)
+        lines = ["# Fake Guide", "", "This guide was generated by the local fake provider.", ""]
+        for i, image in enumerate(images or [None], 1):
+            label = _image_label(image) if image is not None else 'text'
+            lines.append(f"Step {i}: Click the highlighted control in screenshot {i} ({label}).")
+            lines.append("This moves the task forward to the next screen.")
+            lines.append("")
+        lines.append(f"You have completed all {count} steps.")
+        return '\n'.join(lines)
+
+    label = _image_label(images[0]) if images else 'text'
+    return f"Click the highlighted control shown in the screenshot ({label}). This opens the next part of the task."
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(config=None):
+    """
+    Return the provider selected by AI_PROVIDER (environment or config), created once per process.
+
+    Args:
+        config: Dict from config.txt; FAKE_AI_* keys configure the fake provider and
+            AI_BREAKER_* keys the circuit breaker
+    """
+    config = config or {}
+    name = (os.environ.get('AI_PROVIDER') or config.get('AI_PROVIDER') or 'gemini').lower()
+    with _providers_lock:
+        if name not in _providers:
+            if name == 'gemini':
+                _providers[name] = GeminiProvider()
+            elif name == 'fake':
+                _providers[name] = FakeProvider(
+                    latency=float(config.get('FAKE_AI_LATENCY', 0.5)),
+                    latency_per_image=float(config.get('FAKE_AI_LATENCY_PER_IMAGE', 0.0)),
+                    error=config.get('FAKE_AI_ERROR') or None,
+                    error_rate=float(config.get('FAKE_AI_ERROR_RATE', 0.0)),
+                    fail_next=int(config.get('FAKE_AI_FAIL_NEXT', 0))
+                )
+            else:
+                raise AIProviderError(f"Unknown AI_PROVIDER: {name}")
+            _providers[name].breaker.configure(
+                failure_threshold=int(config.get('AI_BREAKER_FAILURES', 5)),
+                reset_timeout=float(config.get('AI_BREAKER_RESET_SECONDS', 30))
+            )
+            logging.info(f"AI provider: {name}")
+        return _providers[name]
@@ -0,0 +1,110 @@
+"""
+Locally tracked AI quota state
+
+Counts requests and rate-limit (429) responses as the server makes them and
+keeps the daily totals in a small JSON file, so quota status can be shown
+without spending a request on it and survives a restart.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import date
+
+
+def is_rate_limit_message(error_msg):
+    """True for the errors Gemini returns when a quota is exhausted"""
+    lowered = error_msg.lower()
+    return '429' in error_msg or 'quota' in lowered or 'rate limit' in lowered or 'resource_exhausted' in lowered
+
+
+class QuotaTracker:
+    """
+    Request and 429 counters for the current day.
+
+    Args:
+        state_path: JSON file the daily counters are saved to (None keeps them in memory)
+        rate_limit_cooldown: Seconds after a 429 during which status is 'Rate Limited'
+    """
+
+    def __init__(self, state_path=None, rate_limit_cooldown=60):
+        self.state_path = state_path
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._state = self._load()
+
+    def _empty_state(self):
+        return {'date': date.today().isoformat(), 'requests': 0, 'rate_limited': 0, 'last_rate_limited_at': None}
+
+    def _load(self):
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get('date') == date.today().isoformat():
+                    return state
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable quota state {self.state_path}: {e}")
+        return self._empty_state()
+
+    def _save(self):
+        if not self.state_path:
+            return
+        try:
+            temp_path = self.state_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f)
+            os.replace(temp_path, self.state_path)
+        except Exception as e:
+            logging.warning(f"Could not save quota state: {e}")
+
+    def _roll_day(self):
+        if self._state['date'] != date.today().isoformat():
+            self._state = self._empty_state()
+
+    def record(self, error_msg=None):
+        """Count one request; error_msg is the exception text if it failed"""
+        now = time.time()
+        with self._lock:
+            self._roll_day()
+            self._state['requests'] += 1
+            self._recent.append(now)
+            if error_msg and is_rate_limit_message(error_msg):
+                self._state['rate_limited'] += 1
+                self._state['last_rate_limited_at'] = now
+            self._save()
+
+    def status(self, requests_per_minute=15, daily_limit=1500):
+        """
+        Quota status from the local counters.
+
+        Returns:
+            Dict with status ('Active', 'Near Limit' or 'Rate Limited') and the counts behind it
+        """
+        now = time.time()
+        with self._lock:
+            self._roll_day()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            state = dict(self._state)
+            last_minute = len(self._recent)
+
+        last_429 = state['last_rate_limited_at']
+        if last_429 and now - last_429 < self.rate_limit_cooldown:
+            status = 'Rate Limited'
+        elif state['requests'] >= daily_limit * 0.9 or last_minute >= requests_per_minute:
+            status = 'Near Limit'
+        else:
+            status = 'Active'
+        return {
+            'status': status,
+            'requests_today': state['requests'],
+            'daily_limit': daily_limit,
+            'requests_last_minute': last_minute,
+            'requests_per_minute': requests_per_minute,
+            'rate_limited_today': state['rate_limited'],
+            'last_rate_limited_seconds_ago': round(now - last_429) if last_429 else None
+        }
@@ -0,0 +1,107 @@
+"""
+Shared rate limiter for AI API calls
+
+Every Gemini request made by the server goes through one limiter so that
+parallel work (batch step instructions, background jobs) stays inside the
+account's requests-per-minute quota instead of tripping 429s. Low-priority
+callers (live annotation during recording) only use part of the window, one at
+a time, and step aside whenever a normal request is waiting.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class RateLimiter:
+    """Sliding-window requests-per-minute limit plus a cap on concurrent calls"""
+
+    def __init__(self, requests_per_minute=15, max_concurrent=3, window_seconds=60, low_priority_share=0.5):
+        self.requests_per_minute = max(1, int(requests_per_minute))
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.window_seconds = window_seconds
+        # Low-priority calls may fill at most this share of the window
+        self.low_priority_limit = max(1, int(self.requests_per_minute * low_priority_share))
+        self._calls = deque()
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrent)
+        self._low_priority_semaphore = threading.BoundedSemaphore(1)
+        self._waiting = 0
+        self._blocked_until = 0
+
+    def _reserve(self, low_priority=False):
+        """Reserve a slot in the window. Returns seconds to wait (0 if reserved)."""
+        with self._lock:
+            now = time.time()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            while self._calls and now - self._calls[0] >= self.window_seconds:
+                self._calls.popleft()
+            limit = self.requests_per_minute
+            if low_priority:
+                if self._waiting:
+                    return 1.0
+                limit = self.low_priority_limit
+            if len(self._calls) < limit:
+                self._calls.append(now)
+                return 0
+            return self.window_seconds - (now - self._calls[len(self._calls) - limit])
+
+    def wait(self, sleep=time.sleep, low_priority=False):
+        """Block until a request may be sent within the per-minute limit"""
+        if not low_priority:
+            with self._lock:
+                self._waiting += 1
+        try:
+            while True:
+                delay = self._reserve(low_priority)
+                if delay <= 0:
+                    return
+                logging.info(f"AI rate limit: waiting {delay:.1f}s{' (low priority)' if low_priority else ''}")
+                sleep(min(delay, 5))
+        finally:
+            if not low_priority:
+                with self._lock:
+                    self._waiting -= 1
+
+    @contextmanager
+    def slot(self, sleep=time.sleep, low_priority=False):
+        """
+        Context manager around a single API call.
+
+        Args:
+            sleep: Sleep function to use while waiting (e.g. a cancel-aware one)
+            low_priority: Background work that should not delay user requests
+        """
+        if low_priority:
+            # Wait for the window before taking a concurrency slot from user requests
+            with self._low_priority_semaphore:
+                self.wait(sleep, low_priority=True)
+                with self._semaphore:
+                    yield
+            return
+        self._semaphore.acquire()
+        try:
+            self.wait(sleep)
+            yield
+        finally:
+            self._semaphore.release()
+
+    def backoff(self, seconds):
+        """Pause all callers after the API reported a rate limit"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+
+    def status(self):
+        with self._lock:
+            now = time.time()
+            recent = sum(1 for t in self._calls if now - t < self.window_seconds)
+            return {
+                'requests_per_minute': self.requests_per_minute,
+                'max_concurrent': self.max_concurrent,
+                'low_priority_limit': self.low_priority_limit,
+                'waiting': self._waiting,
+                'requests_last_minute': recent,
+                'blocked_seconds': max(0, round(self._blocked_until - now, 1))
+            }
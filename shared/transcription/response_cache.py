@@ -0,0 +1,76 @@
+"""
+On-disk cache of AI responses
+
+Responses are keyed by a hash of everything that determines the output
+(operation, model, prompt and image bytes), so asking again for the same
+screenshot returns instantly and costs no quota.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+
+
+class ResponseCache:
+    """One JSON file per cached response, pruned oldest-first past max_entries"""
+
+    def __init__(self, cache_dir, max_entries=1000):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """Build a cache key from strings and/or bytes"""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable AI cache entry {path}: {e}")
+            return None
+
+    def set(self, key, value):
+        """Store a JSON-serializable value"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning(f"Could not write AI cache entry: {e}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            if self._writes % 50 == 0:
+                self._prune()
+
+    def _prune(self):
+        try:
+            entries = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.json')]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=os.path.getmtime)
+            for path in entries[:len(entries) - self.max_entries]:
+                os.remove(path)
+        except Exception as e:
+            logging.warning(f"Could not prune AI cache: {e}")
@@ -1,15 +1,17 @@
 import os
 import sys
-import google.generativeai as genai
+import contextlib
 from PIL import Image
 
+from shared.transcription.providers import get_provider
+
 def analyze_screenshots_with_ai(screenshot_dir, output="transcript.txt"):
     """
     Analyze screenshots using Google Gemini Vision API to generate step-by-step instructions.
+    Goes through the shared AI provider, so the call is metered and respects the circuit breaker.
     """
-    # Get API key from environment
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+    provider = get_provider()
+    if not provider.is_configured():
         # Create .env template if it doesn't exist
         env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")
         if not os.path.exists(env_path):
@@ -18,9 +20,7 @@ def analyze_screenshots_with_ai(screenshot_dir, output="transcript.txt"):
                 f.write("GEMINI_API_KEY=your_api_key_here\n")
         raise ValueError(f"Gemini API key not found. Please add it to: {env_path}")
     
-    # Configure Gemini
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    model = provider.get_model('gemini-2.5-flash')
     
     # Get all screenshots in order
     screenshots = sorted([
@@ -57,8 +57,11 @@ Step 4: User selects the project location using the Browse button
 
 Generate the step-by-step guide now:"""
     
-    # Call Gemini with all images
-    response = model.generate_content([prompt] + images)
+    # Call Gemini with all images, attributed to this recording when a ledger is attached
+    ledger_context = (provider.ledger.context(screenshot_dir, 'analyze_screenshots')
+                      if provider.ledger is not None else contextlib.nullcontext())
+    with ledger_context:
+        response = model.generate_content([prompt] + images)
     
     instructions = response.text
     
@@ -0,0 +1,216 @@
+"""
+Edit decision lists for the video editor
+
+Instead of chaining cut, merge, audio sync and audio replacement as separate
+FFmpeg runs (each writing a full intermediate MP4), the editor sends the whole
+timeline as one EDL:
+
+    {
+        "segments": [{"source": "C:/.../recording.mp4", "start": 12.5, "end": 80},
+                     {"source": "C:/.../recording.mp4", "start": 95}],
+        "audio_offset": 0.2,          # seconds; positive delays the audio
+        "replace_audio": null,        # audio file used instead of the segments' audio
+        "mute_original": false,       # drop the segments' audio
+        "narration": true             # mix AI narration (from transcript.txt) on top
+    }
+
+compile_edl() turns it into one filter graph (trim + concat for the segments,
+shift, replacement and narration mixing for the audio), and render_edl() runs
+it in a single FFmpeg pass with progress reporting.
+"""
+import logging
+
+from shared.utils import ffmpeg_runner
+from shared.guide.narration import chunk_input_args, stream_chunks
+
+# Narration is boosted the same way as /api/add_narration
+NARRATION_VOLUME = 2.0
+
+AUDIO_FORMAT = 'aresample=48000,aformat=sample_fmts=fltp:channel_layouts=stereo'
+
+
+class EDLError(ValueError):
+    """The EDL is malformed or refers to media that doesn't exist"""
+
+
+def normalize_segments(edl, media):
+    """
+    Validate the EDL's segments against probed media.
+
+    Args:
+        edl: EDL dict
+        media: {source path: shared.utils.video_cut.probe_streams() result}
+
+    Returns:
+        List of (source, start, end)
+    """
+    segments = edl.get('segments') or []
+    if not segments:
+        raise EDLError('EDL has no segments')
+    normalized = []
+    for i, segment in enumerate(segments, 1):
+        source = segment.get('source')
+        if source not in media:
+            raise EDLError(f'Segment {i}: source not found: {source}')
+        duration = media[source].get('duration')
+        start = float(segment.get('start') or 0)
+        end = segment.get('end')
+        end = float(end) if end is not None else duration
+        if end is None:
+            raise EDLError(f'Segment {i}: no end time and the source duration is unknown')
+        if duration is not None:
+            end = min(end, duration)
+        if start < 0 or end <= start:
+            raise EDLError(f'Segment {i}: invalid range {start}-{end}')
+        normalized.append((source, start, end))
+    return normalized
+
+
+def _shift_audio(offset):
+    """Filter prefix that moves audio by offset seconds (positive = later)"""
+    if offset > 0:
+        return f"adelay=delays={int(round(offset * 1000))}:all=1,"
+    if offset < 0:
+        return f"atrim=start={-offset:.3f},asetpts=PTS-STARTPTS,"
+    return ''
+
+
+def _split(label, count, kind, prefix):
+    """Split one stream into count labelled copies (a pad can only be read once)"""
+    names = [f"{prefix}{n}" for n in range(count)]
+    if count == 1:
+        return [], [label]
+    split = 'split' if kind == 'v' else 'asplit'
+    return [f"{label}{split}={count}{''.join(f'[{n}]' for n in names)}"], [f"[{n}]" for n in names]
+
+
+def compile_edl(edl, media, narration_tempo=None):
+    """
+    Compile an EDL into FFmpeg inputs and one filter graph.
+
+    Args:
+        edl: EDL dict (see module docstring)
+        media: {source path: probe_streams() result} for every segment source
+        narration_tempo: Tempo of the narration input, or None without narration
+
+    Returns:
+        (inputs, filter_complex, maps, duration) - input options; the graph;
+        output -map options; total output length in seconds. With narration,
+        the last input is stdin (added by render_edl()).
+    """
+    segments = normalize_segments(edl, media)
+    sources = list(dict.fromkeys(source for source, _, _ in segments))
+    index = {source: i for i, source in enumerate(sources)}
+    inputs = []
+    for source in sources:
+        inputs += ['-i', source]
+
+    # Every segment is scaled into the first source's frame so concat sees one format
+    first = media[sources[0]]
+    width = (first.get('width') or 1280) // 2 * 2
+    height = (first.get('height') or 720) // 2 * 2
+    fit = (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+           f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p")
+
+    offset = float(edl.get('audio_offset') or 0)
+    replace_audio = edl.get('replace_audio')
+    original_audio = not replace_audio and not edl.get('mute_original')
+    total = sum(end - start for _, start, end in segments)
+
+    filters = []
+    uses = {source: [n for n, (s, _, _) in enumerate(segments) if s == source] for source in sources}
+    video_pads, audio_pads = {}, {}
+    for source in sources:
+        i = index[source]
+        split_filters, pads = _split(f"[{i}:v]", len(uses[source]), 'v', f"vs{i}_")
+        filters += split_filters
+        video_pads.update(zip(uses[source], pads))
+        if original_audio and media[source].get('has_audio'):
+            # apad so a shifted track still covers every segment
+            filters.append(f"[{i}:a]{_shift_audio(offset)}apad[as{i}]")
+            split_filters, pads = _split(f"[as{i}]", len(uses[source]), 'a', f"as{i}_")
+            filters += split_filters
+            audio_pads.update(zip(uses[source], pads))
+
+    concat_inputs = ''
+    for n, (source, start, end) in enumerate(segments):
+        filters.append(f"{video_pads[n]}trim=start={start:.3f}:end={end:.3f},setpts=PTS-STARTPTS,{fit}[v{n}]")
+        concat_inputs += f"[v{n}]"
+        if original_audio:
+            if n in audio_pads:
+                filters.append(f"{audio_pads[n]}atrim=start={start:.3f}:end={end:.3f},"
+                               f"asetpts=PTS-STARTPTS,{AUDIO_FORMAT}[a{n}]")
+            else:
+                filters.append(f"anullsrc=r=48000:cl=stereo,atrim=duration={end - start:.3f},{AUDIO_FORMAT}[a{n}]")
+            concat_inputs += f"[a{n}]"
+    if original_audio:
+        filters.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a=1[vout][program]")
+    else:
+        filters.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a=0[vout]")
+
+    program = '[program]' if original_audio else None
+    next_input = len(sources)
+    if replace_audio:
+        inputs += ['-i', replace_audio]
+        filters.append(f"[{next_input}:a]{_shift_audio(offset)}{AUDIO_FORMAT},apad,"
+                       f"atrim=end={total:.3f}[program]")
+        program = '[program]'
+        next_input += 1
+
+    maps = ['-map', '[vout]']
+    if narration_tempo is not None:
+        tempo = f"atempo={narration_tempo}," if narration_tempo != 1.0 else ""
+        filters.append(f"[{next_input}:a]{tempo}volume={NARRATION_VOLUME},{AUDIO_FORMAT},apad,"
+                       f"atrim=end={total:.3f}[narration]")
+        if program:
+            filters.append(f"{program}[narration]amix=inputs=2:duration=first:dropout_transition=0:normalize=0[aout]")
+        else:
+            filters.append("[narration]anull[aout]")
+        maps += ['-map', '[aout]']
+    elif program:
+        maps += ['-map', program]
+
+    return inputs, ';'.join(filters), maps, total
+
+
+def render_edl(ffmpeg_path, edl, media, output_path, narration_chunks=None, narration_tempo=1.0,
+               progress=None, check_cancelled=None):
+    """
+    Render an EDL to output_path in one FFmpeg pass.
+
+    Args:
+        ffmpeg_path: FFmpeg executable
+        edl: EDL dict
+        media: {source path: probe_streams() result}
+        output_path: Output .mp4
+        narration_chunks: Narration chunk audio files, streamed in through stdin
+        narration_tempo: Tempo applied to the narration
+        progress: Optional callback taking (percent, message)
+        check_cancelled: Optional callable that raises to stop the render
+
+    Returns:
+        (output_path, duration)
+    """
+    progress = progress or (lambda percent, message: None)
+    inputs, graph, maps, total = compile_edl(edl, media, narration_tempo if narration_chunks else None)
+    if narration_chunks:
+        inputs += chunk_input_args(narration_chunks)
+
+    command = [ffmpeg_path, '-hide_banner', '-nostats', '-progress', 'pipe:1', *inputs,
+               '-filter_complex', graph, *maps,
+               '-c:v', 'libx264', '-c:a', 'aac', '-b:a', '192k', '-movflags', '+faststart',
+               '-y', output_path]
+    logging.info(f"Rendering EDL ({len(edl['segments'])} segments, {total:.1f}s) to {output_path}")
+
+    writer = (lambda pipe: stream_chunks(narration_chunks, pipe)) if narration_chunks else None
+    # Progress is read here rather than in a runner callback so it's reported on the job's own thread
+    with ffmpeg_runner.start(command, stdin=writer, stdout=True) as process:
+        for raw in process.stdout:
+            key, _, value = raw.decode('utf-8', errors='replace').strip().partition('=')
+            if key == 'out_time_us' and value.isdigit() and total > 0:
+                done = min(int(value) / 1e6, total)
+                progress(int(5 + 90 * done / total), f"Rendering {done:.0f}s / {total:.0f}s...")
+                if check_cancelled:
+                    check_cancelled()
+        process.wait()
+    return output_path, total
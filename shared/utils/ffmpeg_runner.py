@@ -0,0 +1,401 @@
+"""
+Central FFmpeg / ffprobe process manager
+
+Every FFmpeg and ffprobe process is started through here, so cuts, merges,
+narration, previews and probes can't oversubscribe the CPU and starve a
+live screen capture:
+- A bounded pool: at most `max_workers` non-live processes run at once; the
+  rest wait, interactive work ahead of background work, FIFO within a priority
+- Live capture (gdigrab / dshow) is never queued. While a capture runs, the
+  pool shrinks to `max_workers_while_live` and background processes run at
+  a lower OS priority
+- Per-process timeouts and cancellation: the process is killed when its
+  timeout expires, when cancel() is called, or when the background job that
+  started it is cancelled (see shared.utils.jobs), also while still queued
+- stderr is drained on a thread into a ring buffer (for error messages),
+  optionally mirrored to a log file, and FFmpeg's `time=` stats are parsed
+  into progress callbacks
+"""
+import os
+import re
+import time
+import heapq
+import logging
+import itertools
+import threading
+import subprocess
+from collections import deque
+
+from shared.utils import jobs
+
+# Priorities (lower runs first)
+LIVE = 0          # screen / microphone capture: started immediately, never queued
+INTERACTIVE = 1   # probes, edits and renders a user is waiting on
+BACKGROUND = 2    # previews, timeline assets
+
+DEFAULT_MAX_WORKERS = 2
+# Lines of stderr kept per process
+STDERR_RING_LINES = 200
+
+_TIME_PATTERN = re.compile(r'time=\s*(-?\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+class FFmpegError(RuntimeError):
+    """FFmpeg / ffprobe exited with an error"""
+
+    def __init__(self, message, returncode=None, stderr=''):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class FFmpegTimeout(FFmpegError):
+    """The process ran longer than its timeout and was killed"""
+
+
+class FFmpegCancelled(FFmpegError):
+    """The process was cancelled with FFmpegProcess.cancel()"""
+
+
+class FFmpegResult:
+    """Outcome of FFmpegRunner.run()"""
+
+    def __init__(self, command, returncode, stdout, stderr):
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def _tool_name(command):
+    return 'ffprobe' if 'ffprobe' in os.path.basename(str(command[0])).lower() else 'FFmpeg'
+
+
+def parse_progress_time(line):
+    """Seconds from a FFmpeg stats line ('... time=00:01:02.50 ...'), or None"""
+    match = _TIME_PATTERN.search(line)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class FFmpegProcess:
+    """A started FFmpeg / ffprobe process (see FFmpegRunner.start)"""
+
+    def __init__(self, runner, command, priority, popen, timeout, on_progress, on_stderr, log_path, stdin_writer):
+        self.command = command
+        self.priority = priority
+        self.popen = popen
+        self.name = _tool_name(command)
+        self.stdout = popen.stdout
+        self.stdin = None if stdin_writer else popen.stdin
+        self.out_time = 0.0
+        self.started_at = time.time()
+        self.killed_reason = None
+        self._runner = runner
+        self._timeout = timeout
+        self._on_progress = on_progress
+        self._on_stderr = on_stderr
+        self._stderr = deque(maxlen=STDERR_RING_LINES)
+        self._cancel_event = threading.Event()
+        job = jobs.current_job()
+        self._job_cancel_event = job.cancel_event if job is not None else None
+        self._done = threading.Event()
+
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, args=(log_path,), daemon=True)
+        self._stderr_thread.start()
+        self._stdin_thread = None
+        if stdin_writer:
+            self._stdin_thread = threading.Thread(target=stdin_writer, args=(popen.stdin,), daemon=True)
+            self._stdin_thread.start()
+        threading.Thread(target=self._watch, daemon=True, name='ffmpeg-watch').start()
+
+    @property
+    def pid(self):
+        return self.popen.pid
+
+    @property
+    def returncode(self):
+        return self.popen.returncode
+
+    def _drain_stderr(self, log_path):
+        # FFmpeg ends stats lines with \r, so split on both line endings
+        log_file = open(log_path, 'w', encoding='utf-8') if log_path else None
+        try:
+            pending = b''
+            for block in iter(lambda: self.popen.stderr.read1(4096), b''):
+                lines = re.split(rb'[\r\n]', pending + block)
+                pending = lines.pop()
+                for raw in lines:
+                    if raw:
+                        self._stderr_line(raw.decode('utf-8', errors='replace'), log_file)
+            if pending:
+                self._stderr_line(pending.decode('utf-8', errors='replace'), log_file)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if log_file:
+                log_file.close()
+
+    def _stderr_line(self, line, log_file):
+        self._stderr.append(line)
+        if log_file:
+            log_file.write(line + '\n')
+            log_file.flush()
+        if self._on_stderr:
+            self._on_stderr(line)
+        seconds = parse_progress_time(line)
+        if seconds is not None:
+            self.out_time = seconds
+            if self._on_progress:
+                self._on_progress(seconds)
+
+    def _watch(self):
+        deadline = time.monotonic() + self._timeout if self._timeout else None
+        try:
+            while True:
+                try:
+                    self.popen.wait(0.25)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if deadline is not None and time.monotonic() > deadline:
+                    self._kill('timeout')
+                elif self._cancel_event.is_set() or (self._job_cancel_event and self._job_cancel_event.is_set()):
+                    self._kill('cancelled')
+        finally:
+            self._runner._release(self.priority)
+            self._done.set()
+
+    def _kill(self, reason):
+        if self.killed_reason is None:
+            self.killed_reason = reason
+            logging.warning(f"{self.name} process {self.pid} {reason}, killing it")
+        try:
+            self.popen.kill()
+        except OSError:
+            pass
+
+    def cancel(self):
+        """Kill the process; wait() then raises FFmpegCancelled"""
+        self._cancel_event.set()
+        self._kill('cancelled')
+
+    def stderr_text(self, lines=None):
+        """The last `lines` lines of stderr (all lines kept in the ring buffer by default)"""
+        kept = list(self._stderr)
+        return '\n'.join(kept[-lines:] if lines else kept)
+
+    def wait(self, check=True):
+        """
+        Wait for the process to exit.
+
+        Raises:
+            FFmpegTimeout / FFmpegCancelled when it was killed, jobs.JobCancelled
+            when its background job was cancelled, FFmpegError for a non-zero
+            exit code if check is set
+
+        Returns:
+            Exit code
+        """
+        self._done.wait()
+        self._stderr_thread.join(5)
+        if self._stdin_thread:
+            self._stdin_thread.join(5)
+        if self.killed_reason == 'timeout':
+            raise FFmpegTimeout(f"{self.name} timed out after {self._timeout}s", self.returncode, self.stderr_text())
+        if self.killed_reason == 'cancelled':
+            if not self._cancel_event.is_set():
+                raise jobs.JobCancelled()
+            raise FFmpegCancelled(f"{self.name} cancelled", self.returncode, self.stderr_text())
+        if check and self.returncode != 0:
+            stderr = self.stderr_text()
+            raise FFmpegError(f"{self.name} error: {stderr[-2000:]}", self.returncode, stderr)
+        return self.returncode
+
+    def stop(self, timeout=10):
+        """Stop a capture gracefully ('q' on stdin, so the file is finalized), then terminate or kill"""
+        try:
+            if self.stdin and not self.stdin.closed:
+                self.stdin.write(b'q')
+                self.stdin.flush()
+                self.stdin.close()
+            self.popen.wait(timeout=timeout)
+        except Exception as e:
+            logging.warning(f"Graceful stop of {self.name} ({self.pid}) failed: {e}, terminating")
+            try:
+                self.popen.terminate()
+                self.popen.wait(timeout=5)
+            except Exception:
+                self.popen.kill()
+                self.popen.wait()
+        self._done.wait()
+        self._stderr_thread.join(5)
+        return self.returncode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None and self.popen.poll() is None:
+            self._kill('cancelled' if issubclass(exc_type, jobs.JobCancelled) else 'aborted')
+            self.popen.wait()
+        for pipe in (self.popen.stdout, self.stdin):
+            if pipe:
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+        return False
+
+
+class FFmpegRunner:
+    """
+    Args:
+        max_workers: Non-live processes allowed to run at once
+        max_workers_while_live: The same while a live capture is running
+        default_timeout: Seconds a non-live process may run when the caller gives no timeout
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_workers_while_live=1, default_timeout=None):
+        self.max_workers = max_workers
+        self.max_workers_while_live = max_workers_while_live
+        self.default_timeout = default_timeout
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._live = 0
+
+    def configure(self, max_workers=None, max_workers_while_live=None, default_timeout=None):
+        with self._cond:
+            if max_workers is not None:
+                self.max_workers = max(1, int(max_workers))
+            if max_workers_while_live is not None:
+                self.max_workers_while_live = max(1, int(max_workers_while_live))
+            if default_timeout is not None:
+                self.default_timeout = float(default_timeout) or None
+            self._cond.notify_all()
+
+    def _limit(self):
+        return min(self.max_workers, self.max_workers_while_live) if self._live else self.max_workers
+
+    def _acquire(self, priority):
+        job = jobs.current_job()
+        with self._cond:
+            if priority == LIVE:
+                self._live += 1
+                return
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while self._waiting[0] != ticket or self._running >= self._limit():
+                    if job is not None and job.cancel_requested:
+                        raise jobs.JobCancelled()
+                    self._cond.wait(0.5)
+                heapq.heappop(self._waiting)
+                self._running += 1
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                raise
+            finally:
+                self._cond.notify_all()
+
+    def _release(self, priority):
+        with self._cond:
+            if priority == LIVE:
+                self._live -= 1
+            else:
+                self._running -= 1
+            self._cond.notify_all()
+
+    def _creation_flags(self, priority):
+        if os.name != 'nt':
+            return 0
+        flags = subprocess.CREATE_NO_WINDOW
+        if priority == LIVE:
+            flags |= subprocess.ABOVE_NORMAL_PRIORITY_CLASS
+        elif priority == BACKGROUND or self._live:
+            flags |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        return flags
+
+    def start(self, command, priority=INTERACTIVE, timeout=None, cwd=None, stdin=None, stdout=False,
+              on_progress=None, on_stderr=None, log_path=None):
+        """
+        Start a process once the pool has room for it.
+
+        Args:
+            command: Argument list, starting with the ffmpeg / ffprobe executable
+            priority: LIVE, INTERACTIVE or BACKGROUND
+            timeout: Seconds before the process is killed (default_timeout if None; never for LIVE)
+            cwd: Working directory
+            stdin: None (no input), subprocess.PIPE (process.stdin, e.g. to send 'q'),
+                or a callable writing to the pipe on its own thread (it should close it)
+            stdout: True to read output from process.stdout
+            on_progress: Called with the seconds of output written, from FFmpeg's stats
+            on_stderr: Called with each stderr line (both callbacks run on the stderr thread)
+            log_path: File that receives the full stderr
+
+        Returns:
+            FFmpegProcess
+        """
+        command = [str(part) for part in command]
+        self._acquire(priority)
+        try:
+            popen = subprocess.Popen(
+                command,
+                cwd=cwd,
+                stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+                stdout=subprocess.PIPE if stdout else subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                creationflags=self._creation_flags(priority)
+            )
+        except BaseException:
+            self._release(priority)
+            raise
+        if os.name != 'nt' and (priority == BACKGROUND or (priority == INTERACTIVE and self._live)):
+            try:
+                os.setpriority(os.PRIO_PROCESS, popen.pid, 10)
+            except (AttributeError, OSError):
+                pass
+        if priority == LIVE:
+            timeout = None
+        elif timeout is None:
+            timeout = self.default_timeout
+        return FFmpegProcess(self, command, priority, popen, timeout, on_progress, on_stderr, log_path,
+                             stdin if callable(stdin) else None)
+
+    def run(self, command, priority=INTERACTIVE, timeout=None, text=True, check=True, **kwargs):
+        """
+        Run a process to completion, capturing stdout.
+
+        Returns:
+            FFmpegResult with returncode, stdout (str if text) and the stderr ring buffer
+        """
+        with self.start(command, priority, timeout, stdout=True, **kwargs) as process:
+            output = process.stdout.read()
+            process.wait(check=check)
+        if text:
+            output = output.decode('utf-8', errors='replace')
+        return FFmpegResult(command, process.returncode, output, process.stderr_text())
+
+    def status(self):
+        with self._cond:
+            return {'live': self._live, 'running': self._running, 'queued': len(self._waiting),
+                    'max_workers': self._limit()}
+
+
+# Shared by every FFmpeg / ffprobe call site in the process
+runner = FFmpegRunner()
+
+
+def start(command, **kwargs):
+    """FFmpegRunner.start() on the shared runner"""
+    return runner.start(command, **kwargs)
+
+
+def run(command, **kwargs):
+    """FFmpegRunner.run() on the shared runner"""
+    return runner.run(command, **kwargs)
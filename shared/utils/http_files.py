@@ -0,0 +1,182 @@
+"""
+Conditional and partial file responses
+
+Used by the web app's media, image and SOP endpoints and by the desktop
+editor server, so both answer the same way:
+- Strong ETags: a content hash for small files (screenshots, SOP pages),
+  size + mtime for large ones (videos), where hashing would cost a full read
+- Last-Modified, with If-None-Match / If-Modified-Since answered by 304
+- Single byte ranges (Range / If-Range) answered by 206, or 416 when the
+  range is outside the file; multi-range requests get the whole file
+- Cache-Control: long-lived and immutable for content that never changes
+  under the same URL, otherwise revalidate on every use
+
+plan_file_response() only decides status and headers; the caller sends the
+body with iter_file().
+"""
+import os
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+# Files up to this size get a content-hash ETag
+HASH_ETAG_MAX_BYTES = 8 * 1024 * 1024
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+CHUNK_SIZE = 64 * 1024
+
+_hash_cache = {}
+_hash_cache_lock = threading.Lock()
+
+
+def file_etag(path, stat=None):
+    """Strong ETag (quoted) for a file"""
+    stat = stat or os.stat(path)
+    if stat.st_size > HASH_ETAG_MAX_BYTES:
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    key = os.path.abspath(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _hash_cache_lock:
+        cached = _hash_cache.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    etag = f'"{digest.hexdigest()[:32]}"'
+    with _hash_cache_lock:
+        if len(_hash_cache) > 4096:
+            _hash_cache.clear()
+        _hash_cache[key] = (signature, etag)
+    return etag
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header for a file of `size` bytes.
+
+    Returns:
+        (start, end) inclusive for a single satisfiable range; None to send the
+        whole file (no header, unsupported unit, malformed or multiple ranges);
+        'unsatisfiable' when the range lies outside the file
+    """
+    if not header:
+        return None
+    unit, _, spec = header.strip().partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    first, last = first.strip(), last.strip()
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                return 'unsatisfiable'
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header, etag, weak=True):
+    """If-None-Match (weak comparison) / If-Range (strong) against our ETag"""
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if weak and candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+
+
+def plan_file_response(path, headers, content_type, immutable=False, method='GET'):
+    """
+    Decide how to answer a request for a file.
+
+    Args:
+        path: File to send
+        headers: Request headers (any mapping with .get(), case handled by the caller's mapping)
+        content_type: Content-Type of the file
+        immutable: Content never changes under this URL (long-lived caching)
+        method: 'GET' or 'HEAD'
+
+    Returns:
+        (status, response_headers, body_range) - body_range is (start, length) of
+        the bytes to send, or None for no body
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(path, stat)
+    response_headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return 304, response_headers, None
+    elif headers.get('If-Modified-Since') and _not_modified_since(headers.get('If-Modified-Since'), stat.st_mtime):
+        return 304, response_headers, None
+
+    byte_range = parse_range(headers.get('Range'), size)
+    if_range = headers.get('If-Range')
+    if byte_range is not None and if_range:
+        # Only honour the range if the client's copy is still current
+        if if_range.strip().startswith(('"', 'W/')):
+            current = _etag_matches(if_range, etag, weak=False)
+        else:
+            current = _not_modified_since(if_range, stat.st_mtime)
+        if not current:
+            byte_range = None
+
+    response_headers['Content-Type'] = content_type
+    if byte_range == 'unsatisfiable':
+        response_headers['Content-Range'] = f'bytes */{size}'
+        response_headers['Content-Length'] = '0'
+        return 416, response_headers, None
+    if byte_range is None:
+        response_headers['Content-Length'] = str(size)
+        return 200, response_headers, ((0, size) if method != 'HEAD' else None)
+
+    start, end = byte_range
+    response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response_headers['Content-Length'] = str(end - start + 1)
+    return 206, response_headers, ((start, end - start + 1) if method != 'HEAD' else None)
+
+
+def iter_file(path, start, length, chunk_size=CHUNK_SIZE):
+    """Yield `length` bytes of a file from `start`"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(chunk_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
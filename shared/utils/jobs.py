@@ -0,0 +1,273 @@
+"""
+Background job queue for long-running AI and FFmpeg operations
+
+Jobs run on a bounded thread pool. Their state (status, progress, result)
+is written to a JSON file so finished results survive a server restart;
+jobs that were still queued or running when the process died are marked
+as interrupted on the next start.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Job statuses
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+INTERRUPTED = 'interrupted'
+
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED, INTERRUPTED)
+
+# Thread-local pointer to the job executing on the current worker thread
+_local = threading.local()
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job when cancellation has been requested.
+
+    Derives from BaseException (like asyncio.CancelledError) so the broad
+    `except Exception` handlers in the endpoints don't swallow it.
+    """
+
+
+class JobFailed(Exception):
+    """Raised by a job function to fail with a structured result payload"""
+
+    def __init__(self, message, payload=None):
+        super().__init__(message)
+        self.payload = payload
+
+
+class Job:
+    """State of a single background job"""
+
+    def __init__(self, operation, params=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.operation = operation
+        self.params = params or {}
+        self.status = QUEUED
+        self.progress = 0
+        self.message = 'Queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancel_requested(self):
+        return self.cancel_event.is_set()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'operation': self.operation,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cancel_requested': self.cancel_requested
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data.get('operation', 'unknown'), data.get('params'), job_id=data.get('job_id'))
+        job.status = data.get('status', INTERRUPTED)
+        job.progress = data.get('progress', 0)
+        job.message = data.get('message', '')
+        job.result = data.get('result')
+        job.error = data.get('error')
+        job.created_at = data.get('created_at', time.time())
+        job.started_at = data.get('started_at')
+        job.finished_at = data.get('finished_at')
+        if data.get('cancel_requested'):
+            job.cancel_event.set()
+        return job
+
+
+class JobManager:
+    """Bounded worker pool with persisted job state"""
+
+    def __init__(self, state_path, max_workers=2, max_history=200):
+        self.state_path = state_path
+        self.max_history = max_history
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Serializes writes of jobs.json; snapshots are numbered so an older one never replaces a newer one
+        self._write_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._written_seq = 0
+        self._last_persist = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hs-job')
+        self._load()
+
+    def _load(self):
+        """Load persisted jobs; anything unfinished from a previous run is interrupted"""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for data in saved:
+                job = Job.from_dict(data)
+                if job.status not in FINISHED_STATUSES:
+                    job.status = INTERRUPTED
+                    job.message = 'Interrupted by server restart'
+                    job.finished_at = time.time()
+                self._jobs[job.id] = job
+            logging.info(f"Loaded {len(self._jobs)} jobs from {self.state_path}")
+        except Exception as e:
+            logging.warning(f"Could not load job state from {self.state_path}: {e}")
+
+    def _persist(self, force=True):
+        """Write job state to disk (atomic replace). Progress-only updates are throttled."""
+        now = time.time()
+        if not force and now - self._last_persist < 1.0:
+            return
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j.created_at)
+            # Drop the oldest finished jobs beyond the history limit
+            finished = [j for j in jobs if j.status in FINISHED_STATUSES]
+            for old in finished[:max(0, len(jobs) - self.max_history)]:
+                del self._jobs[old.id]
+            snapshot = [j.to_dict() for j in sorted(self._jobs.values(), key=lambda j: j.created_at)]
+            self._last_persist = now
+            self._snapshot_seq += 1
+            seq = self._snapshot_seq
+        with self._write_lock:
+            if seq <= self._written_seq:
+                return  # A newer snapshot was written while this one waited
+            try:
+                os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+                temp_path = self.state_path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, indent=2, default=str)
+                os.replace(temp_path, self.state_path)
+                self._written_seq = seq
+            except Exception as e:
+                logging.warning(f"Could not persist job state: {e}")
+
+    def submit(self, operation, func, params=None):
+        """
+        Queue func() to run in the worker pool.
+
+        Args:
+            operation: Short name of the operation (e.g. 'generate_guide')
+            func: Callable taking no arguments, returning a JSON-serializable result
+            params: Request parameters, stored for display and diagnostics
+
+        Returns:
+            The queued Job
+        """
+        job = Job(operation, params)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._persist()
+        self._executor.submit(self._run, job, func)
+        logging.info(f"Job {job.id} queued: {operation}")
+        return job
+
+    def _run(self, job, func):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED, message='Cancelled before start')
+            return
+
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.message = 'Running'
+        self._persist()
+        _local.job = job
+        _local.manager = self
+        try:
+            result = func()
+            job.progress = 100
+            self._finish(job, COMPLETED, result=result, message='Completed')
+        except JobCancelled:
+            self._finish(job, CANCELLED, message='Cancelled')
+        except JobFailed as e:
+            self._finish(job, FAILED, result=e.payload, error=str(e), message='Failed')
+        except Exception as e:
+            logging.error(f"Job {job.id} ({job.operation}) failed: {e}", exc_info=True)
+            self._finish(job, FAILED, error=str(e), message='Failed')
+        finally:
+            _local.job = None
+            _local.manager = None
+
+    def _finish(self, job, status, result=None, error=None, message=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        if message:
+            job.message = message
+        job.finished_at = time.time()
+        self._persist()
+        logging.info(f"Job {job.id} ({job.operation}) {status}")
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, limit=50):
+        jobs = sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+        return jobs[:limit]
+
+    def cancel(self, job_id):
+        """Request cancellation. Returns the job, or None if it does not exist."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status not in FINISHED_STATUSES:
+            job.cancel_event.set()
+            job.message = 'Cancelling...'
+            self._persist()
+            logging.info(f"Cancellation requested for job {job_id}")
+        return job
+
+    def update_progress(self, job, progress=None, message=None):
+        if progress is not None:
+            job.progress = max(0, min(100, int(progress)))
+        if message is not None:
+            job.message = message
+        self._persist(force=False)
+
+
+def current_job():
+    """Return the Job running on this thread, or None outside a worker"""
+    return getattr(_local, 'job', None)
+
+
+def report_progress(progress=None, message=None):
+    """Update progress of the current job (no-op outside a worker)"""
+    job = current_job()
+    manager = getattr(_local, 'manager', None)
+    if job is not None and manager is not None:
+        manager.update_progress(job, progress, message)
+
+
+def check_cancelled():
+    """Raise JobCancelled if the current job has been cancelled"""
+    job = current_job()
+    if job is not None and job.cancel_requested:
+        raise JobCancelled()
+
+
+def sleep(seconds):
+    """time.sleep() that wakes up early (raising JobCancelled) when the current job is cancelled"""
+    job = current_job()
+    if job is None:
+        time.sleep(seconds)
+        return
+    job.cancel_event.wait(seconds)
+    check_cancelled()
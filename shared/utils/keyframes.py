@@ -0,0 +1,284 @@
+"""
+Keyframe selection for video-mode guides
+
+Picks the frames of a screen recording that matter for a how-to guide:
+the moment just before each mouse click in actions.log, plus frames where
+the screen changes substantially (FFmpeg scene-change score). Everything
+happens in one FFmpeg pass; candidate frames are piped back as PNG bytes
+and never written to disk, and the budget is applied as they arrive, so only
+a budget's worth of scene-change frames is held in memory at a time.
+"""
+import os
+import re
+import json
+import heapq
+import logging
+import threading
+
+from shared.utils import ffmpeg_runner
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Show the screen slightly before the click, while the target is still visible
+CLICK_LEAD_SECONDS = 0.3
+
+RECORDING_META_FILE = 'recording_meta.json'
+
+
+class Keyframe:
+    """A selected frame: video time, why it was picked, and its PNG bytes"""
+
+    def __init__(self, time, reason, score=0.0, png=None):
+        self.time = time
+        self.reason = reason  # 'start', 'click' or 'scene'
+        self.score = score
+        self.png = png
+
+    def __repr__(self):
+        return f"Keyframe(t={self.time:.2f}, reason={self.reason}, score={self.score:.2f})"
+
+
+def read_recording_start(scribble_dir):
+    """Epoch time the screen recording started, if it was recorded"""
+    meta_path = os.path.join(scribble_dir, RECORDING_META_FILE)
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return float(json.load(f)['started_at'])
+        except Exception as e:
+            logging.warning(f"Could not read {meta_path}: {e}")
+    return None
+
+
+def read_click_times(actions_path, video_start=None):
+    """
+    Click times from actions.log, in seconds from the start of the video.
+
+    Args:
+        actions_path: Path to actions.log ("<epoch> CLICK <button> at (x,y)" lines)
+        video_start: Epoch time the video started; falls back to the log's
+            "# Started at" header, then to the first logged event
+    """
+    if not os.path.exists(actions_path):
+        return []
+
+    clicks = []
+    first_event = None
+    log_start = None
+    with open(actions_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            header = re.match(r'#\s*Started at\s+([\d.]+)', line)
+            if header:
+                log_start = float(header.group(1))
+                continue
+            parts = line.split()
+            if len(parts) < 2:
+                continue
+            try:
+                when = float(parts[0])
+            except ValueError:
+                continue  # "[HH:MM:SS] Screenshot N captured" lines etc.
+            if first_event is None:
+                first_event = when
+            if parts[1] == 'CLICK':
+                clicks.append(when)
+
+    start = video_start or log_start or first_event
+    if start is None:
+        return []
+    return [round(t - start, 3) for t in clicks if t >= start]
+
+
+def _build_select_expr(click_times, scene_threshold, min_gap, frame_window):
+    """select= expression: first frame, frames just before clicks, and scene changes"""
+    fixed = ['eq(n,0)']
+    for t in click_times:
+        target = max(0.0, t - CLICK_LEAD_SECONDS)
+        fixed.append(f'between(t,{target:.3f},{target + frame_window:.3f})')
+    # Scene changes closer than min_gap to the previously selected frame are dropped;
+    # start and click frames never are, so a fast action right after a scene change is kept
+    spacing = f'(isnan(prev_selected_t)+gte(t-prev_selected_t,{min_gap}))'
+    return f"{'+'.join(fixed)}+gt(scene,{scene_threshold})*{spacing}"
+
+
+def _read_pngs(stream):
+    """Yield complete PNG images from a concatenated image2pipe stream"""
+    buffer = bytearray()
+    pos = None  # Offset of the next PNG chunk header in the current image, once its signature is seen
+    while True:
+        chunk = stream.read(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        while True:
+            if pos is None:
+                if len(buffer) < len(PNG_SIGNATURE):
+                    break
+                if not buffer.startswith(PNG_SIGNATURE):
+                    start = buffer.find(PNG_SIGNATURE)
+                    if start < 0:
+                        # Keep a possible partial signature at the end
+                        del buffer[:-(len(PNG_SIGNATURE) - 1)]
+                        break
+                    del buffer[:start]
+                pos = len(PNG_SIGNATURE)
+            # Walk the chunk list to find IEND; each chunk is length + type + data + CRC.
+            # pos carries over between reads, so each byte is scanned once
+            end = None
+            while pos + 8 <= len(buffer):
+                length = int.from_bytes(buffer[pos:pos + 4], 'big')
+                next_pos = pos + 12 + length
+                if buffer[pos + 4:pos + 8] == b'IEND':
+                    if next_pos <= len(buffer):
+                        end = next_pos
+                    break
+                pos = next_pos
+            if end is None:
+                break
+            yield bytes(buffer[:end])
+            del buffer[:end]
+            pos = None
+
+
+class _FrameMetadata:
+    """Collects metadata=print output from FFmpeg's stderr as it arrives: [time, scene score] per frame"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = []
+
+    def add_line(self, line):
+        match = re.search(r'frame:\s*\d+\s+pts:\s*\S+\s+pts_time:\s*([\d.]+)', line)
+        if match:
+            with self._lock:
+                self.frames.append([float(match.group(1)), 0.0])
+            return
+        match = re.search(r'lavfi\.scene_score=([\d.]+)', line)
+        if match:
+            with self._lock:
+                if self.frames:
+                    self.frames[-1][1] = float(match.group(1))
+
+    def complete(self, index):
+        """True once frame `index`'s record is complete (the next frame's record has started)"""
+        with self._lock:
+            return len(self.frames) > index + 1
+
+    def get(self, index):
+        with self._lock:
+            return tuple(self.frames[index]) if index < len(self.frames) else (0.0, 0.0)
+
+
+def select_keyframes(video_path, ffmpeg_path='ffmpeg', click_times=None, budget=10,
+                     scene_threshold=0.3, min_gap=1.0, max_width=1280, timeout=600):
+    """
+    Pick up to `budget` keyframes from a recording in a single FFmpeg pass.
+
+    Args:
+        video_path: Recording to analyze
+        ffmpeg_path: FFmpeg executable
+        click_times: Click times in seconds from video start (see read_click_times)
+        budget: Maximum number of frames to return
+        scene_threshold: Scene-change score (0-1) that makes a frame a candidate
+        min_gap: Minimum seconds between candidate frames
+        max_width: Frames wider than this are scaled down
+        timeout: Seconds before FFmpeg is killed
+
+    Returns:
+        List of Keyframe in time order, each with PNG bytes
+    """
+    click_times = sorted(click_times or [])
+    if len(click_times) > budget:
+        # More clicks than budget: only an even spread of them can be picked, so only select those
+        step = len(click_times) / budget
+        click_times = [click_times[int(i * step)] for i in range(budget)]
+    select_expr = _build_select_expr(click_times, scene_threshold, min_gap, frame_window=0.05)
+    command = [
+        ffmpeg_path, '-hide_banner', '-nostats', '-loglevel', 'info',
+        '-i', video_path,
+        '-an',
+        '-vf', f"select='{select_expr}',metadata=mode=print,scale='min({max_width},iw)':-2",
+        '-vsync', 'vfr',
+        '-f', 'image2pipe', '-vcodec', 'png',
+        'pipe:1'
+    ]
+
+    # Start and click frames are at most budget + 1; of the scene changes only the `budget`
+    # strongest can ever be picked, so weaker ones are dropped as soon as they arrive
+    metadata = _FrameMetadata()
+    fixed = []
+    scenes = []  # Min-heap of (score, index, Keyframe)
+    click_targets = [max(0.0, t - CLICK_LEAD_SECONDS) for t in click_times]
+    claimed = set()  # Click windows can hold several frames at high frame rates; keep the first
+
+    def keep(index, png):
+        time_s, score = metadata.get(index)
+        frame = Keyframe(time_s, 'scene', score, png)
+        clicks = [i for i, target in enumerate(click_targets) if abs(frame.time - target) <= 0.1]
+        if frame.time < 0.05:
+            frame.reason = 'start'
+        elif clicks:
+            unclaimed = [i for i in clicks if i not in claimed]
+            if not unclaimed:
+                return
+            claimed.add(unclaimed[0])
+            frame.reason = 'click'
+        if frame.reason != 'scene':
+            fixed.append(frame)
+        elif len(scenes) < budget:
+            heapq.heappush(scenes, (score, index, frame))
+        else:
+            heapq.heappushpop(scenes, (score, index, frame))
+
+    pending = []
+    frame_count = 0
+    with ffmpeg_runner.start(command, timeout=timeout, stdout=True, on_stderr=metadata.add_line) as process:
+        for index, png in enumerate(_read_pngs(process.stdout)):
+            frame_count += 1
+            pending.append((index, png))
+            while pending and metadata.complete(pending[0][0]):
+                keep(*pending.pop(0))
+        process.wait(check=False)
+    # stderr has been read to the end by now
+    for index, png in pending:
+        keep(index, png)
+
+    if process.returncode != 0 and not frame_count:
+        tail = process.stderr_text(20)
+        raise RuntimeError(f"FFmpeg keyframe extraction failed ({process.returncode}): {tail}")
+
+    if len(metadata.frames) != frame_count:
+        logging.warning(f"Keyframes: {frame_count} frames but {len(metadata.frames)} metadata records")
+
+    candidates = sorted(fixed + [frame for _, _, frame in scenes], key=lambda f: f.time)
+    selected = _apply_budget(candidates, budget)
+    logging.info(f"Keyframes: {frame_count} candidates from {len(click_times)} clicks, "
+                 f"selected {len(selected)} (budget {budget})")
+    return selected
+
+
+def _apply_budget(candidates, budget):
+    """Keep the start frame and clicks first, then the strongest scene changes"""
+    if len(candidates) <= budget:
+        return candidates
+    priority = {'start': 0, 'click': 1, 'scene': 2}
+    ranked = sorted(candidates, key=lambda f: (priority[f.reason], -f.score))
+    if sum(1 for f in candidates if f.reason != 'scene') > budget:
+        # More clicks than budget: spread the picks evenly over the recording
+        clicks = [f for f in candidates if f.reason != 'scene']
+        step = len(clicks) / budget
+        kept = [clicks[int(i * step)] for i in range(budget)]
+    else:
+        kept = ranked[:budget]
+    return sorted(kept, key=lambda f: f.time)
+
+
+def select_recording_keyframes(scribble_dir, ffmpeg_path='ffmpeg', budget=10, **kwargs):
+    """select_keyframes() for a recording folder, using its actions.log clicks"""
+    video_path = os.path.join(scribble_dir, 'recording.mp4')
+    click_times = read_click_times(
+        os.path.join(scribble_dir, 'actions.log'),
+        video_start=read_recording_start(scribble_dir)
+    )
+    return select_keyframes(video_path, ffmpeg_path=ffmpeg_path, click_times=click_times,
+                            budget=budget, **kwargs)
@@ -0,0 +1,189 @@
+"""
+Cached media metadata
+
+The video editor asks for the same file's duration, streams and frame rate
+over and over, and every answer used to start an ffprobe subprocess. This
+cache keeps one entry per file (keyed by normalized path) with its
+metadata and, once requested, its keyframe index. An entry is valid while
+the file's size and modification time match; entries are saved to a JSON
+file so they survive restarts.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from shared.utils import ffmpeg_runner
+from shared.utils.video_cut import probe_keyframes
+
+# Least recently used entries beyond this are dropped
+MAX_ENTRIES = 500
+
+
+def _frame_rate(rate):
+    """'30000/1001' -> 29.97"""
+    try:
+        num, den = rate.split('/')
+        return float(num) / float(den) if float(den) else 0.0
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def run_ffprobe(ffprobe_path, path, timeout=30):
+    """
+    Probe a media file once for everything the editor and cutters need.
+
+    Returns:
+        Dict with duration, size, bit_rate, codec, pix_fmt, width, height, fps,
+        has_audio and a streams list (index, type, codec and type-specific fields)
+    """
+    result = ffmpeg_runner.run(
+        [ffprobe_path, '-v', 'error',
+         '-show_entries', 'stream=index,codec_type,codec_name,pix_fmt,width,height,r_frame_rate,'
+                          'sample_rate,channels,duration:format=duration,bit_rate',
+         '-of', 'json', path],
+        timeout=timeout
+    )
+    probe = json.loads(result.stdout)
+
+    streams = []
+    for stream in probe.get('streams', []):
+        entry = {'index': stream.get('index'), 'type': stream.get('codec_type'), 'codec': stream.get('codec_name'),
+                 'duration': _float(stream.get('duration'))}
+        if stream.get('codec_type') == 'video':
+            entry.update(width=stream.get('width'), height=stream.get('height'), pix_fmt=stream.get('pix_fmt'),
+                         fps=_frame_rate(stream.get('r_frame_rate')))
+        elif stream.get('codec_type') == 'audio':
+            entry.update(sample_rate=int(stream.get('sample_rate') or 0), channels=stream.get('channels'))
+        streams.append(entry)
+
+    video = next((s for s in streams if s['type'] == 'video'), {})
+    duration = _float(probe.get('format', {}).get('duration')) or video.get('duration')
+    return {
+        'duration': duration,
+        'bit_rate': int(_float(probe.get('format', {}).get('bit_rate')) or 0),
+        'codec': video.get('codec'),
+        'pix_fmt': video.get('pix_fmt') or 'yuv420p',
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'fps': video.get('fps', 0.0),
+        'has_audio': any(s['type'] == 'audio' for s in streams),
+        'streams': streams
+    }
+
+
+class MediaProbeCache:
+    """
+    Args:
+        cache_path: JSON file the entries are saved to
+        ffprobe_path: FFprobe executable, or a callable returning it
+    """
+
+    def __init__(self, cache_path, ffprobe_path='ffprobe'):
+        self.cache_path = cache_path
+        self._ffprobe_path = ffprobe_path
+        self._lock = threading.Lock()
+        self._path_locks = {}
+        self._hits = 0
+        self._misses = 0
+        self._entries = self._load()
+
+    @property
+    def ffprobe_path(self):
+        return self._ffprobe_path() if callable(self._ffprobe_path) else self._ffprobe_path
+
+    def _load(self):
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+                if isinstance(entries, dict):
+                    return entries
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable media probe cache {self.cache_path}: {e}")
+        return {}
+
+    def _save(self):
+        # Called with the lock held
+        if len(self._entries) > MAX_ENTRIES:
+            by_use = sorted(self._entries, key=lambda key: self._entries[key].get('used_at', 0))
+            for key in by_use[:len(self._entries) - MAX_ENTRIES]:
+                del self._entries[key]
+        try:
+            temp_path = self.cache_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            logging.warning(f"Could not save media probe cache: {e}")
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _path_lock(self, key):
+        # One probe per file at a time; concurrent callers wait for its result
+        with self._lock:
+            return self._path_locks.setdefault(key, threading.Lock())
+
+    def _entry(self, path, field, compute):
+        key = os.path.normcase(os.path.normpath(os.path.abspath(path)))
+        with self._path_lock(key):
+            signature = self._signature(path)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry.get('signature') != signature:
+                    entry = {'signature': signature}
+                if field in entry:
+                    self._hits += 1
+                    entry['used_at'] = time.time()
+                    self._entries[key] = entry
+                    return entry[field]
+                self._misses += 1
+
+            value = compute(path)
+            with self._lock:
+                # The file may have changed while probing; only keep what matches
+                if self._signature(path) == signature:
+                    current = self._entries.get(key)
+                    if current is None or current.get('signature') != signature:
+                        current = {'signature': signature}
+                    current[field] = value
+                    current['used_at'] = time.time()
+                    self._entries[key] = current
+                    self._save()
+            return value
+
+    def info(self, path):
+        """Metadata of a media file (see run_ffprobe), probed once per size/mtime"""
+        return self._entry(path, 'info', lambda p: run_ffprobe(self.ffprobe_path, p))
+
+    def keyframes(self, path):
+        """Keyframe times of the file's video stream, read once per size/mtime"""
+        return self._entry(path, 'keyframes', lambda p: probe_keyframes(self.ffprobe_path, p))
+
+    def prefetch(self, path, keyframes=True):
+        """Fill the cache for a file in a background thread (e.g. when a recording finishes)"""
+        def fill():
+            try:
+                self.info(path)
+                if keyframes:
+                    self.keyframes(path)
+                logging.info(f"Media probe cached for {path}")
+            except Exception as e:
+                logging.warning(f"Could not probe {path}: {e}")
+
+        threading.Thread(target=fill, daemon=True, name='media-probe').start()
+
+    def status(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self._hits, 'misses': self._misses}
@@ -0,0 +1,108 @@
+"""
+Editor previews of recordings
+
+Scrubbing a full-resolution recording in the browser stutters, especially
+over the network. For each source video one FFmpeg pass (tee muxer, single
+encode) writes a low-bitrate proxy MP4 and a fragmented-MP4 HLS playlist
+into preview/<video name>/ next to it, with a keyframe every second so
+seeking is instant. The editor plays the preview; edits are still applied
+to the original.
+
+preview.json records the source's size and mtime, so a preview of a file
+that has since changed is reported as stale and regenerated.
+"""
+import os
+import json
+import shutil
+import logging
+
+from shared.utils import ffmpeg_runner
+
+PREVIEW_DIR = 'preview'
+PREVIEW_MANIFEST = 'preview.json'
+PROXY_FILE = 'proxy.mp4'
+HLS_PLAYLIST = 'index.m3u8'
+
+DEFAULT_PREVIEW_HEIGHT = 540
+DEFAULT_PREVIEW_BITRATE = '800k'
+HLS_SEGMENT_SECONDS = 4
+
+
+def preview_dir(video_path):
+    """Folder holding the preview of video_path"""
+    folder, filename = os.path.split(os.path.abspath(video_path))
+    return os.path.join(folder, PREVIEW_DIR, os.path.splitext(filename)[0])
+
+
+def _signature(video_path):
+    stat = os.stat(video_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def preview_status(video_path):
+    """
+    Returns:
+        'ready', 'stale' (the source changed since) or 'missing'
+    """
+    manifest_path = os.path.join(preview_dir(video_path), PREVIEW_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return 'missing'
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except Exception:
+        return 'missing'
+    return 'ready' if manifest.get('source_signature') == _signature(video_path) else 'stale'
+
+
+def generate_preview(ffmpeg_path, video_path, height=DEFAULT_PREVIEW_HEIGHT, bitrate=DEFAULT_PREVIEW_BITRATE,
+                     timeout=None):
+    """
+    Write the proxy MP4 and HLS preview of a recording in one encode.
+
+    Args:
+        ffmpeg_path: FFmpeg executable
+        video_path: Source recording
+        height: Preview height in pixels (smaller sources keep their size)
+        bitrate: Target video bitrate of the preview
+
+    Returns:
+        Preview folder
+    """
+    target = preview_dir(video_path)
+    signature = _signature(video_path)
+    work_dir = target + '.tmp'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    # Relative output names (FFmpeg runs in work_dir) keep Windows drive colons out of the tee syntax
+    outputs = '|'.join([
+        f"[f=mp4:movflags=+faststart]{PROXY_FILE}",
+        f"[f=hls:hls_time={HLS_SEGMENT_SECONDS}:hls_playlist_type=vod:hls_segment_type=fmp4:"
+        f"hls_segment_filename=segment_%05d.m4s]{HLS_PLAYLIST}"
+    ])
+    command = [
+        ffmpeg_path,
+        '-y',
+        '-i', os.path.abspath(video_path),
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', f"scale=-2:'min({int(height)},ih)'",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', bitrate, '-maxrate', bitrate, '-bufsize', bitrate,
+        '-pix_fmt', 'yuv420p',
+        '-force_key_frames', 'expr:gte(t,n_forced*1)',
+        '-c:a', 'aac', '-b:a', '96k', '-ac', '2',
+        '-f', 'tee', outputs
+    ]
+    try:
+        ffmpeg_runner.run(command, priority=ffmpeg_runner.BACKGROUND, timeout=timeout, cwd=work_dir)
+
+        with open(os.path.join(work_dir, PREVIEW_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({'source': os.path.basename(video_path), 'source_signature': signature,
+                       'height': height, 'bitrate': bitrate}, f, indent=2)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(work_dir, target)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logging.info(f"Preview generated for {video_path}")
+    return target
@@ -0,0 +1,112 @@
+"""
+Request coalescing and per-recording write locks
+
+SingleFlight lets identical concurrent operations (same operation, recording
+and inputs) share one execution: the first caller runs it, later callers wait
+for and receive the same result instead of spending AI quota again.
+recording_lock() serializes writes to a recording folder so two writers never
+interleave guide.txt, transcript.txt or notes.json.
+"""
+import os
+import hashlib
+import logging
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.aborted = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run fn() once for all concurrent callers with the same key.
+
+        Returns:
+            (result, shared) - shared is True for callers that attached to a
+            call already in flight. Exceptions from fn are raised to every caller;
+            if the leader is interrupted (e.g. its job is cancelled), waiting
+            callers start over and one of them runs fn itself.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    leader = False
+                else:
+                    call = self._calls[key] = _Call()
+                    leader = True
+
+            if leader:
+                break
+            logging.info(f"Attaching to in-flight call: {key[:2] if isinstance(key, tuple) else key}")
+            call.done.wait()
+            if call.aborted:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            # JobCancelled and the like belong to the leader's thread, not to the waiters
+            call.aborted = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """Keys currently running and how many callers wait on each"""
+        with self._lock:
+            return [(key, call.waiters) for key, call in self._calls.items()]
+
+
+_recording_locks = {}
+_recording_locks_lock = threading.Lock()
+
+
+def recording_lock(output_dir):
+    """Reentrant lock for writes to one recording folder"""
+    key = os.path.normcase(os.path.abspath(output_dir))
+    with _recording_locks_lock:
+        lock = _recording_locks.get(key)
+        if lock is None:
+            lock = _recording_locks[key] = threading.RLock()
+        return lock
+
+
+def content_hash(*parts):
+    """SHA-256 over strings, bytes and file paths (prefixed 'file:') in order"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str) and part.startswith('file:'):
+            path = part[5:]
+            digest.update(path.encode('utf-8'))
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(block)
+            continue
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
@@ -0,0 +1,207 @@
+"""
+Filmstrip sprites and waveform peaks for the video editor timeline
+
+One FFmpeg pass (a background process of shared.utils.ffmpeg_runner) decodes the recording once and produces both:
+- Thumbnail sprite sheets: a frame every `interval` seconds, scaled to a
+  fixed cell size and tiled COLUMNS x ROWS per JPEG sheet
+- Waveform peaks: the audio is piped back as 8 kHz mono PCM and reduced to
+  a min/max pair per bucket with the array module, then saved in the
+  audiowaveform .dat format (8-bit), which waveform viewers read directly
+
+Everything is written to timeline/<video name>/ next to the recording with a
+timeline.json manifest; the manifest records the source's size and mtime so
+assets of a changed file are rebuilt.
+"""
+import os
+import json
+import math
+import array
+import shutil
+import struct
+import logging
+
+from shared.utils import ffmpeg_runner
+
+TIMELINE_DIR = 'timeline'
+TIMELINE_MANIFEST = 'timeline.json'
+WAVEFORM_FILE = 'waveform.dat'
+SPRITE_PATTERN = 'sprite_%03d.jpg'
+
+DEFAULT_THUMB_INTERVAL = 2.0
+THUMB_WIDTH = 160
+COLUMNS = 10
+ROWS = 10
+# Long recordings get a wider interval so there are at most this many thumbnails
+MAX_THUMBNAILS = 600
+
+WAVEFORM_SAMPLE_RATE = 8000
+# 80 samples per bucket at 8 kHz: 100 min/max pairs per second
+SAMPLES_PER_PEAK = 80
+
+# audiowaveform .dat: version, flags (1 = 8-bit), sample rate, samples per pixel, length
+_DAT_HEADER = struct.Struct('<iIiiI')
+
+
+def timeline_dir(video_path):
+    """Folder holding the timeline assets of video_path"""
+    folder, filename = os.path.split(os.path.abspath(video_path))
+    return os.path.join(folder, TIMELINE_DIR, os.path.splitext(filename)[0])
+
+
+def _signature(video_path):
+    stat = os.stat(video_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(video_path):
+    """The assets' manifest if it matches the current file, else None"""
+    manifest_path = os.path.join(timeline_dir(video_path), TIMELINE_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except Exception:
+        return None
+    return manifest if manifest.get('source_signature') == _signature(video_path) else None
+
+
+def thumbnail_layout(duration, width, height, interval=DEFAULT_THUMB_INTERVAL):
+    """
+    Sprite grid for a video.
+
+    Returns:
+        Dict with interval, count, thumb_width, thumb_height, columns, rows and sheets
+    """
+    duration = max(float(duration or 0), 0.001)
+    interval = max(float(interval), duration / MAX_THUMBNAILS)
+    count = max(1, math.ceil(duration / interval))
+    aspect = (height / width) if width and height else 9 / 16
+    thumb_height = max(2, int(round(THUMB_WIDTH * aspect / 2)) * 2)
+    return {
+        'interval': round(interval, 3),
+        'count': count,
+        'thumb_width': THUMB_WIDTH,
+        'thumb_height': thumb_height,
+        'columns': COLUMNS,
+        'rows': ROWS,
+        'sheets': math.ceil(count / (COLUMNS * ROWS))
+    }
+
+
+class PeakBuilder:
+    """Reduces a stream of signed 16-bit mono PCM to min/max pairs per bucket"""
+
+    def __init__(self, samples_per_peak=SAMPLES_PER_PEAK):
+        self.samples_per_peak = samples_per_peak
+        self.peaks = array.array('b')
+        self._pending = array.array('h')
+        self._odd_byte = b''
+
+    def feed(self, data):
+        data = self._odd_byte + data
+        whole = len(data) - len(data) % 2
+        self._odd_byte = data[whole:]
+        samples = array.array('h')
+        samples.frombytes(data[:whole])
+        if struct.pack('=h', 1) != struct.pack('<h', 1):
+            samples.byteswap()  # PCM is little-endian
+        self._pending.extend(samples)
+        full = len(self._pending) - len(self._pending) % self.samples_per_peak
+        for start in range(0, full, self.samples_per_peak):
+            self._add(self._pending[start:start + self.samples_per_peak])
+        del self._pending[:full]
+
+    def _add(self, bucket):
+        # Scale 16-bit to 8-bit (>> 8 keeps -128..127)
+        self.peaks.append(min(bucket) >> 8)
+        self.peaks.append(max(bucket) >> 8)
+
+    def finish(self):
+        if self._pending:
+            self._add(self._pending)
+            self._pending = array.array('h')
+        return self.peaks
+
+
+def write_waveform(path, peaks, sample_rate=WAVEFORM_SAMPLE_RATE, samples_per_peak=SAMPLES_PER_PEAK):
+    with open(path, 'wb') as f:
+        f.write(_DAT_HEADER.pack(1, 1, sample_rate, samples_per_peak, len(peaks) // 2))
+        f.write(peaks.tobytes())
+
+
+def read_waveform(path):
+    """
+    Read a .dat waveform.
+
+    Returns:
+        Dict in audiowaveform's JSON layout: sample_rate, samples_per_pixel,
+        bits, length and data (min, max, min, max, ...)
+    """
+    with open(path, 'rb') as f:
+        version, flags, sample_rate, samples_per_peak, length = _DAT_HEADER.unpack(f.read(_DAT_HEADER.size))
+        peaks = array.array('b')
+        peaks.frombytes(f.read(length * 2))
+    return {'version': 2, 'channels': 1, 'sample_rate': sample_rate, 'samples_per_pixel': samples_per_peak,
+            'bits': 8, 'length': length, 'data': peaks.tolist()}
+
+
+def generate_timeline_assets(ffmpeg_path, video_path, info, interval=DEFAULT_THUMB_INTERVAL, timeout=None):
+    """
+    Write sprite sheets and waveform peaks for a recording in one decode pass.
+
+    Args:
+        ffmpeg_path: FFmpeg executable
+        video_path: Source recording
+        info: Media info with duration, width, height and has_audio
+            (see shared.utils.media_probe)
+        interval: Seconds between thumbnails (widened for long recordings)
+        timeout: Seconds before FFmpeg is killed
+
+    Returns:
+        The manifest dict
+    """
+    target = timeline_dir(video_path)
+    signature = _signature(video_path)
+    layout = thumbnail_layout(info.get('duration'), info.get('width'), info.get('height'), interval)
+    work_dir = target + '.tmp'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    cell_w, cell_h = layout['thumb_width'], layout['thumb_height']
+    video_filter = (f"fps=1/{layout['interval']},"
+                    f"scale={cell_w}:{cell_h}:force_original_aspect_ratio=decrease,"
+                    f"pad={cell_w}:{cell_h}:(ow-iw)/2:(oh-ih)/2,"
+                    f"tile={COLUMNS}x{ROWS}")
+    command = [
+        ffmpeg_path, '-hide_banner', '-nostats', '-y',
+        '-i', os.path.abspath(video_path),
+        '-map', '0:v:0', '-vf', video_filter, '-q:v', '5', '-f', 'image2', SPRITE_PATTERN
+    ]
+    has_audio = bool(info.get('has_audio'))
+    if has_audio:
+        command += ['-map', '0:a:0', '-ac', '1', '-ar', str(WAVEFORM_SAMPLE_RATE), '-f', 's16le', 'pipe:1']
+
+    try:
+        builder = PeakBuilder()
+        with ffmpeg_runner.start(command, priority=ffmpeg_runner.BACKGROUND, timeout=timeout, cwd=work_dir,
+                                 stdout=True) as process:
+            for chunk in iter(lambda: process.stdout.read(65536), b''):
+                builder.feed(chunk)
+            process.wait()
+
+        if has_audio:
+            write_waveform(os.path.join(work_dir, WAVEFORM_FILE), builder.finish())
+        sheets = sorted(f for f in os.listdir(work_dir) if f.startswith('sprite_') and f.endswith('.jpg'))
+        manifest = dict(layout, sheets=sheets, source=os.path.basename(video_path), source_signature=signature,
+                        waveform=WAVEFORM_FILE if has_audio else None)
+        with open(os.path.join(work_dir, TIMELINE_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(work_dir, target)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logging.info(f"Timeline assets generated for {video_path}: {layout['count']} thumbnails in "
+                 f"{len(sheets)} sheets, waveform {'yes' if has_audio else 'no audio'}")
+    return manifest
@@ -0,0 +1,303 @@
+"""
+Frame-accurate video trimming
+
+A full re-encode of the kept segment is accurate but slow on long recordings.
+Smart cut re-encodes only the partial GOPs at the two cut points (start up to
+the first keyframe inside the range, and the last keyframe inside the range up
+to the end) and stream-copies everything between those keyframes. The three
+video parts are written as MPEG-TS, then concatenated and muxed with the
+audio (re-encoded over the exact range, which is cheap) in one final pass.
+
+The joined MP4 carries a single set of H.264 parameter sets (SPS/PPS), so
+the boundary parts are encoded with the source's profile, level and
+reference count on x264's defaults (which the recorder uses), and their
+SPS/PPS are compared with the copied part's before joining. Recordings that
+aren't H.264, ranges without two keyframes far enough apart, and boundary
+parts whose parameter sets differ fall back to the full re-encode.
+"""
+import os
+import re
+import json
+import shutil
+import logging
+import tempfile
+
+from shared.utils import ffmpeg_runner
+
+# Codecs whose streams can be stream-copied next to libx264 boundary segments
+SMART_CUT_CODECS = ('h264',)
+
+# Below this much stream-copyable video, smart cut isn't worth the extra passes
+MIN_COPY_SECONDS = 2.0
+
+# Seek just past a keyframe so input seeking lands on it rather than the one before
+KEYFRAME_SEEK_EPSILON = 0.001
+
+# x264's defaults, as used by the recorder: a different preset or CRF changes the parameter sets
+BOUNDARY_PRESET = 'medium'
+BOUNDARY_CRF = '23'
+
+# ffprobe profile names -> libx264 -profile:v
+X264_PROFILES = {
+    'baseline': 'baseline', 'constrained baseline': 'baseline', 'main': 'main', 'high': 'high',
+    'high 10': 'high10', 'high 4:2:2': 'high422', 'high 4:4:4 predictive': 'high444'
+}
+
+# H.264 NAL unit types of the sequence and picture parameter sets
+_SPS, _PPS = 7, 8
+
+
+def _run(command, timeout=None):
+    # Raises ffmpeg_runner.FFmpegError (a RuntimeError) on failure
+    return ffmpeg_runner.run(command, timeout=timeout)
+
+
+def probe_streams(ffprobe_path, video_path):
+    """
+    Codec details of the first video stream, whether there is audio, and the duration.
+
+    Returns:
+        {'codec': 'h264', 'pix_fmt': 'yuv420p', 'width': 1920, 'height': 1080,
+         'has_audio': True, 'duration': 61.5}
+    """
+    result = _run([
+        ffprobe_path, '-v', 'error',
+        '-show_entries', 'stream=codec_type,codec_name,pix_fmt,width,height:format=duration',
+        '-of', 'json',
+        video_path
+    ])
+    probe = json.loads(result.stdout)
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    try:
+        duration = float(probe.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    return {
+        'codec': video.get('codec_name'),
+        'pix_fmt': video.get('pix_fmt') or 'yuv420p',
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'has_audio': any(s.get('codec_type') == 'audio' for s in streams),
+        'duration': duration
+    }
+
+
+def probe_h264_settings(ffprobe_path, video_path):
+    """
+    Encoder settings of the first video stream that boundary parts must match.
+
+    Returns:
+        {'profile': 'high', 'level': '3.1', 'refs': 3} - None for values ffprobe doesn't report
+    """
+    result = _run([
+        ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=profile,level,refs',
+        '-of', 'json',
+        video_path
+    ])
+    stream = (json.loads(result.stdout).get('streams') or [{}])[0]
+    level, refs = stream.get('level'), stream.get('refs')
+    return {
+        'profile': X264_PROFILES.get(str(stream.get('profile', '')).lower()),
+        'level': f"{level / 10:g}" if isinstance(level, int) and level >= 10 else None,
+        'refs': refs if isinstance(refs, int) and refs > 0 else None
+    }
+
+
+def read_parameter_sets(ffmpeg_path, part_path, timeout=None):
+    """SPS and PPS NAL units of the first access unit of an H.264 MPEG-TS part"""
+    result = ffmpeg_runner.run([
+        ffmpeg_path, '-v', 'error',
+        '-i', part_path,
+        '-map', '0:v:0', '-c:v', 'copy', '-frames:v', '1',
+        '-f', 'h264', 'pipe:1'
+    ], timeout=timeout, text=False)
+    units = set()
+    for nal in re.split(b'\x00\x00\x01', result.stdout):
+        # Zero bytes at the end belong to the next 4-byte start code
+        nal = nal.rstrip(b'\x00')
+        if nal and (nal[0] & 0x1F) in (_SPS, _PPS):
+            units.add(nal)
+    return units
+
+
+def probe_keyframes(ffprobe_path, video_path, start=None, end=None):
+    """
+    Keyframe times (seconds) of the first video stream, read from packet flags
+    without decoding. With start/end only that part of the file is read.
+    """
+    command = [ffprobe_path, '-v', 'error', '-select_streams', 'v:0']
+    if start is not None and end is not None:
+        command += ['-read_intervals', f"{max(0.0, start - 1):.3f}%{end + 1:.3f}"]
+    command += ['-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path]
+    result = _run(command)
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) >= 2 and 'K' in parts[1]:
+            try:
+                keyframes.append(float(parts[0]))
+            except ValueError:
+                continue  # N/A timestamps
+    return sorted(set(keyframes))
+
+
+def plan_smart_cut(keyframes, start, end, min_copy=MIN_COPY_SECONDS):
+    """
+    Split [start, end] into parts to re-encode or stream-copy.
+
+    Args:
+        keyframes: Keyframe times of the source
+        start: Cut start in seconds
+        end: Cut end in seconds
+        min_copy: Minimum length of the stream-copied middle part
+
+    Returns:
+        List of (mode, part_start, part_end) with mode 'encode' or 'copy', or
+        None when the range has no stream-copyable part
+    """
+    inside = [k for k in keyframes if start <= k <= end]
+    if len(inside) < 2:
+        return None
+    copy_start, copy_end = inside[0], inside[-1]
+    if copy_end - copy_start < min_copy:
+        return None
+
+    parts = []
+    if copy_start > start:
+        parts.append(('encode', start, copy_start))
+    parts.append(('copy', copy_start, copy_end))
+    if end > copy_end:
+        parts.append(('encode', copy_end, end))
+    return parts
+
+
+def reencode_cut(ffmpeg_path, video_path, start, end, output_path, timeout=None):
+    """Cut by re-encoding the whole segment (accurate, slow on long recordings)"""
+    _run([
+        ffmpeg_path,
+        '-ss', str(start),
+        '-i', video_path,
+        '-to', str(end - start),
+        '-c:v', 'libx264',
+        '-c:a', 'aac',
+        '-y',
+        output_path
+    ], timeout=timeout)
+    return output_path
+
+
+def _encode_part(ffmpeg_path, video_path, start, end, pix_fmt, settings, part_path, timeout):
+    command = [
+        ffmpeg_path,
+        '-ss', f"{start:.6f}",
+        '-i', video_path,
+        '-t', f"{end - start:.6f}",
+        '-an',
+        '-c:v', 'libx264', '-preset', BOUNDARY_PRESET, '-crf', BOUNDARY_CRF,
+        '-pix_fmt', pix_fmt
+    ]
+    if settings['profile']:
+        command += ['-profile:v', settings['profile']]
+    if settings['level']:
+        command += ['-level:v', settings['level']]
+    if settings['refs']:
+        command += ['-refs', str(settings['refs'])]
+    command += ['-f', 'mpegts', '-y', part_path]
+    _run(command, timeout=timeout)
+
+
+def _copy_part(ffmpeg_path, video_path, start, end, part_path, timeout):
+    _run([
+        ffmpeg_path,
+        '-ss', f"{start + KEYFRAME_SEEK_EPSILON:.6f}",
+        '-i', video_path,
+        '-t', f"{end - start:.6f}",
+        '-an',
+        '-c:v', 'copy',
+        '-bsf:v', 'h264_mp4toannexb',
+        '-f', 'mpegts',
+        '-y',
+        part_path
+    ], timeout=timeout)
+
+
+def smart_cut(ffmpeg_path, ffprobe_path, video_path, start, end, output_path, progress=None, timeout=None,
+              probe=None):
+    """
+    Cut [start, end] from a recording, re-encoding only the GOPs at the cut points.
+
+    Args:
+        ffmpeg_path: FFmpeg executable
+        ffprobe_path: FFprobe executable
+        video_path: Source recording
+        start: Cut start in seconds
+        end: Cut end in seconds
+        output_path: Output .mp4
+        progress: Optional callback taking (percent, message)
+        timeout: Seconds each FFmpeg pass may take
+        probe: Optional MediaProbeCache for the stream info and keyframe index
+
+    Returns:
+        (output_path, mode) - mode is 'smart', or 'reencode' when the source
+        or range can't be stream-copied or the boundary parts can't match its parameter sets
+    """
+    progress = progress or (lambda percent, message: None)
+    info = probe.info(video_path) if probe else probe_streams(ffprobe_path, video_path)
+    parts = None
+    if info['codec'] in SMART_CUT_CODECS:
+        keyframes = probe.keyframes(video_path) if probe else probe_keyframes(ffprobe_path, video_path, start, end)
+        parts = plan_smart_cut(keyframes, start, end)
+    if parts is None:
+        logging.info(f"Smart cut not possible for {video_path} ({info['codec']}, "
+                     f"{start}-{end}s), re-encoding the segment")
+        progress(20, 'Re-encoding video segment...')
+        return reencode_cut(ffmpeg_path, video_path, start, end, output_path, timeout), 'reencode'
+
+    settings = probe_h264_settings(ffprobe_path, video_path)
+    work_dir = tempfile.mkdtemp(prefix='smart_cut_', dir=os.path.dirname(output_path) or None)
+    try:
+        part_paths = []
+        for i, (mode, part_start, part_end) in enumerate(parts):
+            progress(20 + 50 * i // len(parts), f"{'Re-encoding' if mode == 'encode' else 'Copying'} "
+                                                f"{part_start:.1f}s-{part_end:.1f}s...")
+            part_path = os.path.join(work_dir, f"part_{i}.ts")
+            if mode == 'encode':
+                _encode_part(ffmpeg_path, video_path, part_start, part_end, info['pix_fmt'], settings,
+                             part_path, timeout)
+            else:
+                _copy_part(ffmpeg_path, video_path, part_start, part_end, part_path, timeout)
+            part_paths.append(part_path)
+
+        # Decoders read the MP4's single avcC for every part, so the parameter sets must be identical
+        parameter_sets = [read_parameter_sets(ffmpeg_path, path, timeout) for path in part_paths]
+        copied_sets = parameter_sets[[mode for mode, _, _ in parts].index('copy')]
+        if not copied_sets or any(sets != copied_sets for sets in parameter_sets):
+            logging.info(f"Smart cut boundary parameter sets differ from {video_path} ({settings}), "
+                         f"re-encoding the segment")
+            progress(20, 'Re-encoding video segment...')
+            return reencode_cut(ffmpeg_path, video_path, start, end, output_path, timeout), 'reencode'
+
+        concat_file = os.path.join(work_dir, 'concat_list.txt')
+        with open(concat_file, 'w', encoding='utf-8') as f:
+            for path in part_paths:
+                norm_path = os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+                f.write(f"file '{norm_path}'\n")
+
+        # Join the video parts and add the audio for the exact range in one pass
+        progress(80, 'Joining segments...')
+        command = [ffmpeg_path, '-f', 'concat', '-safe', '0', '-i', concat_file]
+        if info['has_audio']:
+            command += ['-ss', f"{start:.6f}", '-t', f"{end - start:.6f}", '-i', video_path,
+                        '-map', '0:v', '-map', '1:a', '-c:a', 'aac']
+        command += ['-c:v', 'copy', '-movflags', '+faststart', '-y', output_path]
+        _run(command, timeout=timeout)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    copied = sum(part_end - part_start for mode, part_start, part_end in parts if mode == 'copy')
+    logging.info(f"Smart cut {video_path} {start}-{end}s: {copied:.1f}s stream-copied, "
+                 f"{end - start - copied:.1f}s re-encoded")
+    return output_path, 'smart'
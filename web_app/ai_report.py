@@ -0,0 +1,84 @@
+"""
+AI Cost Report
+Shows AI token usage, latency and estimated cost from the ledger the server
+keeps (ai_ledger_rollup.json next to the log, ai_ledger.jsonl per recording).
+Works offline; the server does not need to be running.
+
+Usage:
+    python ai_report.py                  # most expensive recordings and calls
+    python ai_report.py --limit 20
+    python ai_report.py --recording "C:\\Users\\me\\Downloads\\Hallmark Scribble Outputs\\scribble_..."
+"""
+import sys
+import os
+import json
+import argparse
+from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.transcription.ledger import build_report, read_recording_ledger, summarize_entries
+
+DEFAULT_ROLLUP = os.path.join(os.path.expanduser("~"), "Downloads", "Hallmark Scribble Outputs", "ai_ledger_rollup.json")
+
+
+def format_totals(totals):
+    tokens = totals['prompt_tokens'] + totals['output_tokens']
+    return (f"{totals['calls']} calls, {totals['cache_hits']} cache hits, {totals['retries']} retries, "
+            f"{totals['errors']} errors | {tokens:,} tokens ({totals['prompt_tokens']:,} in / "
+            f"{totals['output_tokens']:,} out) | {totals['images']} images | "
+            f"{totals['latency_seconds']:.1f}s | ${totals['cost_usd']:.4f}")
+
+
+def format_call(entry):
+    when = datetime.fromtimestamp(entry['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+    recording = os.path.basename(entry.get('output_dir') or '') or '-'
+    status = 'cache' if entry.get('cache_hit') else ('error' if entry.get('error') else f"try {entry.get('attempt', 1)}")
+    return (f"{when}  {entry.get('operation') or '-':<22} {entry.get('model') or '-':<22} "
+            f"{entry['prompt_tokens'] + entry['output_tokens']:>8,} tok  {entry['images']:>2} img  "
+            f"{entry['latency_seconds']:>6.1f}s  ${entry['cost_usd']:.4f}  {status:<6} {recording}")
+
+
+def report_recording(output_dir):
+    entries = read_recording_ledger(output_dir)
+    if not entries:
+        print(f"No AI calls recorded for {output_dir}")
+        return 1
+    print(f"\nRecording: {output_dir}")
+    print(f"Totals:    {format_totals(summarize_entries(entries))}\n")
+    for entry in entries:
+        print(format_call(entry))
+    return 0
+
+
+def report_global(rollup_path, limit):
+    if not os.path.exists(rollup_path):
+        print(f"No AI ledger found at {rollup_path}")
+        return 1
+    with open(rollup_path, 'r', encoding='utf-8') as f:
+        report = build_report(json.load(f), limit)
+
+    print(f"\nAll recordings: {format_totals(report['totals'])}")
+    print(f"\nMost expensive recordings (top {limit}):")
+    for recording in report['top_recordings']:
+        print(f"  {os.path.basename(recording['output_dir']) or recording['output_dir']}")
+        print(f"      {format_totals(recording)}")
+    print(f"\nMost expensive calls (top {limit}):")
+    for entry in report['top_calls']:
+        print(f"  {format_call(entry)}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report AI token usage and estimated cost')
+    parser.add_argument('--recording', help='Show every call for one recording folder')
+    parser.add_argument('--rollup', default=DEFAULT_ROLLUP, help='Path to ai_ledger_rollup.json')
+    parser.add_argument('--limit', type=int, default=10, help='Rows per table')
+    args = parser.parse_args()
+
+    if args.recording:
+        return report_recording(args.recording)
+    return report_global(args.rollup, args.limit)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+AI Throughput Benchmark
+Measures end-to-end throughput of guide and SOP generation against a running
+server, and checks retry/error handling using the local fake AI provider.
+
+Start the server with these config.txt settings first:
+    AI_PROVIDER=fake
+    GUIDE_COOLDOWN_SECONDS=0
+    AI_REQUESTS_PER_MINUTE=1000   (optional, to measure the server rather than the limiter)
+
+Usage:
+    python benchmark_ai.py --requests 20 --concurrency 4
+    python benchmark_ai.py --verify-retries
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+BASE_URL = "http://127.0.0.1:5000"
+
+
+def make_recording(screenshot_count):
+    """Create a fake screenshot-mode recording folder"""
+    output_dir = tempfile.mkdtemp(prefix='hs_benchmark_')
+    for i in range(1, screenshot_count + 1):
+        color = ((i * 53) % 256, (i * 97) % 256, (i * 151) % 256)
+        Image.new('RGB', (1280, 720), color).save(os.path.join(output_dir, f'screenshot_{i:03d}.png'))
+    return output_dir
+
+
+def set_fake(**settings):
+    response = requests.post(f"{BASE_URL}/api/ai_provider", json=settings, timeout=10)
+    data = response.json()
+    if not data.get('success'):
+        raise RuntimeError(data.get('error'))
+    return data
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def timed_post(endpoint, payload):
+    started = time.time()
+    try:
+        response = requests.post(f"{BASE_URL}{endpoint}", json=payload, timeout=300)
+        data = response.json()
+    except Exception as e:
+        data = {'success': False, 'error': str(e), 'error_type': 'request_failed'}
+    return time.time() - started, data
+
+
+def run_benchmark(name, endpoint, payload, total, concurrency):
+    """Send `total` requests with `concurrency` in flight and print latency/throughput"""
+    print(f"\n{name}: {total} requests, concurrency {concurrency}")
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: timed_post(endpoint, payload), range(total)))
+    elapsed = time.time() - started
+
+    latencies = [latency for latency, data in results if data.get('success')]
+    failures = {}
+    for _, data in results:
+        if not data.get('success'):
+            error_type = data.get('error_type', 'error')
+            failures[error_type] = failures.get(error_type, 0) + 1
+
+    print(f"  Succeeded:   {len(latencies)}/{total}")
+    if failures:
+        print(f"  Failures:    {failures}")
+    print(f"  Throughput:  {len(latencies) / elapsed:.2f} req/s over {elapsed:.1f}s")
+    if latencies:
+        print(f"  Latency p50: {percentile(latencies, 50):.2f}s  p95: {percentile(latencies, 95):.2f}s  max: {max(latencies):.2f}s")
+    return len(latencies) == total
+
+
+def check(description, passed):
+    print(f"  {'✓' if passed else '✗'} {description}")
+    return passed
+
+
+def verify_retries(output_dir):
+    """Inject errors through the fake provider and check how generate_guide reacts"""
+    print("\nVerifying retry behavior...")
+    payload = {'output_dir': output_dir}
+    results = []
+
+    # Two 429s then success: retried after 2s + 4s backoff
+    set_fake(error='429', fail_next=2, error_rate=0.0)
+    elapsed, data = timed_post('/api/generate_guide', payload)
+    results.append(check(f"Recovers after two 429s ({elapsed:.1f}s)", data.get('success') and elapsed >= 6))
+
+    # Three 429s exhaust the retries
+    set_fake(error='429', fail_next=3)
+    _, data = timed_post('/api/generate_guide', payload)
+    results.append(check("Reports rate_limit after retries are exhausted", data.get('error_type') == 'rate_limit'))
+
+    # Safety blocks are not retried
+    before = set_fake(error='safety', fail_next=1)['usage']['requests']
+    _, data = timed_post('/api/generate_guide', payload)
+    after = set_fake()['usage']['requests']
+    results.append(check("Reports safety block without retrying", data.get('error_type') == 'safety' and after - before == 1))
+
+    set_fake(error=None, fail_next=0, error_rate=0.0)
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark AI guide/SOP generation')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per benchmark')
+    parser.add_argument('--concurrency', type=int, default=2, help='Requests in flight')
+    parser.add_argument('--screenshots', type=int, default=5, help='Screenshots in the test recording')
+    parser.add_argument('--verify-retries', action='store_true', help='Only run the retry checks')
+    parser.add_argument('--allow-real', action='store_true', help='Run even if the server uses the real Gemini API')
+    args = parser.parse_args()
+
+    try:
+        provider = requests.get(f"{BASE_URL}/api/ai_provider", timeout=5).json()
+    except Exception as e:
+        print(f"✗ Server not reachable at {BASE_URL}: {e}")
+        return 1
+
+    print(f"AI provider: {provider.get('provider')}  rate limit: {provider.get('rate_limit')}")
+    if provider.get('provider') != 'fake' and not args.allow_real:
+        print("✗ Server is not using AI_PROVIDER=fake; refusing to spend real quota (use --allow-real)")
+        return 1
+
+    output_dir = make_recording(args.screenshots)
+    print(f"Test recording: {output_dir} ({args.screenshots} screenshots)")
+
+    if args.verify_retries:
+        return 0 if verify_retries(output_dir) else 1
+
+    set_fake(reset_usage=True)
+    ok = run_benchmark('generate_guide', '/api/generate_guide', {'output_dir': output_dir},
+                       args.requests, args.concurrency)
+    guide_content = '\n\n'.join(f"Step {i}: Do step {i}." for i in range(1, args.screenshots + 1))
+    ok = run_benchmark('generate_sop', '/api/generate_sop',
+                       {'output_dir': output_dir, 'title': 'Benchmark', 'guide_content': guide_content},
+                       args.requests, args.concurrency) and ok
+
+    usage = requests.get(f"{BASE_URL}/api/ai_provider", timeout=5).json().get('usage', {})
+    print(f"\nToken usage: {usage}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Video Cut Benchmark
+Compares smart cut (re-encode only the GOPs at the cut points, stream-copy
+the rest) with the full re-encode /api/cut_video used before, on the same
+cuts. Checks that both outputs have the expected duration and frame count.
+
+Without --video a synthetic H.264 test recording is generated first.
+
+Usage:
+    python benchmark_cut.py
+    python benchmark_cut.py --video "path/to/recording.mp4" --cuts 12.5-600,30-1790
+    python benchmark_cut.py --minutes 30
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.utils import ffmpeg_runner
+from shared.utils.video_cut import smart_cut, reencode_cut
+
+
+def find_tool(name):
+    bundled = os.path.join(os.path.dirname(__file__), '..', 'shared', 'ffmpeg', 'bin', f'{name}.exe')
+    return bundled if os.path.exists(bundled) else (shutil.which(name) or name)
+
+
+def make_test_video(ffmpeg_path, path, minutes, fps=30, gop_seconds=2):
+    """A screen-recording-like H.264 file with a keyframe every gop_seconds"""
+    ffmpeg_runner.run([
+        ffmpeg_path, '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate={fps}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(minutes * 60),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(fps * gop_seconds), '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest',
+        '-y', path
+    ])
+
+
+def measure(ffprobe_path, path):
+    """(duration, video frame count) of a file"""
+    result = ffmpeg_runner.run([
+        ffprobe_path, '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+        '-show_entries', 'stream=nb_read_packets,r_frame_rate:format=duration', '-of', 'json', path
+    ])
+    info = json.loads(result.stdout)
+    stream = info['streams'][0]
+    num, den = stream['r_frame_rate'].split('/')
+    return float(info['format']['duration']), int(stream['nb_read_packets']), float(num) / float(den)
+
+
+def parse_cuts(text, duration):
+    if not text:
+        # A cut that keeps most of the recording, and a short one from the middle
+        return [(duration * 0.05 + 0.37, duration * 0.95 - 0.21), (duration * 0.4 + 0.13, duration * 0.45)]
+    cuts = []
+    for item in text.split(','):
+        start, end = item.split('-')
+        cuts.append((float(start), float(end)))
+    return cuts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare smart cut with a full re-encode')
+    parser.add_argument('--video', help='Recording to cut (default: generate a test video)')
+    parser.add_argument('--minutes', type=float, default=5, help='Length of the generated test video')
+    parser.add_argument('--cuts', help='Comma-separated start-end ranges in seconds')
+    args = parser.parse_args()
+
+    ffmpeg_path, ffprobe_path = find_tool('ffmpeg'), find_tool('ffprobe')
+    work_dir = tempfile.mkdtemp(prefix='hs_cut_bench_')
+    try:
+        video_path = args.video
+        if not video_path:
+            video_path = os.path.join(work_dir, 'recording.mp4')
+            print(f"Generating {args.minutes:g}-minute test video...")
+            make_test_video(ffmpeg_path, video_path, args.minutes)
+        source_duration, _, fps = measure(ffprobe_path, video_path)
+        print(f"Source: {video_path} ({source_duration:.1f}s, {fps:.2f} fps)")
+
+        for start, end in parse_cuts(args.cuts, source_duration):
+            expected_frames = round((end - start) * fps)
+            print(f"\nCut {start:.2f}s - {end:.2f}s ({end - start:.1f}s, ~{expected_frames} frames)")
+
+            started = time.time()
+            reencode_path = os.path.join(work_dir, 'cut_reencode.mp4')
+            reencode_cut(ffmpeg_path, video_path, start, end, reencode_path)
+            reencode_time = time.time() - started
+
+            started = time.time()
+            smart_path = os.path.join(work_dir, 'cut_smart.mp4')
+            _, mode = smart_cut(ffmpeg_path, ffprobe_path, video_path, start, end, smart_path)
+            smart_time = time.time() - started
+
+            for label, path, elapsed in (('Re-encode', reencode_path, reencode_time),
+                                         (f'Smart ({mode})', smart_path, smart_time)):
+                duration, frames, _ = measure(ffprobe_path, path)
+                print(f"  {label:<18} {elapsed:7.2f}s  duration {duration:8.3f}s  frames {frames} "
+                      f"({frames - expected_frames:+d})")
+            print(f"  Speedup: {reencode_time / max(smart_time, 0.001):.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
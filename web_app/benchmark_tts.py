@@ -0,0 +1,80 @@
+"""
+TTS Backend Benchmark
+Measures narration synthesis speed per TTS backend as a real-time factor
+(seconds spent synthesizing per second of audio; below 1.0 is faster than
+real time). Each backend gets a cold run with an empty chunk cache, then a
+warm run where every chunk comes from the cache.
+
+Backends that are not installed are skipped. `stub` needs nothing and is
+deterministic, so it measures the pipeline itself.
+
+Usage:
+    python benchmark_tts.py
+    python benchmark_tts.py --backends edge,local,stub --steps 20 --concurrency 4
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.guide.narration import (TTSBackendChain, create_tts_backend, synthesize_narration, audio_duration,
+                                    load_narration_config, TTS_MAX_CONCURRENT)
+
+
+def make_script(steps):
+    """A guide-shaped narration script with `steps` steps"""
+    lines = ["Welcome. This guide shows how to create and share a new report.", ""]
+    for i in range(1, steps + 1):
+        lines.append(f"Step {i}: Click the button labelled Option {i} in the toolbar. "
+                     f"This opens the settings panel, where you choose how section {i} is formatted.")
+    lines += ["", "You have finished. Your report is now ready to share."]
+    return '\n'.join(lines)
+
+
+def time_run(backend, script, cache_dir, concurrency):
+    started = time.time()
+    _, chunks = synthesize_narration(script, cache_dir, backends=TTSBackendChain([backend]),
+                                     max_concurrent=concurrency)
+    return time.time() - started, sum(audio_duration(path) for _, path in chunks), len(chunks)
+
+
+def benchmark_backend(backend, script, concurrency):
+    if not backend.is_available():
+        print(f"\n{backend.name}: not installed, skipped")
+        return
+    work_dir = tempfile.mkdtemp(prefix=f'hs_tts_{backend.name}_')
+    cache_dir = os.path.join(work_dir, 'tts_cache')
+    try:
+        cold, audio_seconds, chunk_count = time_run(backend, script, cache_dir, concurrency)
+        warm, _, _ = time_run(backend, script, cache_dir, concurrency)
+    except Exception as e:
+        print(f"\n{backend.name}: failed - {e}")
+        return
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{backend.name}: {chunk_count} chunks, {audio_seconds:.1f}s of audio")
+    print(f"  Cold:  {cold:.2f}s  real-time factor {cold / max(audio_seconds, 0.001):.3f}")
+    print(f"  Warm:  {warm:.2f}s  real-time factor {warm / max(audio_seconds, 0.001):.3f} (all chunks cached)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure TTS synthesis real-time factor per backend')
+    parser.add_argument('--backends', default='edge,gtts,local,stub', help='Comma-separated backends to test')
+    parser.add_argument('--steps', type=int, default=10, help='Steps in the generated narration script')
+    parser.add_argument('--concurrency', type=int, default=TTS_MAX_CONCURRENT, help='Chunks synthesized at once')
+    args = parser.parse_args()
+
+    config = load_narration_config()
+    script = make_script(args.steps)
+    print(f"Script: {args.steps} steps, {len(script)} characters, concurrency {args.concurrency}")
+    for name in [n.strip() for n in args.backends.split(',') if n.strip()]:
+        benchmark_backend(create_tts_backend(name, config), script, args.concurrency)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Tests for the AI circuit breaker's half-open probe with streamed responses
+(shared/transcription/circuit_breaker.py, shared/transcription/providers.py)
+Uses the fake provider, so no API key or network is needed.
+
+Usage:
+    python -m pytest test_circuit_breaker.py
+    python test_circuit_breaker.py
+"""
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.utils.jobs import JobCancelled
+from shared.transcription.providers import FakeProvider
+from shared.transcription.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN
+
+PROMPT = 'Write step-by-step instructions for this recording.'
+
+
+class HalfOpenStreamTests(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = FakeProvider(latency=0, chunk_delay=0)
+        # No background probe and no wait: the next real call is the half-open probe
+        self.provider.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.breaker = self.provider.breaker
+        self.model = self.provider.get_model('gemini-2.5-flash')
+        self.breaker.record_failure('503 Service Unavailable')
+
+    def start_probe_stream(self):
+        stream = self.model.generate_content(PROMPT, stream=True)
+        next(stream)
+        self.assertEqual(self.breaker.status()['state'], HALF_OPEN)
+        self.assertTrue(self.breaker.is_open())
+        return stream
+
+    def assert_probe_released(self):
+        self.assertFalse(self.breaker.is_open())
+        # The next call becomes the probe and, completing, closes the breaker
+        chunks = list(self.model.generate_content(PROMPT, stream=True))
+        self.assertTrue(chunks)
+        self.assertEqual(self.breaker.status()['state'], CLOSED)
+
+    def test_second_call_rejected_while_probe_streams(self):
+        stream = self.start_probe_stream()
+        with self.assertRaises(CircuitOpenError):
+            self.model.generate_content(PROMPT)
+        stream.close()
+
+    def test_stream_closed_halfway_releases_probe(self):
+        stream = self.start_probe_stream()
+        stream.close()
+        self.assertEqual(self.breaker.status()['state'], HALF_OPEN)
+        self.assert_probe_released()
+
+    def test_consumer_break_releases_probe(self):
+        stream = self.model.generate_content(PROMPT, stream=True)
+        for _ in stream:
+            break
+        del stream
+        self.assert_probe_released()
+
+    def test_job_cancelled_mid_stream_releases_probe(self):
+        stream = self.start_probe_stream()
+        with self.assertRaises(JobCancelled):
+            stream.throw(JobCancelled())
+        self.assert_probe_released()
+
+    def test_completed_stream_closes_breaker(self):
+        stream = self.start_probe_stream()
+        list(stream)
+        self.assertEqual(self.breaker.status()['state'], CLOSED)
+
+    def test_early_close_is_counted_in_usage(self):
+        stream = self.start_probe_stream()
+        stream.close()
+        self.assertEqual(self.provider.usage.to_dict()['requests'], 1)
+        self.assertEqual(self.provider.usage.to_dict()['errors'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""
+Tests for byte-range, ETag and conditional responses (shared/utils/http_files.py)
+Runs the response planner directly and against a live editor server, so no
+Flask or browser is needed.
+
+Usage:
+    python -m pytest test_http_ranges.py
+    python test_http_ranges.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+import http.client
+from http.server import HTTPServer
+from urllib.parse import quote
+from email.utils import formatdate
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.utils import http_files
+from shared.utils.http_files import parse_range, plan_file_response, iter_file, file_etag
+from shared.guide.editor_server import EditorHandler
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes, every offset distinguishable
+
+
+def read_body(path, body):
+    return b''.join(iter_file(path, *body)) if body else b''
+
+
+class ParseRangeTests(unittest.TestCase):
+
+    def test_closed_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+
+    def test_open_ended_range(self):
+        self.assertEqual(parse_range('bytes=500-', 1000), (500, 999))
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+
+    def test_suffix_longer_than_file(self):
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_end_clamped_to_file(self):
+        self.assertEqual(parse_range('bytes=900-5000', 1000), (900, 999))
+
+    def test_start_past_end_is_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=1000-', 1000), 'unsatisfiable')
+
+    def test_zero_suffix_is_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=-0', 1000), 'unsatisfiable')
+
+    def test_whole_file_cases(self):
+        for header in (None, '', 'items=0-5', 'bytes=0-5,10-20', 'bytes=abc-', 'bytes=5-2', 'bytes=5'):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+
+class PlanFileResponseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'video.mp4')
+        with open(self.path, 'wb') as f:
+            f.write(CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def plan(self, headers=None, **kwargs):
+        return plan_file_response(self.path, headers or {}, 'video/mp4', **kwargs)
+
+    def test_full_response(self):
+        status, headers, body = self.plan()
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(read_body(self.path, body), CONTENT)
+
+    def test_partial_content(self):
+        status, headers, body = self.plan({'Range': 'bytes=1000-1999'})
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], f'bytes 1000-1999/{len(CONTENT)}')
+        self.assertEqual(headers['Content-Length'], '1000')
+        self.assertEqual(read_body(self.path, body), CONTENT[1000:2000])
+
+    def test_suffix_partial_content(self):
+        status, headers, body = self.plan({'Range': 'bytes=-10'})
+        self.assertEqual(status, 206)
+        self.assertEqual(read_body(self.path, body), CONTENT[-10:])
+
+    def test_unsatisfiable_range(self):
+        status, headers, body = self.plan({'Range': f'bytes={len(CONTENT)}-'})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['Content-Range'], f'bytes */{len(CONTENT)}')
+        self.assertIsNone(body)
+
+    def test_head_has_headers_without_body(self):
+        status, headers, body = self.plan({'Range': 'bytes=0-9'}, method='HEAD')
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertIsNone(body)
+
+    def test_etag_is_strong_content_hash(self):
+        _, headers, _ = self.plan()
+        etag = headers['ETag']
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        # Same content in another file -> same ETag
+        other = os.path.join(self.dir, 'copy.mp4')
+        shutil.copyfile(self.path, other)
+        self.assertEqual(file_etag(other), etag)
+
+    def test_large_file_etag_uses_size_and_mtime(self):
+        original = http_files.HASH_ETAG_MAX_BYTES
+        http_files.HASH_ETAG_MAX_BYTES = 100
+        try:
+            stat = os.stat(self.path)
+            self.assertEqual(file_etag(self.path), f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"')
+        finally:
+            http_files.HASH_ETAG_MAX_BYTES = original
+
+    def test_etag_changes_with_content(self):
+        before = file_etag(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(CONTENT[::-1])
+        os.utime(self.path, ns=(os.stat(self.path).st_atime_ns, os.stat(self.path).st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(file_etag(self.path), before)
+
+    def test_if_none_match_gives_304(self):
+        _, headers, _ = self.plan()
+        for header in (headers['ETag'], f'"other", {headers["ETag"]}', 'W/' + headers['ETag'], '*'):
+            status, not_modified, body = self.plan({'If-None-Match': header})
+            self.assertEqual(status, 304, header)
+            self.assertEqual(not_modified['ETag'], headers['ETag'])
+            self.assertIsNone(body)
+
+    def test_if_none_match_mismatch_gives_200(self):
+        status, _, _ = self.plan({'If-None-Match': '"stale"'})
+        self.assertEqual(status, 200)
+
+    def test_if_modified_since(self):
+        mtime = os.stat(self.path).st_mtime
+        status, _, _ = self.plan({'If-Modified-Since': formatdate(mtime + 60, usegmt=True)})
+        self.assertEqual(status, 304)
+        status, _, _ = self.plan({'If-Modified-Since': formatdate(mtime - 60, usegmt=True)})
+        self.assertEqual(status, 200)
+
+    def test_if_none_match_takes_precedence_over_date(self):
+        mtime = os.stat(self.path).st_mtime
+        status, _, _ = self.plan({'If-None-Match': '"stale"',
+                                  'If-Modified-Since': formatdate(mtime + 60, usegmt=True)})
+        self.assertEqual(status, 200)
+
+    def test_if_range_current_etag_keeps_range(self):
+        _, headers, _ = self.plan()
+        status, _, body = self.plan({'Range': 'bytes=0-9', 'If-Range': headers['ETag']})
+        self.assertEqual(status, 206)
+        self.assertEqual(read_body(self.path, body), CONTENT[:10])
+
+    def test_if_range_stale_etag_sends_whole_file(self):
+        status, _, body = self.plan({'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(status, 200)
+        self.assertEqual(read_body(self.path, body), CONTENT)
+
+    def test_if_range_weak_etag_sends_whole_file(self):
+        _, headers, _ = self.plan()
+        status, _, _ = self.plan({'Range': 'bytes=0-9', 'If-Range': 'W/' + headers['ETag']})
+        self.assertEqual(status, 200)
+
+    def test_cache_control(self):
+        self.assertEqual(self.plan()[1]['Cache-Control'], http_files.REVALIDATE_CACHE_CONTROL)
+        self.assertEqual(self.plan(immutable=True)[1]['Cache-Control'], http_files.IMMUTABLE_CACHE_CONTROL)
+
+
+class EditorServerTests(unittest.TestCase):
+    """Partial content from the desktop editor's image server over real HTTP"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.dir, 'screenshot 001.png')
+        with open(cls.path, 'wb') as f:
+            f.write(CONTENT)
+        cls.server = HTTPServer(('127.0.0.1', 0), EditorHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = '/image/' + quote(cls.path.replace(os.sep, '/'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.dir, ignore_errors=True)
+
+    def request(self, url=None, headers=None, method='GET'):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=10)
+        try:
+            connection.request(method, url or self.url, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def test_whole_image(self):
+        status, headers, body = self.request()
+        self.assertEqual(status, 200)
+        self.assertEqual(body, CONTENT)
+        self.assertEqual(headers['Content-Type'], 'image/png')
+        self.assertIn('ETag', headers)
+        self.assertIn('Last-Modified', headers)
+
+    def test_ranges_reassemble_the_file(self):
+        parts = []
+        for start in range(0, len(CONTENT), 3000):
+            end = min(start + 2999, len(CONTENT) - 1)
+            status, headers, body = self.request(headers={'Range': f'bytes={start}-{end}'})
+            self.assertEqual(status, 206)
+            self.assertEqual(headers['Content-Range'], f'bytes {start}-{end}/{len(CONTENT)}')
+            self.assertEqual(len(body), end - start + 1)
+            parts.append(body)
+        self.assertEqual(b''.join(parts), CONTENT)
+
+    def test_not_modified(self):
+        _, headers, _ = self.request()
+        status, _, body = self.request(headers={'If-None-Match': headers['ETag']})
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+
+    def test_unsatisfiable(self):
+        status, headers, body = self.request(headers={'Range': 'bytes=999999-'})
+        self.assertEqual(status, 416)
+        self.assertEqual(body, b'')
+
+    def test_versioned_url_is_immutable(self):
+        _, headers, _ = self.request(self.url + '?v=1a2b')
+        self.assertIn('immutable', headers['Cache-Control'])
+        _, headers, _ = self.request()
+        self.assertEqual(headers['Cache-Control'], 'no-cache')
+
+    def test_head(self):
+        status, headers, body = self.request(method='HEAD', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertEqual(body, b'')
+
+    def test_missing_image(self):
+        status, _, _ = self.request('/image/' + quote(os.path.join(self.dir, 'nope.png').replace(os.sep, '/')))
+        self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,14 +4,17 @@ A Flask-based web application for screen recording and guide generation
 """
 # Updated video selector functionality
 
+import io
 import os
 import sys
 import logging
 import json
 import time
 import re
+import functools
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_file, session
+from urllib.parse import quote
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
 import uuid
 import pyautogui
 import threading
@@ -173,9 +176,8 @@ progress_state = {
 # Active sessions
 active_sessions = {}
 
-# Cache for Gemini models (to avoid rate limiting)
-models_cache = {'models': None, 'timestamp': 0}
-CACHE_DURATION = 3600  # Cache for 1 hour
+# Gemini model list is cached on disk (see model_catalog below)
+CACHE_DURATION = 3600  # Refresh after 1 hour
 
 # Track last API call for rate limiting
 last_api_call = {'timestamp': None, 'cooldown_seconds': 65}  # 65 seconds to be safe
@@ -246,6 +248,163 @@ def load_config():
 config = load_config()
 logging.info(f"Configuration loaded: {list(config.keys())}")
 
+from shared.guide.step_parser import StepParser, parse_guide_notes, extract_guide_title
+from shared.guide.incremental_guide import IncrementalGuideBuilder, LiveGuideAnnotator
+from shared.guide import narration
+from shared.utils.video_cut import smart_cut, reencode_cut
+from shared.utils.media_probe import MediaProbeCache
+from shared.utils.http_files import plan_file_response, iter_file, IMMUTABLE_CACHE_CONTROL
+from shared.utils.preview import (preview_dir, preview_status, generate_preview, PROXY_FILE, HLS_PLAYLIST,
+                                  DEFAULT_PREVIEW_HEIGHT, DEFAULT_PREVIEW_BITRATE)
+from shared.utils.edl import render_edl, EDLError
+from shared.utils.timeline_assets import (timeline_dir, load_manifest as load_timeline_manifest, read_waveform,
+                                          generate_timeline_assets, DEFAULT_THUMB_INTERVAL)
+from shared.guide.structured_guide import (STRUCTURED_GUIDE_PROMPT, guide_generation_config, is_schema_unsupported_error,
+                                           parse_structured_guide, structured_guide_notes, render_guide_text)
+
+# Shared limit for all Gemini calls, and cache of responses keyed by their inputs
+from shared.transcription.providers import get_provider, FakeProvider
+from shared.transcription.circuit_breaker import CircuitOpenError
+from shared.transcription.rate_limit import RateLimiter
+from shared.transcription.response_cache import ResponseCache
+from shared.transcription.context_budget import truncate_text, log_prompt_tokens, GUIDE_TOKEN_BUDGET
+from shared.transcription.quota import QuotaTracker
+from shared.transcription.model_catalog import ModelCatalog
+from shared.transcription.ledger import AILedger, read_recording_ledger, summarize_entries
+from shared.utils.keyframes import select_recording_keyframes
+ai_rate_limiter = RateLimiter(
+    requests_per_minute=int(config.get('AI_REQUESTS_PER_MINUTE', 15)),
+    max_concurrent=int(config.get('AI_MAX_CONCURRENT', 3))
+)
+ai_response_cache = ResponseCache(os.path.join(log_dir, 'ai_cache'))
+
+# Cooldown between full guide generations (set to 0 for load tests with AI_PROVIDER=fake)
+last_api_call['cooldown_seconds'] = int(config.get('GUIDE_COOLDOWN_SECONDS', last_api_call['cooldown_seconds']))
+
+# Background job queue for long-running AI and FFmpeg operations
+from shared.utils import jobs
+from shared.utils.singleflight import SingleFlight, recording_lock, content_hash
+job_manager = jobs.JobManager(
+    state_path=os.path.join(log_dir, 'jobs.json'),
+    max_workers=int(config.get('JOB_WORKERS', 2))
+)
+
+# Every FFmpeg/ffprobe process runs through one bounded, prioritized pool; live capture always goes first
+from shared.utils import ffmpeg_runner
+ffmpeg_runner.runner.configure(
+    max_workers=int(config.get('FFMPEG_WORKERS', ffmpeg_runner.DEFAULT_MAX_WORKERS)),
+    max_workers_while_live=int(config.get('FFMPEG_WORKERS_WHILE_RECORDING', 1)),
+    default_timeout=float(config.get('FFMPEG_TIMEOUT', 3600))
+)
+
+def summarize_job_params(params):
+    """Shorten large request fields (guide text, base64 blobs) before storing them with a job"""
+    summary = {}
+    for key, value in params.items():
+        if isinstance(value, str) and len(value) > 200:
+            summary[key] = value[:200] + f'... ({len(value)} chars)'
+        else:
+            summary[key] = value
+    return summary
+
+def background_capable(operation):
+    """
+    Let a JSON endpoint run as a background job.
+    
+    When the request body contains "background": true the endpoint is queued on the
+    job pool and 202 + job_id is returned immediately. The job replays the endpoint
+    in its own request context and stores the JSON response as the job result.
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            payload = request.get_json(silent=True)
+            if not (isinstance(payload, dict) and payload.get('background')) or jobs.current_job() is not None:
+                return view_func(*args, **kwargs)
+            
+            params = {k: v for k, v in payload.items() if k != 'background'}
+            path = request.path
+            
+            def work():
+                with app.test_request_context(path, method='POST', json=params):
+                    response = app.make_response(view_func(*args, **kwargs))
+                    result = response.get_json(silent=True) or {}
+                if response.status_code >= 400 or not result.get('success', False):
+                    raise jobs.JobFailed(result.get('error', f'HTTP {response.status_code}'), result)
+                return result
+            
+            job = job_manager.submit(operation, work, summarize_job_params(params))
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/api/jobs/{job.id}'
+            }), 202
+        return wrapper
+    return decorator
+
+# Identical concurrent AI requests share one run (see shared/utils/singleflight.py)
+ai_flights = SingleFlight()
+
+def coalesce_requests(key_func):
+    """
+    Let concurrent identical requests share one execution.
+    
+    key_func(payload) returns a hashable key for the request, or None to run it
+    normally. While a request with the same key is in flight, later callers wait
+    for it and get the same JSON response with "coalesced": true.
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            payload = request.get_json(silent=True)
+            try:
+                key = key_func(payload) if isinstance(payload, dict) else None
+            except Exception as e:
+                logging.warning(f"Could not build coalescing key for {request.path}: {e}")
+                key = None
+            if key is None:
+                return view_func(*args, **kwargs)
+            
+            def run():
+                response = app.make_response(view_func(*args, **kwargs))
+                return response.get_json(silent=True), response.status_code
+            
+            (result, status), shared = ai_flights.do(key, run)
+            if shared and isinstance(result, dict):
+                result = dict(result, coalesced=True)
+            return jsonify(result), status
+        return wrapper
+    return decorator
+
+def guide_request_key(payload):
+    """Coalescing key for /api/generate_guide: recording, model and input content"""
+    output_dir = payload.get('output_dir')
+    if not output_dir:
+        return None
+    output_dir = os.path.normpath(output_dir)
+    if not os.path.isdir(output_dir):
+        return None
+    
+    screenshots = sorted(f for f in os.listdir(output_dir) if f.startswith('screenshot_') and f.endswith('.png'))
+    if screenshots:
+        parts = [f"file:{os.path.join(output_dir, f)}" for f in screenshots]
+    else:
+        # Hashing a whole video is too slow; its size and mtime identify the recording
+        video_path = os.path.join(output_dir, 'recording.mp4')
+        video_stat = os.stat(video_path) if os.path.exists(video_path) else None
+        parts = [f"{video_stat.st_size}:{video_stat.st_mtime}" if video_stat else '',
+                 f"file:{os.path.join(output_dir, 'actions.log')}"]
+    return ('generate_guide', output_dir, content_hash(load_config().get('GEMINI_MODEL', ''), *parts))
+
+def sop_request_key(payload):
+    """Coalescing key for /api/generate_sop: recording, title and guide text"""
+    output_dir = payload.get('output_dir')
+    if not output_dir:
+        return None
+    return ('generate_sop', os.path.normpath(output_dir),
+            content_hash(payload.get('title', ''), payload.get('guide_content', '')))
+
 @app.route('/')
 def index():
     """Main page"""
@@ -447,6 +606,60 @@ def get_progress():
     
     return jsonify(response)
 
+@app.route('/api/ffmpeg_status', methods=['GET'])
+def get_ffmpeg_status():
+    """FFmpeg process pool: live captures, running and queued processes, current limit"""
+    return jsonify({'success': True, **ffmpeg_runner.runner.status()})
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List recent background jobs (newest first)"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        return jsonify({
+            'success': True,
+            'jobs': [job.to_dict() for job in job_manager.list_jobs(limit)]
+        })
+    except Exception as e:
+        logging.error(f"Error listing jobs: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get status and progress of a background job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Get the result of a finished background job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job.status not in jobs.FINISHED_STATUSES:
+        return jsonify({
+            'success': False,
+            'error': 'Job has not finished yet',
+            'status': job.status,
+            'progress': job.progress
+        }), 409
+    return jsonify({
+        'success': job.status == jobs.COMPLETED,
+        'status': job.status,
+        'error': job.error,
+        'result': job.result
+    })
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Request cancellation of a queued or running background job"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
 @app.route('/api/start_recording', methods=['POST'])
 def start_recording():
     """Start a recording session"""
@@ -599,6 +812,10 @@ def start_recording():
                 except Exception as e:
                     logging.warning(f"Could not bring window to front: {e}")
             
+            # Opt-in: describe each step in the background as it is captured
+            live_annotation = data.get('live_annotation', config.get('LIVE_ANNOTATION', 'false').lower() == 'true')
+            live_annotator = start_live_annotation(scribble_dir) if live_annotation else None
+            
             def take_screenshot(x, y):
                 """Callback when user clicks - capture screenshot"""
                 try:
@@ -677,6 +894,9 @@ def start_recording():
                     progress_state['status'] = 'recording'
                     progress_state['timestamp'] = time.time()
                     progress_state['screenshot_count'] = screenshot_count['count']
+                    
+                    if live_annotator:
+                        live_annotator.notify()
                 except Exception as e:
                     logging.error(f"Error taking screenshot: {e}")
             
@@ -692,7 +912,8 @@ def start_recording():
                 'output_dir': scribble_dir,
                 'screenshot_count': screenshot_count,
                 'capture_mode': capture_mode,
-                'window_region': window_region
+                'window_region': window_region,
+                'live_annotation': live_annotator is not None
             }
         
         # Video mode with screen recording (like desktop app)
@@ -874,7 +1095,8 @@ def start_recording():
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'output_dir': scribble_dir
+            'output_dir': scribble_dir,
+            'live_annotation': os.path.normpath(scribble_dir) in live_annotators
         })
     except Exception as e:
         logging.error(f"Error starting recording: {e}", exc_info=True)
@@ -894,12 +1116,18 @@ def stop_recording():
                 input_logger.stop_logging()
                 screenshot_count = session_data['screenshot_count']['count']
                 
+                annotator = live_annotators.get(os.path.normpath(session_data['output_dir']))
+                if annotator:
+                    # The last step's keystrokes are complete now
+                    annotator.notify(stopped=True)
+                
                 del active_sessions[session_id]
                 logging.info(f"Stopped screenshot session {session_id}")
                 
                 return jsonify({
                     'success': True,
-                    'screenshot_count': screenshot_count
+                    'screenshot_count': screenshot_count,
+                    'live_annotation': annotator.status() if annotator else None
                 })
                 
             elif session_data['mode'] == 'video':
@@ -928,8 +1156,6 @@ def stop_recording():
                     time.sleep(2.0)
                     
                     try:
-                        import subprocess
-                        
                         # Get ffprobe path
                         shared_path = get_shared_path()
                         ffprobe_path = os.path.join(shared_path, 'ffmpeg', 'bin', 'ffprobe.exe')
@@ -950,14 +1176,7 @@ def stop_recording():
                                 video_path
                             ]
                             
-                            result = subprocess.run(
-                                cmd,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                text=True,
-                                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                timeout=5
-                            )
+                            result = ffmpeg_runner.run(cmd, timeout=5, check=False)
                             
                             if result.returncode == 0 and result.stdout.strip():
                                 video_duration = float(result.stdout.strip())
@@ -971,6 +1190,12 @@ def stop_recording():
                                     logging.warning(f"ffprobe failed after 3 attempts: {result.stderr}")
                     except Exception as e:
                         logging.warning(f"Failed to get video duration: {e}", exc_info=True)
+                    
+                    # The editor will ask for streams, fps and keyframes and play a preview; prepare them now
+                    if video_duration:
+                        media_probe.prefetch(video_path)
+                        schedule_preview(video_path)
+                        schedule_timeline(video_path)
                 
                 del active_sessions[session_id]
                 logging.info(f"Stopped video session {session_id}")
@@ -1020,21 +1245,411 @@ def upload_screenshot():
         logging.error(f"Error uploading screenshot: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def check_guide_cooldown():
+    """Return a 429 response if the guide cooldown is still running, else None"""
+    if last_api_call['timestamp']:
+        time_since_last = (datetime.now() - last_api_call['timestamp']).total_seconds()
+        if time_since_last < last_api_call['cooldown_seconds']:
+            wait_time = int(last_api_call['cooldown_seconds'] - time_since_last)
+            return {
+                'success': False,
+                'error': f'Please wait {wait_time} more seconds before retrying to avoid rate limits.',
+                'error_type': 'cooldown',
+                'wait_seconds': wait_time
+            }, 429
+    return None
+
+def check_ai_circuit():
+    """Return a 503 response if the AI provider's circuit breaker is open, else None"""
+    breaker = get_ai_provider().breaker
+    if breaker.is_open():
+        retry_after = max(breaker.status()['retry_after'], 1)
+        return {
+            'success': False,
+            'error': f'The AI provider is unavailable after repeated failures. Try again in {retry_after} seconds.',
+            'error_type': 'circuit_open',
+            'wait_seconds': retry_after
+        }, 503
+    return None
+
+class GuideInputError(Exception):
+    """Raised when a recording has nothing a guide can be generated from"""
+    
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def collect_guide_screenshots(output_dir):
+    """
+    Find the images to send to the model for a recording.
+    
+    Uses screenshot-mode captures when present, otherwise picks keyframes from
+    recording.mp4 (frames just before each click plus scene changes) in a
+    single FFmpeg pass, kept in memory as PNG bytes.
+    
+    Returns:
+        List of file paths (screenshots) or PNG bytes (keyframes)
+    """
+    # Check for existing screenshots first (screenshot mode)
+    existing_screenshots = sorted([f for f in os.listdir(output_dir) 
+                                  if f.startswith('screenshot_') and f.endswith('.png')])
+    
+    if existing_screenshots:
+        # Use existing screenshots from screenshot mode
+        logging.info(f"Found {len(existing_screenshots)} existing screenshots")
+        return [os.path.join(output_dir, f) for f in existing_screenshots[:5]]  # Max 5 to avoid rate limits
+    
+    # Check for video file
+    video_path = os.path.join(output_dir, 'recording.mp4')
+    if not os.path.exists(video_path):
+        raise GuideInputError('No video file or screenshots found')
+    
+    jobs.report_progress(10, 'Selecting keyframes from video...')
+    ffmpeg_path = get_ffmpeg_path()
+    if not os.path.exists(ffmpeg_path):
+        ffmpeg_path = 'ffmpeg'  # Use system FFmpeg if bundled not found
+    
+    try:
+        keyframes = select_recording_keyframes(
+            output_dir, ffmpeg_path,
+            budget=int(config.get('KEYFRAME_BUDGET', 10)),
+            scene_threshold=float(config.get('KEYFRAME_SCENE_THRESHOLD', 0.3))
+        )
+    except Exception as e:
+        raise GuideInputError(f'Failed to extract frames from video: {e}', 500)
+    
+    if not keyframes:
+        raise GuideInputError('No frames could be extracted from video')
+    
+    logging.info(f"Using {len(keyframes)} keyframes: {keyframes}")
+    return [frame.png for frame in keyframes]
+
+def load_guide_images(screenshots):
+    """Load screenshots (paths or PNG bytes) into memory so the file handles are released"""
+    images = []
+    try:
+        for screenshot in screenshots:
+            # Keyframes arrive as PNG bytes, screenshots as file paths
+            img = Image.open(io.BytesIO(screenshot) if isinstance(screenshot, bytes) else screenshot)
+            # Copy image to memory to release file handle
+            img_copy = img.copy()
+            img.close()
+            images.append(img_copy)
+    except Exception as img_error:
+        # Clean up any opened images
+        for img in images:
+            try:
+                img.close()
+            except:
+                pass
+        raise img_error
+    return images
+
+# Requests and 429s counted locally, so quota status needs no API call
+ai_quota = QuotaTracker(os.path.join(log_dir, 'ai_quota.json'))
+
+# Per-call token, latency and cost accounting (per recording + global rollup)
+ai_ledger = AILedger(os.path.join(log_dir, 'ai_ledger_rollup.json'))
+
+def get_ai_provider():
+    """AI provider selected by AI_PROVIDER in config.txt ('gemini' by default, or 'fake')"""
+    provider = get_provider(config)
+    if provider.quota is None:
+        provider.quota = ai_quota
+    if provider.ledger is None:
+        provider.ledger = ai_ledger
+    return provider
+
+def ledger_operation(operation):
+    """Attribute AI calls made by an endpoint to its operation and the request's output_dir"""
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            payload = request.get_json(silent=True)
+            output_dir = payload.get('output_dir') if isinstance(payload, dict) else None
+            with ai_ledger.context(os.path.normpath(output_dir) if output_dir else None, operation):
+                return view_func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+FALLBACK_GEMINI_MODELS = [
+    {'name': 'gemini-2.5-flash', 'display_name': 'Gemini 2.5 Flash', 'description': 'Latest stable multimodal model'},
+    {'name': 'gemini-2.5-pro', 'display_name': 'Gemini 2.5 Pro', 'description': 'Most capable model'},
+    {'name': 'gemini-2.0-flash', 'display_name': 'Gemini 2.0 Flash', 'description': 'Fast and versatile'},
+    {'name': 'gemini-2.0-flash-exp', 'display_name': 'Gemini 2.0 Flash Experimental', 'description': 'Experimental features'},
+    {'name': 'gemini-flash-latest', 'display_name': 'Gemini Flash Latest', 'description': 'Always points to latest Flash'},
+    {'name': 'gemini-pro-latest', 'display_name': 'Gemini Pro Latest', 'description': 'Always points to latest Pro'}
+]
+
+def fetch_gemini_models():
+    """List models that support generateContent, stable releases first"""
+    models = []
+    for model in get_ai_provider().list_models():
+        # Only include models that support generateContent
+        if 'generateContent' in model.supported_generation_methods:
+            model_name = model.name.replace('models/', '')
+            description = model.description if model.description else ''
+            
+            # Skip embedding and specialized models
+            if any(skip in model_name.lower() for skip in ['embedding', 'aqa', 'imagen', 'veo', 'live', 'tts', 'audio', 'robotics', 'computer-use']):
+                continue
+            
+            models.append({
+                'name': model_name,
+                'display_name': model.display_name,
+                'description': description[:100] if description else ''
+            })
+    
+    # Sort models - put stable releases first, then experimental
+    models.sort(key=lambda x: (
+        'exp' in x['name'].lower() or 'preview' in x['name'].lower(),
+        x['name']
+    ))
+    return models
+
+model_catalog = ModelCatalog(
+    os.path.join(log_dir, 'models_cache.json'),
+    fetch_gemini_models,
+    ttl=int(config.get('MODEL_CACHE_SECONDS', CACHE_DURATION))
+)
+
+# Narration voices (edge-tts list fetched over the network), cached the same way
+voice_catalog = ModelCatalog(
+    os.path.join(log_dir, narration.VOICE_CACHE_FILE),
+    narration.fetch_edge_voices,
+    ttl=int(config.get('VOICE_CACHE_SECONDS', narration.VOICE_CACHE_SECONDS)),
+    label='Voice list'
+)
+if narration.EdgeTTSBackend().is_available():
+    voice_catalog.prefetch('edge')
+
+# Media metadata and keyframe index per file, reused until its size or mtime changes
+media_probe = MediaProbeCache(os.path.join(log_dir, 'media_probe_cache.json'), get_ffprobe_path)
+
+# Editor asset jobs (previews, timeline assets) by operation and normalized video path
+editor_asset_jobs = {}
+editor_asset_jobs_lock = threading.Lock()
+
+def schedule_editor_asset(operation, video_path, is_ready, build):
+    """Queue build(key) for a video unless is_ready(key) or it is already queued; returns the job or None"""
+    key = os.path.normpath(video_path)
+    with editor_asset_jobs_lock:
+        job = job_manager.get(editor_asset_jobs.get((operation, key), ''))
+        if job is not None and job.status in (jobs.QUEUED, jobs.RUNNING):
+            return job
+        if is_ready(key):
+            return None
+        
+        job = job_manager.submit(operation, lambda: build(key), {'video_path': key})
+        editor_asset_jobs[(operation, key)] = job.id
+        return job
+
+def schedule_preview(video_path):
+    """Queue proxy/HLS preview generation (see shared/utils/preview.py)"""
+    def build(key):
+        current_config = load_config()
+        generate_preview(get_ffmpeg_path(), key,
+                         height=int(current_config.get('PREVIEW_HEIGHT', DEFAULT_PREVIEW_HEIGHT)),
+                         bitrate=current_config.get('PREVIEW_BITRATE', DEFAULT_PREVIEW_BITRATE))
+        return {'success': True, 'preview_dir': preview_dir(key)}
+    
+    return schedule_editor_asset('generate_preview', video_path, lambda key: preview_status(key) == 'ready', build)
+
+def schedule_timeline(video_path):
+    """Queue filmstrip sprite and waveform generation (see shared/utils/timeline_assets.py)"""
+    def build(key):
+        interval = float(load_config().get('TIMELINE_THUMB_INTERVAL', DEFAULT_THUMB_INTERVAL))
+        manifest = generate_timeline_assets(get_ffmpeg_path(), key, media_probe.info(key), interval=interval)
+        return {'success': True, 'timeline_dir': timeline_dir(key), 'thumbnails': manifest['count']}
+    
+    return schedule_editor_asset('generate_timeline', video_path, lambda key: load_timeline_manifest(key) is not None,
+                                 build)
+
+def get_guide_model(provider):
+    """Create the configured Gemini model, falling back to the default"""
+    # Reload config to get latest model selection
+    current_config = load_config()
+    model_name = current_config.get('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+    logging.info(f"Using Gemini model: {model_name}")
+    
+    try:
+        model = provider.get_model(model_name)
+    except Exception as model_error:
+        logging.warning(f"Failed to load model {model_name}: {model_error}. Falling back to gemini-2.0-flash-exp")
+        model = provider.get_model('gemini-2.0-flash-exp')
+    return model, model_name
+
+# Screenshot recordings whose steps are described while recording (output_dir -> LiveGuideAnnotator)
+live_annotators = {}
+
+def start_live_annotation(output_dir):
+    """Describe steps in the background while a screenshot session records (None without an AI provider)"""
+    provider = get_ai_provider()
+    if not provider.is_configured():
+        logging.warning("Live annotation requested but no AI provider is configured")
+        return None
+    model, _ = get_guide_model(provider)
+    # Low priority: user requests always go first under the shared rate limiter
+    builder = IncrementalGuideBuilder(output_dir, model, rate_limiter=ai_rate_limiter, low_priority=True)
+    annotator = LiveGuideAnnotator(builder, call_context=lambda: ai_ledger.context(output_dir, 'live_annotation'))
+    live_annotators[os.path.normpath(output_dir)] = annotator
+    logging.info(f"Live annotation enabled for {output_dir}")
+    return annotator
+
+def build_guide_prompt(screenshot_count, structured=False):
+    """Prompt for a step-by-step guide covering screenshot_count screenshots (JSON fields when structured)"""
+    if structured:
+        return STRUCTURED_GUIDE_PROMPT.format(screenshot_count=screenshot_count)
+    return f"""You are analyzing {screenshot_count} screenshots to create a professional step-by-step how-to guide.
+
+Carefully examine each screenshot image and create a detailed, educational guide with:
+
+1. A clear, engaging title for the tutorial based on what you see
+2. A brief introduction explaining what will be accomplished
+3. Step-by-step instructions (one for each screenshot):
+   - Start with "Step 1:", "Step 2:", etc.
+   - Describe exactly what you SEE in each screenshot
+   - Identify specific UI elements, buttons, menus, text fields visible
+   - Explain what action should be taken ("Click on...", "Type in...", "Select...")
+   - Explain WHY each step matters
+   - Use professional but friendly language
+4. A brief conclusion or next steps
+
+Analyze the visual content of each screenshot carefully. Reference specific elements you can see like button labels, menu items, window titles, etc.
+
+Write in a natural, human-like style - as if an expert is explaining this to a colleague while showing them the screenshots. Be clear, educational, and encouraging. Keep each step concise but informative (2-4 sentences per step).
+
+IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
+
+def is_rate_limit_error(error_msg):
+    return '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower() or 'RESOURCE_EXHAUSTED' in error_msg
+
+def classify_guide_error(error_msg, model_name, subject='screenshots'):
+    """Map a final generation error to (response payload, HTTP status)"""
+    if 'circuit open' in error_msg:
+        return {
+            'success': False,
+            'error': 'The AI provider is unavailable after repeated failures. Please try again shortly.',
+            'error_type': 'circuit_open'
+        }, 503
+    elif is_rate_limit_error(error_msg):
+        return {
+            'success': False, 
+            'error': 'API rate limit exceeded after retries. Please wait a few minutes and try again.',
+            'error_type': 'rate_limit'
+        }, 429
+    elif 'SAFETY' in error_msg.upper() or 'blocked' in error_msg.lower():
+        return {
+            'success': False,
+            'error': f'Content was blocked by safety filters. Try different {subject}.',
+            'error_type': 'safety'
+        }, 400
+    elif 'invalid' in error_msg.lower() and 'model' in error_msg.lower():
+        return {
+            'success': False,
+            'error': f'Invalid model: {model_name}. Please select a different model in settings.',
+            'error_type': 'invalid_model'
+        }, 400
+    else:
+        return {
+            'success': False,
+            'error': f'Generation failed: {error_msg}',
+            'error_type': 'generation_error'
+        }, 500
+
+def write_guide_notes(output_dir, notes):
+    """Write notes.json atomically so the editor never reads a half-written file"""
+    notes_path = os.path.join(output_dir, 'notes.json')
+    temp_path = notes_path + '.tmp'
+    with recording_lock(output_dir):
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(notes, f, indent=2)
+        os.replace(temp_path, notes_path)
+    return notes_path
+
+def save_guide_outputs(output_dir, guide_text, notes, guide_title=None):
+    """Save guide.txt, transcript.txt, title.txt and notes.json for a generated guide"""
+    guide_path = os.path.join(output_dir, 'guide.txt')
+    transcript_path = os.path.join(output_dir, 'transcript.txt')
+    guide_title = guide_title or extract_guide_title(guide_text)
+    
+    # One writer at a time, so concurrent runs can't leave a mix of two guides behind
+    with recording_lock(output_dir):
+        # Save guide as both guide.txt and transcript.txt for compatibility
+        with open(guide_path, 'w', encoding='utf-8') as f:
+            f.write(guide_text)
+        with open(transcript_path, 'w', encoding='utf-8') as f:
+            f.write(guide_text)
+        
+        # Save title to a separate file for the editor
+        title_path = os.path.join(output_dir, 'title.txt')
+        with open(title_path, 'w', encoding='utf-8') as f:
+            f.write(guide_title)
+        
+        notes_path = write_guide_notes(output_dir, notes)
+    logging.info(f"Guide generated: {guide_path}, {len(notes)} step notes saved to {notes_path}")
+    return guide_path, guide_title
+
+guide_metrics_path = os.path.join(log_dir, 'guide_metrics.jsonl')
+
+def finish_live_guide(output_dir, annotator, started):
+    """
+    Guide for a live-annotated recording: steps were described while recording,
+    so only leftover steps and the title/introduction/conclusion pass remain.
+    """
+    jobs.report_progress(30, 'Waiting for live step descriptions...')
+    annotator.finish()
+    builder = annotator.builder
+    builder.low_priority = False  # The user is waiting now
+    builder.progress = lambda message: jobs.report_progress(message=message)
+    described_live = annotator.status()['described']
+    
+    guide_text = builder.finalize()
+    notes = builder.notes
+    guide_path, guide_title = save_guide_outputs(output_dir, guide_text, notes)
+    live_annotators.pop(output_dir, None)
+    last_api_call['timestamp'] = datetime.now()
+    
+    elapsed = round(time.time() - started, 2)
+    record_guide_metrics({
+        'mode': 'live',
+        'output_dir': output_dir,
+        'screenshots': len(notes),
+        'steps': len(notes),
+        'described_while_recording': described_live,
+        'time_to_first_step': elapsed if notes else None,
+        'total_seconds': elapsed
+    })
+    return {
+        'success': True,
+        'guide': guide_text,
+        'guide_path': guide_path,
+        'title': guide_title,
+        'notes_count': len(notes),
+        'live_annotation': True
+    }
+
+def record_guide_metrics(metrics):
+    """Append one guide generation's timings to guide_metrics.jsonl"""
+    metrics = dict(metrics, timestamp=datetime.now().isoformat())
+    logging.info(f"Guide metrics: {metrics}")
+    try:
+        with open(guide_metrics_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrics) + '\n')
+    except Exception as e:
+        logging.warning(f"Could not record guide metrics: {e}")
+
 @app.route('/api/generate_guide', methods=['POST'])
+@background_capable('generate_guide')
+@coalesce_requests(guide_request_key)
+@ledger_operation('generate_guide')
 def generate_guide():
     """Generate AI guide from screenshots"""
     try:
         # Check rate limit before doing anything
-        if last_api_call['timestamp']:
-            time_since_last = (datetime.now() - last_api_call['timestamp']).total_seconds()
-            if time_since_last < last_api_call['cooldown_seconds']:
-                wait_time = int(last_api_call['cooldown_seconds'] - time_since_last)
-                return jsonify({
-                    'success': False,
-                    'error': f'Please wait {wait_time} more seconds before retrying to avoid rate limits.',
-                    'error_type': 'cooldown',
-                    'wait_seconds': wait_time
-                }), 429
+        cooldown = check_guide_cooldown() or check_ai_circuit()
+        if cooldown:
+            return jsonify(cooldown[0]), cooldown[1]
         
         data = request.json
         output_dir = data.get('output_dir')
@@ -1048,246 +1663,106 @@ def generate_guide():
         if not os.path.exists(output_dir):
             return jsonify({'success': False, 'error': f'Invalid output directory: {output_dir}'}), 400
         
-        # Check for existing screenshots first (screenshot mode)
-        existing_screenshots = sorted([f for f in os.listdir(output_dir) 
-                                      if f.startswith('screenshot_') and f.endswith('.png')])
-        
-        screenshots = []
-        temp_dir = None
+        jobs.report_progress(5, 'Collecting screenshots...')
+        started = time.time()
         
-        if existing_screenshots:
-            # Use existing screenshots from screenshot mode
-            logging.info(f"Found {len(existing_screenshots)} existing screenshots")
-            screenshots = [os.path.join(output_dir, f) for f in existing_screenshots[:5]]  # Max 5 to avoid rate limits
-        else:
-            # Check for video file
-            video_path = os.path.join(output_dir, 'recording.mp4')
-            if not os.path.exists(video_path):
-                return jsonify({'success': False, 'error': 'No video file or screenshots found'}), 400
-            
-            # Extract frames from video (every 5 seconds)
-            import subprocess
-            import tempfile
-            
-            temp_dir = tempfile.mkdtemp()
-            frame_pattern = os.path.join(temp_dir, 'frame_%03d.png')
+        annotator = live_annotators.get(output_dir)
+        if annotator:
+            return jsonify(finish_live_guide(output_dir, annotator, started))
         
-            # Use FFmpeg to extract frames
-            ffmpeg_path = get_ffmpeg_path()
-            if not os.path.exists(ffmpeg_path):
-                ffmpeg_path = 'ffmpeg'  # Use system FFmpeg if bundled not found
-            
-            try:
-                # Extract 1 frame every 5 seconds, max 10 frames
-                subprocess.run([
-                    ffmpeg_path, '-i', video_path,
-                    '-vf', 'fps=1/5',  # 1 frame every 5 seconds
-                    '-frames:v', '10',  # Max 10 frames
-                    '-q:v', '2',  # High quality
-                    frame_pattern
-                ], check=True, capture_output=True)
-            except subprocess.CalledProcessError as e:
-                return jsonify({'success': False, 'error': f'Failed to extract frames from video: {e.stderr.decode() if e.stderr else str(e)}'}), 500
-            
-            # Get extracted frames
-            screenshots = sorted([os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.png')])
-            
-            if not screenshots:
-                return jsonify({'success': False, 'error': 'No frames could be extracted from video'}), 400
+        try:
+            screenshots = collect_guide_screenshots(output_dir)
+        except GuideInputError as e:
+            return jsonify({'success': False, 'error': str(e)}), e.status_code
         
         # Import AI guide generation
         try:
-            import google.generativeai as genai
-            from PIL import Image
-            
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if not api_key:
+            provider = get_ai_provider()
+            if not provider.is_configured():
                 return jsonify({'success': False, 'error': 'GEMINI_API_KEY not configured'}), 400
             
-            genai.configure(api_key=api_key)
-            
-            # Reload config to get latest model selection
-            current_config = load_config()
-            model_name = current_config.get('GEMINI_MODEL', 'gemini-2.0-flash-exp')
-            logging.info(f"Using Gemini model: {model_name}")
-            
-            try:
-                model = genai.GenerativeModel(model_name)
-            except Exception as model_error:
-                logging.warning(f"Failed to load model {model_name}: {model_error}. Falling back to gemini-2.0-flash-exp")
-                model = genai.GenerativeModel('gemini-2.0-flash-exp')
+            model, model_name = get_guide_model(provider)
             
             # Load images (with context manager to ensure they're closed)
-            images = []
-            try:
-                for screenshot_path in screenshots:
-                    img = Image.open(screenshot_path)
-                    # Copy image to memory to release file handle
-                    img_copy = img.copy()
-                    img.close()
-                    images.append(img_copy)
-            except Exception as img_error:
-                # Clean up any opened images
-                for img in images:
-                    try:
-                        img.close()
-                    except:
-                        pass
-                raise img_error
+            images = load_guide_images(screenshots)
+            # Ask for schema-constrained JSON unless disabled for models without JSON mode
+            structured = config.get('GUIDE_JSON_OUTPUT', 'true').lower() != 'false'
+            prompt = build_guide_prompt(len(screenshots), structured)
             
-            prompt = f"""You are analyzing {len(screenshots)} screenshots to create a professional step-by-step how-to guide.
-
-Carefully examine each screenshot image and create a detailed, educational guide with:
-
-1. A clear, engaging title for the tutorial based on what you see
-2. A brief introduction explaining what will be accomplished
-3. Step-by-step instructions (one for each screenshot):
-   - Start with "Step 1:", "Step 2:", etc.
-   - Describe exactly what you SEE in each screenshot
-   - Identify specific UI elements, buttons, menus, text fields visible
-   - Explain what action should be taken ("Click on...", "Type in...", "Select...")
-   - Explain WHY each step matters
-   - Use professional but friendly language
-4. A brief conclusion or next steps
-
-Analyze the visual content of each screenshot carefully. Reference specific elements you can see like button labels, menu items, window titles, etc.
-
-Write in a natural, human-like style - as if an expert is explaining this to a colleague while showing them the screenshots. Be clear, educational, and encouraging. Keep each step concise but informative (2-4 sentences per step).
-
-IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
-
             logging.info(f"Generating guide for {len(screenshots)} screenshots...")
+            log_prompt_tokens('generate_guide', [prompt] + images)
+            jobs.report_progress(30, f'Generating guide for {len(screenshots)} screenshots...')
             
             # Retry logic with exponential backoff for rate limits
             max_retries = 3
             retry_delay = 2  # Start with 2 seconds
             guide_text = None
+            attempt = 0
             
-            for attempt in range(max_retries):
+            while attempt < max_retries:
+                jobs.check_cancelled()
                 try:
-                    response = model.generate_content([prompt] + images)
+                    generation_kwargs = {'generation_config': guide_generation_config()} if structured else {}
+                    with ai_rate_limiter.slot(sleep=jobs.sleep):
+                        response = model.generate_content([prompt] + images, attempt=attempt + 1, **generation_kwargs)
                     guide_text = response.text.strip()
                     # Update timestamp after successful API call
                     last_api_call['timestamp'] = datetime.now()
                     break  # Success, exit retry loop
                 except Exception as gen_error:
                     error_msg = str(gen_error)
-                    is_rate_limit = '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower() or 'RESOURCE_EXHAUSTED' in error_msg
                     
-                    if is_rate_limit and attempt < max_retries - 1:
+                    if structured and is_schema_unsupported_error(error_msg):
+                        # Model has no JSON mode: ask again for free text (doesn't use up a retry)
+                        logging.warning(f"{model_name} rejected JSON output, falling back to text: {error_msg}")
+                        structured = False
+                        prompt = build_guide_prompt(len(screenshots))
+                        continue
+                    
+                    attempt += 1
+                    # Once the breaker opens, further retries would only be rejected
+                    if is_rate_limit_error(error_msg) and attempt < max_retries and not provider.breaker.is_open():
                         # Wait and retry
-                        wait_time = retry_delay * (2 ** attempt)  # Exponential backoff: 2s, 4s, 8s
-                        logging.warning(f"Rate limit hit on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
-                        time.sleep(wait_time)
+                        wait_time = retry_delay * (2 ** (attempt - 1))  # Exponential backoff: 2s, 4s, 8s
+                        logging.warning(f"Rate limit hit on attempt {attempt}/{max_retries}. Retrying in {wait_time}s...")
+                        jobs.report_progress(message=f'Rate limited, retrying in {wait_time}s...')
+                        ai_rate_limiter.backoff(wait_time)
                         continue
                     else:
                         # Final attempt failed or non-rate-limit error
                         logging.error(f"Error during guide generation: {error_msg}", exc_info=True)
-                        
-                        # Check for specific error types
-                        if is_rate_limit:
-                            return jsonify({
-                                'success': False, 
-                                'error': 'API rate limit exceeded after retries. Please wait a few minutes and try again.',
-                                'error_type': 'rate_limit'
-                            }), 429
-                        elif 'SAFETY' in error_msg.upper() or 'blocked' in error_msg.lower():
-                            return jsonify({
-                                'success': False,
-                                'error': 'Content was blocked by safety filters. Try different screenshots.',
-                                'error_type': 'safety'
-                            }), 400
-                        elif 'invalid' in error_msg.lower() and 'model' in error_msg.lower():
-                            return jsonify({
-                                'success': False,
-                                'error': f'Invalid model: {model_name}. Please select a different model in settings.',
-                                'error_type': 'invalid_model'
-                            }), 400
-                        else:
-                            return jsonify({
-                                'success': False,
-                                'error': f'Generation failed: {error_msg}',
-                                'error_type': 'generation_error'
-                            }), 500
-            
-            # Save guide as both guide.txt and transcript.txt for compatibility
-            guide_path = os.path.join(output_dir, 'guide.txt')
-            transcript_path = os.path.join(output_dir, 'transcript.txt')
-            with open(guide_path, 'w', encoding='utf-8') as f:
-                f.write(guide_text)
-            with open(transcript_path, 'w', encoding='utf-8') as f:
-                f.write(guide_text)
-            
-            # Extract title from the first line(s) of the guide
-            guide_title = "How-To Guide"
-            for line in guide_text.split('\n')[:5]:  # Check first 5 lines
-                line_clean = line.strip().lstrip('#').strip()
-                if line_clean and not line_clean.startswith('Welcome') and not line_clean.startswith('This guide'):
-                    guide_title = line_clean
-                    break
+                        payload, status = classify_guide_error(error_msg, model_name)
+                        return jsonify(payload), status
             
-            # Save title to a separate file for the editor
-            title_path = os.path.join(output_dir, 'title.txt')
-            with open(title_path, 'w', encoding='utf-8') as f:
-                f.write(guide_title)
+            jobs.report_progress(90, 'Saving guide...')
             
-            # Parse guide into individual step notes and save to notes.json
-            notes = []
-            lines = guide_text.split('\n')
-            current_step = 0
-            current_note = []
-            
-            for line in lines:
-                line_stripped = line.strip()
-                # Remove markdown bold markers and headers
-                line_clean = line_stripped.replace('**', '').lstrip('#').strip()
-                
-                # Check if this is a step header (e.g., "Step 1:", "### Step 2:", etc.)
-                if line_clean.startswith('Step ') and ':' in line_clean:
-                    # Save previous step if exists
-                    if current_note and current_step > 0:
-                        notes.append({
-                            'step': str(current_step),
-                            'note': '\n'.join(current_note).strip(),
-                            'type': 'screenshot'
-                        })
-                        current_note = []
-                    
-                    # Start new step
-                    current_step += 1
-                    # Add the step line without the "Step X:" prefix
-                    step_content = line_clean.split(':', 1)[1].strip() if ':' in line_clean else line_clean
-                    current_note.append(step_content)
-                elif current_step > 0 and line_stripped and not line_stripped.startswith('---') and not line_stripped.startswith('!['):
-                    # Add content to current step, removing markdown formatting
-                    # Skip horizontal rules (---) and image references (![...)
-                    clean_content = line_stripped.replace('**', '').lstrip('#').strip()
-                    if clean_content:
-                        current_note.append(clean_content)
-            
-            # Save last step
-            if current_note and current_step > 0:
-                notes.append({
-                    'step': str(current_step),
-                    'note': '\n'.join(current_note).strip(),
-                    'type': 'screenshot'
-                })
-            
-            # Save notes to notes.json
-            notes_path = os.path.join(output_dir, 'notes.json')
-            with open(notes_path, 'w', encoding='utf-8') as f:
-                import json
-                json.dump(notes, f, indent=2)
-            
-            # Clean up temporary frames if created
-            if temp_dir:
-                import shutil
-                try:
-                    shutil.rmtree(temp_dir)
-                except Exception as cleanup_error:
-                    logging.warning(f"Failed to clean up temp directory: {cleanup_error}")
+            # Build step notes straight from the JSON fields; free text (or JSON the model
+            # didn't follow) goes through the tolerant line parser instead
+            guide = parse_structured_guide(guide_text, len(screenshots)) if structured else None
+            if guide:
+                screenshot_files = [s for s in screenshots if isinstance(s, str)] or None
+                notes = structured_guide_notes(guide, screenshot_files)
+                guide_text = render_guide_text(guide)
+                guide_title = guide['title'] or None
+            else:
+                if structured:
+                    logging.warning("Guide response was not usable JSON, parsing it as text")
+                notes = parse_guide_notes(guide_text)
+                guide_title = None
+            guide_path, guide_title = save_guide_outputs(output_dir, guide_text, notes, guide_title)
             
-            logging.info(f"Guide generated: {guide_path}, {len(notes)} step notes saved to {notes_path}")
+            # Without streaming, the first step only arrives with the full response
+            elapsed = round(time.time() - started, 2)
+            record_guide_metrics({
+                'mode': 'blocking',
+                'output_dir': output_dir,
+                'model': model_name,
+                'structured': bool(guide),
+                'screenshots': len(screenshots),
+                'steps': len(notes),
+                'time_to_first_step': elapsed if notes else None,
+                'total_seconds': elapsed
+            })
             
             return jsonify({
                 'success': True,
@@ -1303,7 +1778,200 @@ IMPORTANT: Write ONLY the guide content. Do NOT include any meta-commentary."""
         logging.error(f"Error generating guide: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/generate_guide_stream', methods=['GET'])
+def generate_guide_stream():
+    """
+    Generate an AI guide and stream it to the browser as Server-Sent Events.
+    
+    Events:
+        delta - {"text"}: partial guide text as it arrives from the model
+        step  - {"step", "note", "type"}: a step that has finished; notes.json is updated
+        done  - same payload as /api/generate_guide plus timing metrics
+        error - {"error", "error_type"}
+    """
+    output_dir = request.args.get('output_dir')
+    
+    def error_stream(payload):
+        yield sse_event('error', payload)
+    
+    def error_response(payload):
+        return Response(error_stream(payload), mimetype='text/event-stream')
+    
+    cooldown = check_guide_cooldown() or check_ai_circuit()
+    if cooldown:
+        return error_response(cooldown[0])
+    if not output_dir:
+        return error_response({'success': False, 'error': 'No output directory specified'})
+    output_dir = os.path.normpath(output_dir)
+    if not os.path.exists(output_dir):
+        return error_response({'success': False, 'error': f'Invalid output directory: {output_dir}'})
+    
+    def generate():
+        started = time.time()
+        try:
+            provider = get_ai_provider()
+            if not provider.is_configured():
+                yield sse_event('error', {'success': False, 'error': 'GEMINI_API_KEY not configured'})
+                return
+            
+            try:
+                screenshots = collect_guide_screenshots(output_dir)
+            except GuideInputError as e:
+                yield sse_event('error', {'success': False, 'error': str(e)})
+                return
+            
+            model, model_name = get_guide_model(provider)
+            images = load_guide_images(screenshots)
+            prompt = build_guide_prompt(len(screenshots))
+            
+            logging.info(f"Streaming guide for {len(screenshots)} screenshots...")
+            log_prompt_tokens('generate_guide_stream', [prompt] + images)
+            
+            max_retries = 3
+            retry_delay = 2
+            parser = None
+            notes = []
+            first_token_at = None
+            first_step_at = None
+            
+            for attempt in range(max_retries):
+                parser = StepParser()
+                notes = []
+                received_text = False
+                try:
+                    # Only the request itself counts against the limit; the stream may stay open a while
+                    ai_rate_limiter.wait()
+                    for chunk in model.generate_content([prompt] + images, stream=True, attempt=attempt + 1):
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            continue  # Chunk without text parts (e.g. finish reason only)
+                        if not text:
+                            continue
+                        if first_token_at is None:
+                            first_token_at = time.time()
+                        received_text = True
+                        yield sse_event('delta', {'text': text})
+                        
+                        for note in parser.feed(text):
+                            if first_step_at is None:
+                                first_step_at = time.time()
+                            notes.append(note)
+                            write_guide_notes(output_dir, notes)
+                            yield sse_event('step', note)
+                    
+                    for note in parser.finish():
+                        if first_step_at is None:
+                            first_step_at = time.time()
+                        notes.append(note)
+                        write_guide_notes(output_dir, notes)
+                        yield sse_event('step', note)
+                    
+                    last_api_call['timestamp'] = datetime.now()
+                    break
+                except Exception as gen_error:
+                    error_msg = str(gen_error)
+                    # Partial output has already reached the browser, so only retry clean failures
+                    if (is_rate_limit_error(error_msg) and not received_text and attempt < max_retries - 1
+                            and not provider.breaker.is_open()):
+                        wait_time = retry_delay * (2 ** attempt)  # Exponential backoff: 2s, 4s, 8s
+                        logging.warning(f"Rate limit hit on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
+                        yield sse_event('status', {'message': f'Rate limited, retrying in {wait_time}s...'})
+                        ai_rate_limiter.backoff(wait_time)
+                        continue
+                    logging.error(f"Error during streamed guide generation: {error_msg}", exc_info=True)
+                    payload, _ = classify_guide_error(error_msg, model_name)
+                    yield sse_event('error', payload)
+                    return
+            
+            guide_text = parser.text.strip()
+            guide_path, guide_title = save_guide_outputs(output_dir, guide_text, notes)
+            
+            metrics = {
+                'mode': 'stream',
+                'output_dir': output_dir,
+                'model': model_name,
+                'screenshots': len(screenshots),
+                'steps': len(notes),
+                'time_to_first_token': round(first_token_at - started, 2) if first_token_at else None,
+                'time_to_first_step': round(first_step_at - started, 2) if first_step_at else None,
+                'total_seconds': round(time.time() - started, 2)
+            }
+            record_guide_metrics(metrics)
+            
+            yield sse_event('done', {
+                'success': True,
+                'guide': guide_text,
+                'guide_path': guide_path,
+                'title': guide_title,
+                'notes_count': len(notes),
+                'metrics': metrics
+            })
+        except GeneratorExit:
+            logging.info(f"Guide stream closed by client: {output_dir}")
+        except ImportError as e:
+            yield sse_event('error', {'success': False, 'error': f'Missing dependency: {str(e)}'})
+        except Exception as e:
+            logging.error(f"Error streaming guide: {e}", exc_info=True)
+            yield sse_event('error', {'success': False, 'error': str(e)})
+    
+    def generate_with_ledger():
+        with ai_ledger.context(output_dir, 'generate_guide_stream'):
+            yield from generate()
+    
+    return Response(stream_with_context(generate_with_ledger()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/live_annotation', methods=['GET'])
+def get_live_annotation():
+    """Progress of live step annotation for a recording (?output_dir=...)"""
+    output_dir = os.path.normpath(request.args.get('output_dir', ''))
+    annotator = live_annotators.get(output_dir)
+    if annotator is None:
+        return jsonify({'success': False, 'error': 'Live annotation is not active for this recording'}), 404
+    return jsonify(dict(annotator.status(), success=True))
+
+@app.route('/api/guide_metrics', methods=['GET'])
+def get_guide_metrics():
+    """Recent guide generation timings, including time-to-first-step"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        entries = []
+        if os.path.exists(guide_metrics_path):
+            with open(guide_metrics_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            continue
+        entries = entries[-limit:]
+        
+        summary = {}
+        for mode in ('stream', 'blocking', 'live'):
+            values = sorted(e['time_to_first_step'] for e in entries
+                            if e.get('mode') == mode and e.get('time_to_first_step') is not None)
+            if values:
+                summary[mode] = {
+                    'count': len(values),
+                    'median_time_to_first_step': values[len(values) // 2],
+                    'max_time_to_first_step': values[-1]
+                }
+        
+        return jsonify({'success': True, 'summary': summary, 'entries': entries})
+    except Exception as e:
+        logging.error(f"Error reading guide metrics: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/add_narration', methods=['POST'])
+@background_capable('add_narration')
 def add_narration():
     """Add AI narration to a video recording"""
     try:
@@ -1333,17 +2001,16 @@ def add_narration():
                 'error': 'No transcript found. Please write a transcript or generate a guide first.'
             }), 400
         
-        # Import narration module
-        from shared.guide import narration
-        
         logging.info(f"Adding narration to video in {output_dir}")
+        jobs.report_progress(10, 'Generating narration...')
         
         try:
             # Generate narrated video
             narrated_video_path = narration.add_narration_to_video(
                 scribble_dir=output_dir,
                 transcript_path=transcript_path,
-                output_name="narrated_video.mp4"
+                output_name="narrated_video.mp4",
+                config=load_config()
             )
             
             logging.info(f"Narrated video created: {narrated_video_path}")
@@ -1431,8 +2098,9 @@ def save_transcript():
         transcript_path = os.path.join(output_dir, 'transcript.txt')
         
         try:
-            with open(transcript_path, 'w', encoding='utf-8') as f:
-                f.write(transcript_text)
+            with recording_lock(output_dir):
+                with open(transcript_path, 'w', encoding='utf-8') as f:
+                    f.write(transcript_text)
             
             logging.info(f"Transcript saved to {transcript_path}")
             
@@ -1452,6 +2120,99 @@ def save_transcript():
         logging.error(f"Error in save_transcript endpoint: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+STEP_INSTRUCTIONS_PROMPT = """Analyze this screenshot and provide clear, concise step-by-step instructions for what the user should do.
+
+Focus on:
+- Identifying specific UI elements visible (buttons, menus, fields, etc.)
+- Describing the exact action to take ("Click on...", "Type into...", "Select...")
+- Explaining why this step matters (briefly)
+
+Write 2-4 sentences in a professional but friendly tone, as if guiding a colleague. Be specific about what you see in the image.
+
+IMPORTANT: Write ONLY the instructions. Do NOT include any meta-commentary or labels like "Step 1:"."""
+
+class StepInstructionError(Exception):
+    """Generation failed; payload/status_code are the JSON error response"""
+    
+    def __init__(self, payload, status_code):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status_code = status_code
+
+def decode_image_data(image_data):
+    """Decode a base64 image, with or without a data: URL prefix"""
+    import base64
+    # Remove data URL prefix if present
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+def step_instruction_cache_key(model_name, image_bytes):
+    """AI response cache key for one screenshot's instructions"""
+    return ai_response_cache.make_key('step_instructions', get_ai_provider().name, model_name, STEP_INSTRUCTIONS_PROMPT, image_bytes)
+
+def generate_step_instruction_text(model, model_name, image_bytes, output_dir=None):
+    """
+    Generate instructions for one screenshot, using the AI response cache.
+    
+    Args:
+        model: Gemini GenerativeModel
+        model_name: Name of the model (part of the cache key)
+        image_bytes: Encoded image file contents
+        output_dir: Recording the step belongs to (for the AI ledger)
+        
+    Returns:
+        (instructions, cached)
+    """
+    with ai_ledger.context(output_dir, 'step_instructions'):
+        cache_key = step_instruction_cache_key(model_name, image_bytes)
+        cached = ai_response_cache.get(cache_key)
+        if cached:
+            ai_ledger.record_cache_hit(model_name)
+            return cached['instructions'], True
+        
+        # Load image in memory so no file handle stays open
+        image = Image.open(io.BytesIO(image_bytes))
+        log_prompt_tokens('step_instructions', [STEP_INSTRUCTIONS_PROMPT, image])
+        
+        # Retry logic with exponential backoff for rate limits
+        max_retries = 3
+        retry_delay = 2  # Start with 2 seconds
+        
+        for attempt in range(max_retries):
+            try:
+                with ai_rate_limiter.slot():
+                    response = model.generate_content([STEP_INSTRUCTIONS_PROMPT, image], attempt=attempt + 1)
+                instructions = response.text.strip()
+                break  # Success, exit retry loop
+            except Exception as gen_error:
+                error_msg = str(gen_error)
+                
+                if is_rate_limit_error(error_msg) and attempt < max_retries - 1 and not get_ai_provider().breaker.is_open():
+                    # Wait and retry
+                    wait_time = retry_delay * (2 ** attempt)  # Exponential backoff: 2s, 4s, 8s
+                    logging.warning(f"Rate limit hit on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
+                    ai_rate_limiter.backoff(wait_time)
+                    continue
+                else:
+                    # Final attempt failed or non-rate-limit error
+                    logging.error(f"Error during instruction generation: {error_msg}", exc_info=True)
+                    payload, status = classify_guide_error(error_msg, model_name, subject='screenshot')
+                    raise StepInstructionError(payload, status)
+        
+        ai_response_cache.set(cache_key, {'instructions': instructions, 'model': model_name})
+        return instructions, False
+
+def get_step_instructions_model():
+    """Return (model, model_name) from the AI provider, or raise StepInstructionError"""
+    provider = get_ai_provider()
+    if not provider.is_configured():
+        raise StepInstructionError({'success': False, 'error': 'GEMINI_API_KEY not configured'}, 400)
+    circuit = check_ai_circuit()
+    if circuit:
+        raise StepInstructionError(*circuit)
+    return get_guide_model(provider)
+
 @app.route('/api/generate_step_instructions', methods=['POST'])
 def generate_step_instructions():
     """Generate AI instructions for a single screenshot"""
@@ -1462,94 +2223,24 @@ def generate_step_instructions():
         if not image_path or not os.path.exists(image_path):
             return jsonify({'success': False, 'error': 'Invalid image path'}), 400
         
-        # Import AI generation
         try:
-            import google.generativeai as genai
-            from PIL import Image
-            
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if not api_key:
-                return jsonify({'success': False, 'error': 'GEMINI_API_KEY not configured'}), 400
-            
-            genai.configure(api_key=api_key)
+            model, model_name = get_step_instructions_model()
             
-            # Get model from config
-            current_config = load_config()
-            model_name = current_config.get('GEMINI_MODEL', 'gemini-2.0-flash-exp')
-            logging.info(f"Using Gemini model for step instructions: {model_name}")
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
             
-            try:
-                model = genai.GenerativeModel(model_name)
-            except Exception as model_error:
-                logging.warning(f"Failed to load model {model_name}: {model_error}. Falling back to gemini-2.0-flash-exp")
-                model = genai.GenerativeModel('gemini-2.0-flash-exp')
-            
-            # Load image (copy to memory and close file handle to prevent locks)
-            img_file = Image.open(image_path)
-            image = img_file.copy()
-            img_file.close()
-            
-            prompt = """Analyze this screenshot and provide clear, concise step-by-step instructions for what the user should do.
-
-Focus on:
-- Identifying specific UI elements visible (buttons, menus, fields, etc.)
-- Describing the exact action to take ("Click on...", "Type into...", "Select...")
-- Explaining why this step matters (briefly)
-
-Write 2-4 sentences in a professional but friendly tone, as if guiding a colleague. Be specific about what you see in the image.
-
-IMPORTANT: Write ONLY the instructions. Do NOT include any meta-commentary or labels like "Step 1:"."""
-
             logging.info(f"Generating instructions for: {image_path}")
-            
-            # Retry logic with exponential backoff for rate limits
-            max_retries = 3
-            retry_delay = 2  # Start with 2 seconds
-            
-            for attempt in range(max_retries):
-                try:
-                    response = model.generate_content([prompt, image])
-                    instructions = response.text.strip()
-                    break  # Success, exit retry loop
-                except Exception as gen_error:
-                    error_msg = str(gen_error)
-                    is_rate_limit = '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower() or 'RESOURCE_EXHAUSTED' in error_msg
-                    
-                    if is_rate_limit and attempt < max_retries - 1:
-                        # Wait and retry
-                        wait_time = retry_delay * (2 ** attempt)  # Exponential backoff: 2s, 4s, 8s
-                        logging.warning(f"Rate limit hit on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        # Final attempt failed or non-rate-limit error
-                        logging.error(f"Error during instruction generation: {error_msg}", exc_info=True)
-                        
-                        # Check for specific error types
-                        if is_rate_limit:
-                            return jsonify({
-                                'success': False, 
-                                'error': 'API rate limit exceeded after retries. Please wait a few minutes and try again.',
-                                'error_type': 'rate_limit'
-                            }), 429
-                        elif 'SAFETY' in error_msg.upper() or 'blocked' in error_msg.lower():
-                            return jsonify({
-                                'success': False,
-                                'error': 'Content was blocked by safety filters. Try different screenshot.',
-                                'error_type': 'safety'
-                            }), 400
-                        else:
-                            return jsonify({
-                                'success': False,
-                                'error': f'Generation failed: {error_msg}',
-                                'error_type': 'generation_error'
-                            }), 500
+            instructions, cached = generate_step_instruction_text(model, model_name, image_bytes,
+                                                                  output_dir=os.path.dirname(os.path.normpath(image_path)))
             
             return jsonify({
                 'success': True,
-                'instructions': instructions
+                'instructions': instructions,
+                'cached': cached
             })
-            
+        
+        except StepInstructionError as e:
+            return jsonify(e.payload), e.status_code
         except ImportError as e:
             return jsonify({'success': False, 'error': f'Missing dependency: {str(e)}'}), 500
             
@@ -1567,83 +2258,22 @@ def generate_step_instructions_base64():
         if not image_data:
             return jsonify({'success': False, 'error': 'No image data provided'}), 400
         
-        # Import AI generation
         try:
-            import google.generativeai as genai
-            from PIL import Image
-            import io
-            import base64
-            
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if not api_key:
-                return jsonify({'success': False, 'error': 'GEMINI_API_KEY not configured'}), 400
-            
-            genai.configure(api_key=api_key)
-            
-            # Get model from config
-            current_config = load_config()
-            model_name = current_config.get('GEMINI_MODEL', 'gemini-2.0-flash-exp')
-            logging.info(f"Using Gemini model for step instructions: {model_name}")
-            
-            try:
-                model = genai.GenerativeModel(model_name)
-            except Exception as model_error:
-                logging.warning(f"Failed to load model {model_name}: {model_error}. Falling back to gemini-2.0-flash-exp")
-                model = genai.GenerativeModel('gemini-2.0-flash-exp')
+            model, model_name = get_step_instructions_model()
+            image_bytes = decode_image_data(image_data)
             
-            # Convert base64 to image
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            prompt = """Analyze this screenshot and provide clear, concise step-by-step instructions for what the user should do.
-
-Focus on:
-- Identifying specific UI elements visible (buttons, menus, fields, etc.)
-- Describing the exact action to take ("Click on...", "Type into...", "Select...")
-- Explaining why this step matters (briefly)
-
-Write 2-4 sentences in a professional but friendly tone, as if guiding a colleague. Be specific about what you see in the image.
-
-IMPORTANT: Write ONLY the instructions. Do NOT include any meta-commentary or labels like "Step 1:"."""
-
             logging.info(f"Generating instructions for uploaded image")
-            
-            try:
-                response = model.generate_content([prompt, image])
-                instructions = response.text.strip()
-            except Exception as gen_error:
-                error_msg = str(gen_error)
-                logging.error(f"Error during instruction generation: {error_msg}", exc_info=True)
-                
-                # Check for specific error types
-                if '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower():
-                    return jsonify({
-                        'success': False, 
-                        'error': 'API rate limit exceeded. Please wait a few minutes and try again.',
-                        'error_type': 'rate_limit'
-                    }), 429
-                elif 'SAFETY' in error_msg.upper() or 'blocked' in error_msg.lower():
-                    return jsonify({
-                        'success': False,
-                        'error': 'Content was blocked by safety filters. Try different screenshot.',
-                        'error_type': 'safety'
-                    }), 400
-                else:
-                    return jsonify({
-                        'success': False,
-                        'error': f'Generation failed: {error_msg}',
-                        'error_type': 'generation_error'
-                    }), 500
+            instructions, cached = generate_step_instruction_text(model, model_name, image_bytes,
+                                                                  output_dir=data.get('output_dir'))
             
             return jsonify({
                 'success': True,
-                'instructions': instructions
+                'instructions': instructions,
+                'cached': cached
             })
-            
+        
+        except StepInstructionError as e:
+            return jsonify(e.payload), e.status_code
         except ImportError as e:
             return jsonify({'success': False, 'error': f'Missing dependency: {str(e)}'}), 500
             
@@ -1651,6 +2281,119 @@ IMPORTANT: Write ONLY the instructions. Do NOT include any meta-commentary or la
         logging.error(f"Error generating step instructions from base64: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/generate_step_instructions_batch', methods=['POST'])
+def generate_step_instructions_batch():
+    """
+    Generate AI instructions for many steps at once.
+    
+    Body: {"steps": [{"step": "3", "image_path": "..."} or {"step": "4", "image_data": "data:..."}]}
+    
+    Streams newline-delimited JSON: one line per step as it finishes
+    ({"step", "success", "instructions", "cached"} or an error payload),
+    then a final {"done": true, ...} summary line. Cached steps come first.
+    """
+    try:
+        data = request.json or {}
+        steps = data.get('steps') or []
+        
+        if not steps:
+            return jsonify({'success': False, 'error': 'No steps provided'}), 400
+        
+        try:
+            model, model_name = get_step_instructions_model()
+        except StepInstructionError as e:
+            return jsonify(e.payload), e.status_code
+        except ImportError as e:
+            return jsonify({'success': False, 'error': f'Missing dependency: {str(e)}'}), 500
+        
+        def load_step_bytes(step):
+            if step.get('image_path'):
+                if not os.path.exists(step['image_path']):
+                    raise StepInstructionError({'success': False, 'error': 'Invalid image path'}, 400)
+                with open(step['image_path'], 'rb') as f:
+                    return f.read()
+            if step.get('image_data'):
+                return decode_image_data(step['image_data'])
+            raise StepInstructionError({'success': False, 'error': 'No image provided'}, 400)
+        
+        def step_output_dir(step):
+            if step.get('image_path'):
+                return os.path.dirname(os.path.normpath(step['image_path']))
+            return data.get('output_dir')
+        
+        def run_step(step, image_bytes=None):
+            result = {'step': step.get('step')}
+            try:
+                if image_bytes is None:
+                    image_bytes = load_step_bytes(step)  # Raises the step's input error
+                instructions, cached = generate_step_instruction_text(model, model_name, image_bytes,
+                                                                      output_dir=step_output_dir(step))
+                result.update({'success': True, 'instructions': instructions, 'cached': cached})
+            except StepInstructionError as e:
+                result.update(e.payload)
+            except Exception as e:
+                logging.error(f"Error generating instructions for step {step.get('step')}: {e}", exc_info=True)
+                result.update({'success': False, 'error': str(e)})
+            return result
+        
+        def generate():
+            from concurrent.futures import ThreadPoolExecutor, as_completed
+            
+            started = time.time()
+            succeeded = 0
+            cached_count = 0
+            
+            # Decode every step once up front: cache hits go out immediately and are
+            # dropped, the rest fan out with the bytes already loaded
+            pending = []
+            for step in steps:
+                image_bytes = None
+                try:
+                    image_bytes = load_step_bytes(step)
+                    cached = ai_response_cache.get(step_instruction_cache_key(model_name, image_bytes))
+                except Exception:
+                    cached = None
+                if cached:
+                    ai_ledger.record_cache_hit(model_name, 'step_instructions', step_output_dir(step))
+                    succeeded += 1
+                    cached_count += 1
+                    yield json.dumps({'step': step.get('step'), 'success': True,
+                                      'instructions': cached['instructions'], 'cached': True}) + '\n'
+                else:
+                    pending.append((step, image_bytes))
+            
+            logging.info(f"Batch step instructions: {len(steps)} steps, {cached_count} cached, {len(pending)} to generate")
+            
+            if pending:
+                executor = ThreadPoolExecutor(max_workers=ai_rate_limiter.max_concurrent)
+                try:
+                    futures = [executor.submit(run_step, step, image_bytes) for step, image_bytes in pending]
+                    del pending
+                    for future in as_completed(futures):
+                        result = future.result()
+                        if result.get('success'):
+                            succeeded += 1
+                        yield json.dumps(result) + '\n'
+                finally:
+                    # Client gone (GeneratorExit): don't spend quota on steps nobody will read
+                    executor.shutdown(cancel_futures=True)
+            
+            yield json.dumps({
+                'done': True,
+                'total': len(steps),
+                'succeeded': succeeded,
+                'cached': cached_count,
+                'seconds': round(time.time() - started, 2)
+            }) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+    except Exception as e:
+        logging.error(f"Error generating batch step instructions: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/list_recordings', methods=['GET'])
 def list_recordings():
     """List all recordings"""
@@ -1724,158 +2467,152 @@ def detect_recording_type():
 
 @app.route('/api/gemini_quota', methods=['GET'])
 def get_gemini_quota():
-    """Get Gemini API quota and usage information"""
+    """Get Gemini quota status from locally tracked request and 429 counters"""
     try:
-        api_key = os.environ.get('GEMINI_API_KEY')
-        if not api_key:
+        provider = get_ai_provider()
+        if not provider.is_configured():
             return jsonify({
                 'success': False, 
                 'error': 'API key not configured',
                 'status': 'No API Key'
             })
         
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-            
-            # Get current model
-            current_config = load_config()
-            model_name = current_config.get('GEMINI_MODEL', 'gemini-2.5-flash')
-            
-            # Try to actually list models to test if we're rate limited
-            try:
-                # This will fail if rate limited
-                models = list(genai.list_models())
-                
-                return jsonify({
-                    'success': True,
-                    'status': 'Active',
-                    'model': model_name,
-                    'note': 'Free tier: 15 requests per minute, 1500 requests per day',
-                    'info': 'Quota resets daily. If you hit limits, wait a few minutes or upgrade at https://ai.google.dev/pricing'
-                })
-            except Exception as test_error:
-                error_msg = str(test_error)
-                # Check if it's a rate limit error
-                if '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower() or 'resource' in error_msg.lower() and 'exhaust' in error_msg.lower():
-                    return jsonify({
-                        'success': True,
-                        'status': 'Rate Limited',
-                        'error': 'API quota exceeded. Wait a few minutes.',
-                        'info': 'Free tier limits: 15 requests/min, 1500 requests/day. Try again in 1-2 minutes.',
-                        'model': model_name
-                    })
-                else:
-                    raise test_error
-            
-        except Exception as e:
-            error_msg = str(e)
-            logging.error(f"Error checking quota: {error_msg}")
-            
-            if '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower():
-                return jsonify({
-                    'success': True,
-                    'status': 'Rate Limited',
-                    'error': 'API quota exceeded. Wait a few minutes.',
-                    'info': 'Free tier limits: 15 requests/min, 1500 requests/day'
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'status': 'Error',
-                    'error': error_msg
-                })
+        # Get current model
+        current_config = load_config()
+        model_name = current_config.get('GEMINI_MODEL', 'gemini-2.5-flash')
+        quota = ai_quota.status(
+            requests_per_minute=ai_rate_limiter.requests_per_minute,
+            daily_limit=int(current_config.get('GEMINI_DAILY_LIMIT', 1500))
+        )
+        
+        response = {
+            'success': True,
+            'status': 'Rate Limited' if quota['status'] == 'Rate Limited' else 'Active',
+            'quota': quota,
+            'provider': provider.name,
+            'usage': provider.usage.to_dict(),
+            'rate_limit': ai_rate_limiter.status(),
+            'circuit': provider.breaker.status(),
+            'model': model_name,
+            'note': (f"Today: {quota['requests_today']}/{quota['daily_limit']} requests, "
+                     f"{quota['requests_last_minute']}/{quota['requests_per_minute']} in the last minute"),
+            'info': 'Quota resets daily. If you hit limits, wait a few minutes or upgrade at https://ai.google.dev/pricing'
+        }
+        if quota['status'] == 'Rate Limited':
+            response['error'] = 'API quota exceeded. Wait a few minutes.'
+            response['info'] = (f"Rate limited {quota['last_rate_limited_seconds_ago']}s ago "
+                                f"({quota['rate_limited_today']} times today). Try again in 1-2 minutes.")
+        if response['circuit']['state'] != 'closed':
+            # Shown like a rate limit in the UI: AI features are paused until the probe succeeds
+            response['status'] = 'Rate Limited'
+            response['error'] = 'AI provider unavailable after repeated failures.'
+            response['info'] = (f"AI calls are paused ({response['circuit']['state'].replace('_', '-')}); "
+                                f"next check in {response['circuit']['retry_after']}s.")
+        return jsonify(response)
             
     except Exception as e:
         logging.error(f"Error checking quota: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e), 'status': 'Error'}), 500
 
-@app.route('/api/gemini_models', methods=['GET'])
-def get_gemini_models():
-    """Get available Gemini models"""
-    import time
+@app.route('/api/ai_ledger', methods=['GET'])
+def get_ai_ledger():
+    """
+    AI token, latency and cost accounting.
+    
+    With ?output_dir=... returns that recording's calls and totals; otherwise the
+    global totals with the most expensive recordings and calls (?limit=10).
+    """
+    try:
+        output_dir = request.args.get('output_dir')
+        if output_dir:
+            output_dir = os.path.normpath(output_dir)
+            if not os.path.isdir(output_dir):
+                return jsonify({'success': False, 'error': 'Invalid output directory'}), 400
+            entries = read_recording_ledger(output_dir)
+            return jsonify({'success': True, 'output_dir': output_dir,
+                            'totals': summarize_entries(entries), 'calls': entries})
+        
+        report = ai_ledger.report(limit=int(request.args.get('limit', 10)))
+        return jsonify(dict(report, success=True))
+    except Exception as e:
+        logging.error(f"Error reading AI ledger: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/ai_provider', methods=['GET', 'POST'])
+def handle_ai_provider():
+    """
+    Show the active AI provider and its token usage.
     
+    POST changes fake provider settings at runtime (latency, error, error_rate,
+    fail_next, ...) and can reset the usage counters with {"reset_usage": true}.
+    """
     try:
-        # Check cache first
-        if models_cache['models'] and (time.time() - models_cache['timestamp'] < CACHE_DURATION):
-            logging.info("Returning cached models list")
-            return jsonify({'success': True, 'models': models_cache['models'], 'cached': True})
+        provider = get_ai_provider()
+        if request.method == 'POST':
+            data = dict(request.json or {})
+            if data.pop('reset_usage', False):
+                provider.usage.reset()
+            if data:
+                if not isinstance(provider, FakeProvider):
+                    return jsonify({'success': False, 'error': 'Settings can only be changed for AI_PROVIDER=fake'}), 400
+                try:
+                    provider.configure(**data)
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                logging.info(f"Fake AI provider settings changed: {data}")
         
-        api_key = os.environ.get('GEMINI_API_KEY')
-        if not api_key:
+        response = {
+            'success': True,
+            'provider': provider.name,
+            'usage': provider.usage.to_dict(),
+            'rate_limit': ai_rate_limiter.status(),
+            'circuit': provider.breaker.status()
+        }
+        if isinstance(provider, FakeProvider):
+            response['settings'] = provider.settings()
+        return jsonify(response)
+    except Exception as e:
+        logging.error(f"Error handling AI provider request: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/gemini_models', methods=['GET'])
+def get_gemini_models():
+    """Get available Gemini models (cached on disk, refreshed in the background when stale)"""
+    try:
+        provider = get_ai_provider()
+        if not provider.is_configured():
             # Return fallback models if no API key
-            fallback_models = [
-                {'name': 'gemini-2.5-flash', 'display_name': 'Gemini 2.5 Flash', 'description': 'Latest stable multimodal model'},
-                {'name': 'gemini-2.5-pro', 'display_name': 'Gemini 2.5 Pro', 'description': 'Most capable model'},
-                {'name': 'gemini-2.0-flash', 'display_name': 'Gemini 2.0 Flash', 'description': 'Fast and versatile'},
-                {'name': 'gemini-2.0-flash-exp', 'display_name': 'Gemini 2.0 Flash Experimental', 'description': 'Experimental features'}
-            ]
-            return jsonify({'success': True, 'models': fallback_models, 'fallback': True})
+            return jsonify({'success': True, 'models': FALLBACK_GEMINI_MODELS[:4], 'fallback': True})
         
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-            
-            # List all available models that support generateContent
-            models = []
-            for model in genai.list_models():
-                # Only include models that support generateContent
-                if 'generateContent' in model.supported_generation_methods:
-                    model_name = model.name.replace('models/', '')
-                    display_name = model.display_name
-                    description = model.description if model.description else ''
-                    
-                    # Skip embedding and specialized models
-                    if any(skip in model_name.lower() for skip in ['embedding', 'aqa', 'imagen', 'veo', 'live', 'tts', 'audio', 'robotics', 'computer-use']):
-                        continue
-                    
-                    models.append({
-                        'name': model_name,
-                        'display_name': display_name,
-                        'description': description[:100] if description else ''
-                    })
-            
-            # Sort models - put stable releases first, then experimental
-            models.sort(key=lambda x: (
-                'exp' in x['name'].lower() or 'preview' in x['name'].lower(),
-                x['name']
-            ))
-            
-            # Cache the results
-            models_cache['models'] = models
-            models_cache['timestamp'] = time.time()
-            
-            logging.info(f"Found {len(models)} available Gemini models (cached)")
-            return jsonify({'success': True, 'models': models})
-            
-        except Exception as e:
-            error_msg = str(e)
-            logging.error(f"Error fetching Gemini models: {error_msg}")
-            
-            # Check if it's a rate limit error (429)
-            if '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower():
-                logging.warning("Rate limit hit - using fallback models")
-            
-            # Return fallback models if API call fails
-            fallback_models = [
-                {'name': 'gemini-2.5-flash', 'display_name': 'Gemini 2.5 Flash', 'description': 'Latest stable multimodal model'},
-                {'name': 'gemini-2.5-pro', 'display_name': 'Gemini 2.5 Pro', 'description': 'Most capable model'},
-                {'name': 'gemini-2.0-flash', 'display_name': 'Gemini 2.0 Flash', 'description': 'Fast and versatile'},
-                {'name': 'gemini-2.0-flash-exp', 'display_name': 'Gemini 2.0 Flash Experimental', 'description': 'Experimental features'},
-                {'name': 'gemini-flash-latest', 'display_name': 'Gemini Flash Latest', 'description': 'Always points to latest Flash'},
-                {'name': 'gemini-pro-latest', 'display_name': 'Gemini Pro Latest', 'description': 'Always points to latest Pro'}
-            ]
-            
-            # Cache fallback models too
-            models_cache['models'] = fallback_models
-            models_cache['timestamp'] = time.time()
-            
-            return jsonify({'success': True, 'models': fallback_models, 'fallback': True})
+        models, info = model_catalog.get(provider.name)
+        if models is None:
+            # Nothing cached and the API call failed (often a 429)
+            logging.warning("Model list unavailable - using fallback models")
+            return jsonify({'success': True, 'models': FALLBACK_GEMINI_MODELS, 'fallback': True})
+        
+        return jsonify({'success': True, 'models': models, 'cached': info['cached'], 'stale': info['stale']})
             
     except Exception as e:
         logging.error(f"Error in get_gemini_models: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e), 'models': []}), 500
 
+@app.route('/api/narration_voices', methods=['GET'])
+def get_narration_voices():
+    """Get narration voices (edge-tts list cached on disk, plus offline engine voices)"""
+    try:
+        current_config = load_config()
+        voices, info = narration.list_available_voices(current_config, catalog=voice_catalog)
+        return jsonify({
+            'success': True,
+            'voices': voices,
+            'current': current_config.get('TTS_VOICE', narration.DEFAULT_VOICE),
+            'cached': info['cached'],
+            'stale': info['stale']
+        })
+    except Exception as e:
+        logging.error(f"Error in get_narration_voices: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e), 'voices': []}), 500
+
 @app.route('/api/config', methods=['GET', 'POST'])
 def handle_config():
     """Get or update configuration"""
@@ -1919,6 +2656,7 @@ def handle_config():
                         config[key] = data[key]
                         if key == 'GEMINI_API_KEY':
                             os.environ['GEMINI_API_KEY'] = data[key]
+                            model_catalog.invalidate()
                     else:
                         updated_lines.append(line)
             
@@ -1929,6 +2667,7 @@ def handle_config():
                     config[key] = value
                     if key == 'GEMINI_API_KEY':
                         os.environ['GEMINI_API_KEY'] = value
+                        model_catalog.invalidate()
             
             # Write config to AppData location
             with open(config_path, 'w') as f:
@@ -2140,6 +2879,13 @@ def open_folder():
         logging.error(f"Error opening folder: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def send_media(path, mimetype, immutable=False):
+    """Send a file with byte ranges, ETag/Last-Modified and 304s (see shared/utils/http_files.py)"""
+    status, headers, body = plan_file_response(path, request.headers, mimetype, immutable, request.method)
+    if body is None:
+        return Response(status=status, headers=headers)
+    return Response(iter_file(path, *body), status=status, headers=headers, direct_passthrough=True)
+
 @app.route('/api/serve_video/<path:filename>')
 def serve_video(filename):
     """Serve video file for playback"""
@@ -2151,88 +2897,184 @@ def serve_video(filename):
         if not os.path.exists(video_path):
             return "Video not found", 404
         
-        return send_file(video_path, mimetype='video/mp4')
+        return send_media(video_path, 'video/mp4')
     except Exception as e:
         logging.error(f"Error serving video: {e}", exc_info=True)
         return str(e), 500
 
+@app.route('/api/preview_status', methods=['GET'])
+def get_preview_status():
+    """Preview (proxy MP4 + HLS) of a video for the editor; queues generation when missing or stale"""
+    try:
+        video_path = request.args.get('video_path')
+        if not video_path or not os.path.exists(video_path):
+            return jsonify({'success': False, 'error': 'Video not found'}), 404
+        
+        status = preview_status(video_path)
+        response = {'success': True, 'status': status}
+        if status == 'ready':
+            base_dir = config.get('OUTPUT_FOLDER', os.path.join(os.path.expanduser("~"), "Downloads", "Hallmark Scribble Outputs"))
+            rel_dir = quote(os.path.relpath(preview_dir(video_path), base_dir).replace(os.sep, '/'))
+            response['proxy_url'] = f'/api/serve_preview/{rel_dir}/{PROXY_FILE}'
+            response['hls_url'] = f'/api/serve_preview/{rel_dir}/{HLS_PLAYLIST}'
+        else:
+            job = schedule_preview(video_path)
+            if job is not None:
+                response.update(status='pending', job_id=job.id)
+        return jsonify(response)
+    except Exception as e:
+        logging.error(f"Error getting preview status: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+PREVIEW_MIMETYPES = {'.mp4': 'video/mp4', '.m3u8': 'application/vnd.apple.mpegurl', '.m4s': 'video/iso.segment'}
+
+@app.route('/api/serve_preview/<path:filename>')
+def serve_preview(filename):
+    """Serve a preview file (proxy MP4, HLS playlist or segment)"""
+    try:
+        base_dir = config.get('OUTPUT_FOLDER', os.path.join(os.path.expanduser("~"), "Downloads", "Hallmark Scribble Outputs"))
+        file_path = os.path.normpath(os.path.join(base_dir, filename))
+        mimetype = PREVIEW_MIMETYPES.get(os.path.splitext(file_path)[1].lower())
+        
+        if mimetype is None or not os.path.exists(file_path):
+            return "Preview not found", 404
+        
+        return send_media(file_path, mimetype)
+    except Exception as e:
+        logging.error(f"Error serving preview: {e}", exc_info=True)
+        return str(e), 500
+
+@app.route('/api/timeline_assets', methods=['GET'])
+def get_timeline_assets():
+    """Filmstrip sprite sheets and waveform of a video for the editor timeline; queues generation when missing"""
+    try:
+        video_path = request.args.get('video_path')
+        if not video_path or not os.path.exists(video_path):
+            return jsonify({'success': False, 'error': 'Video not found'}), 404
+        
+        manifest = load_timeline_manifest(video_path)
+        if manifest is None:
+            job = schedule_timeline(video_path)
+            return jsonify({'success': True, 'status': 'pending', 'job_id': job.id if job else None})
+        
+        base_dir = config.get('OUTPUT_FOLDER', os.path.join(os.path.expanduser("~"), "Downloads", "Hallmark Scribble Outputs"))
+        rel_dir = quote(os.path.relpath(timeline_dir(video_path), base_dir).replace(os.sep, '/'))
+        # Assets are rebuilt whenever the source changes, so the signature versions their URLs
+        version = '{:x}-{:x}'.format(*manifest['source_signature'])
+        response = {key: manifest[key] for key in ('interval', 'count', 'thumb_width', 'thumb_height', 'columns', 'rows')}
+        response.update(success=True, status='ready',
+                        sprites=[f'/api/serve_timeline/{rel_dir}/{sheet}?v={version}' for sheet in manifest['sheets']],
+                        waveform_url=(f'/api/timeline_waveform?video_path={quote(video_path)}&v={version}'
+                                      if manifest.get('waveform') else None))
+        return jsonify(response)
+    except Exception as e:
+        logging.error(f"Error getting timeline assets: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/timeline_waveform', methods=['GET'])
+def get_timeline_waveform():
+    """Waveform peaks of a video (audiowaveform JSON layout); ?format=dat returns the binary file"""
+    try:
+        video_path = request.args.get('video_path')
+        if not video_path or not os.path.exists(video_path):
+            return jsonify({'success': False, 'error': 'Video not found'}), 404
+        
+        manifest = load_timeline_manifest(video_path)
+        if manifest is None or not manifest.get('waveform'):
+            return jsonify({'success': False, 'error': 'Waveform not available'}), 404
+        
+        waveform_path = os.path.join(timeline_dir(video_path), manifest['waveform'])
+        immutable = bool(request.args.get('v'))
+        if request.args.get('format') == 'dat':
+            return send_media(waveform_path, 'application/octet-stream', immutable=immutable)
+        response = jsonify(read_waveform(waveform_path))
+        if immutable:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    except Exception as e:
+        logging.error(f"Error getting waveform: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/serve_timeline/<path:filename>')
+def serve_timeline(filename):
+    """Serve a filmstrip sprite sheet"""
+    try:
+        base_dir = config.get('OUTPUT_FOLDER', os.path.join(os.path.expanduser("~"), "Downloads", "Hallmark Scribble Outputs"))
+        file_path = os.path.normpath(os.path.join(base_dir, filename))
+        
+        if not file_path.lower().endswith('.jpg') or not os.path.exists(file_path):
+            return "Sprite not found", 404
+        
+        return send_media(file_path, 'image/jpeg', immutable=bool(request.args.get('v')))
+    except Exception as e:
+        logging.error(f"Error serving sprite: {e}", exc_info=True)
+        return str(e), 500
+
 @app.route('/api/get_video_info', methods=['POST'])
 def get_video_info():
-    """Get video metadata (duration, fps, resolution)"""
+    """Get video metadata (duration, fps, resolution), cached per file size/mtime"""
     try:
-        import subprocess
         data = request.json
         video_path = data.get('video_path')
         
         if not video_path or not os.path.exists(video_path):
             return jsonify({'success': False, 'error': 'Video not found'}), 404
         
-        # Use ffprobe to get video info
-        ffprobe_path = get_ffprobe_path()
-        
-        cmd = [
-            ffprobe_path,
-            '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height,r_frame_rate,duration',
-            '-of', 'json',
-            video_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        video_info = json.loads(result.stdout)
-        
-        stream = video_info['streams'][0]
-        fps_parts = stream['r_frame_rate'].split('/')
-        fps = float(fps_parts[0]) / float(fps_parts[1])
+        info = media_probe.info(video_path)
         
         return jsonify({
             'success': True,
-            'duration': float(stream.get('duration', 0)),
-            'width': stream['width'],
-            'height': stream['height'],
-            'fps': fps
+            'duration': info['duration'] or 0,
+            'width': info['width'],
+            'height': info['height'],
+            'fps': info['fps'],
+            'has_audio': info['has_audio'],
+            'streams': info['streams']
         })
     except Exception as e:
         logging.error(f"Error getting video info: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/cut_video', methods=['POST'])
+@background_capable('cut_video')
 def cut_video():
-    """Cut video segment"""
+    """Cut video segment (smart cut: only the GOPs at the cut points are re-encoded)"""
     try:
-        import subprocess
         data = request.json
         video_path = data.get('video_path')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
+        start_time = float(data.get('start_time'))
+        end_time = float(data.get('end_time'))
         output_name = data.get('output_name', 'cut_video.mp4')
+        mode = data.get('mode', load_config().get('VIDEO_CUT_MODE', 'smart'))
         
         if not video_path or not os.path.exists(video_path):
             return jsonify({'success': False, 'error': 'Video not found'}), 404
         
+        if mode not in ('smart', 'reencode'):
+            return jsonify({'success': False, 'error': f'Unknown cut mode: {mode}'}), 400
+        
         video_dir = os.path.dirname(video_path)
         output_path = os.path.join(video_dir, output_name)
         
         ffmpeg_path = get_ffmpeg_path()
+        jobs.report_progress(10, 'Cutting video...')
         
-        # Cut video using ffmpeg - use re-encoding for accurate cuts
-        cmd = [
-            ffmpeg_path,
-            '-ss', str(start_time),
-            '-i', video_path,
-            '-to', str(end_time - start_time),
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-y',
-            output_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            logging.error(f"FFmpeg cut error: {result.stderr}")
-            return jsonify({'success': False, 'error': f'FFmpeg error: {result.stderr}'}), 500
+        try:
+            if mode == 'smart':
+                try:
+                    _, mode = smart_cut(ffmpeg_path, get_ffprobe_path(), video_path, start_time, end_time, output_path,
+                                        progress=jobs.report_progress, probe=media_probe)
+                except (ffmpeg_runner.FFmpegTimeout, ffmpeg_runner.FFmpegCancelled):
+                    raise  # Timed out or cancelled: a re-encode would only make the user wait again
+                except (ffmpeg_runner.FFmpegError, ValueError, KeyError) as e:
+                    # Unsupported stream or failed probe: fall back to the full re-encode
+                    logging.warning(f"Smart cut failed, re-encoding the segment: {e}")
+                    mode = 'reencode'
+            if mode == 'reencode':
+                reencode_cut(ffmpeg_path, video_path, start_time, end_time, output_path)
+        except RuntimeError as e:
+            logging.error(f"FFmpeg cut error: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
         
         # Verify output file was created and has content
         if not os.path.exists(output_path) or os.path.getsize(output_path) < 1000:
@@ -2241,6 +3083,7 @@ def cut_video():
         return jsonify({
             'success': True,
             'output_path': output_path,
+            'mode': mode,
             'message': 'Video cut successfully'
         })
     except Exception as e:
@@ -2248,10 +3091,10 @@ def cut_video():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/merge_videos', methods=['POST'])
+@background_capable('merge_videos')
 def merge_videos():
     """Merge multiple video segments"""
     try:
-        import subprocess
         data = request.json
         video_paths = data.get('video_paths', [])
         output_name = data.get('output_name', 'merged_video.mp4')
@@ -2276,6 +3119,7 @@ def merge_videos():
         if not os.path.exists(ffmpeg_path):
             ffmpeg_path = 'ffmpeg'
         
+        jobs.report_progress(10, 'Merging videos...')
         cmd = [
             ffmpeg_path,
             '-f', 'concat',
@@ -2286,7 +3130,7 @@ def merge_videos():
             output_path
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = ffmpeg_runner.run(cmd, check=False)
         
         # Clean up concat file
         try:
@@ -2298,22 +3142,13 @@ def merge_videos():
             logging.error(f"FFmpeg merge error: {result.stderr}")
             return jsonify({'success': False, 'error': f'FFmpeg error: {result.stderr}'}), 500
         
-        # Get duration of merged video
+        # Get duration of merged video (cached for the editor's next get_video_info)
         duration = 0
         if os.path.exists(output_path):
             try:
-                probe_cmd = [
-                    ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe') if ffmpeg_path.endswith('.exe') else 'ffprobe',
-                    '-v', 'error',
-                    '-show_entries', 'format=duration',
-                    '-of', 'default=noprint_wrappers=1:nokey=1',
-                    output_path
-                ]
-                probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-                if probe_result.returncode == 0:
-                    duration = float(probe_result.stdout.strip())
-            except:
-                pass
+                duration = media_probe.info(output_path)['duration'] or 0
+            except Exception as e:
+                logging.warning(f"Could not probe merged video: {e}")
         
         return jsonify({
             'success': True,
@@ -2325,11 +3160,76 @@ def merge_videos():
         logging.error(f"Error merging videos: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/render_edl', methods=['POST'])
+@background_capable('render_edl')
+def render_edl_endpoint():
+    """Render a whole editor timeline (segments, audio offset, replacement audio, narration) in one pass"""
+    try:
+        data = request.json
+        edl = data.get('edl') or {}
+        segments = edl.get('segments') or []
+        
+        if not segments:
+            return jsonify({'success': False, 'error': 'EDL has no segments'}), 400
+        
+        sources = {os.path.normpath(segment.get('source') or '') for segment in segments}
+        missing = [source for source in sources if not os.path.exists(source)]
+        if missing:
+            return jsonify({'success': False, 'error': f'Video not found: {missing[0]}'}), 404
+        for segment in segments:
+            segment['source'] = os.path.normpath(segment['source'])
+        
+        replace_audio = edl.get('replace_audio')
+        if replace_audio and not os.path.exists(replace_audio):
+            return jsonify({'success': False, 'error': 'Audio not found'}), 404
+        
+        video_dir = os.path.dirname(segments[0]['source'])
+        output_path = os.path.join(video_dir, data.get('output_name', f'edited_{int(time.time())}.mp4'))
+        
+        jobs.report_progress(2, 'Reading media...')
+        media = {source: media_probe.info(source) for source in sources}
+        
+        narration_chunks, narration_tempo = None, 1.0
+        if edl.get('narration'):
+            # Narration is synthesized from the recording's transcript (chunks are cached per step)
+            transcript_path = os.path.join(video_dir, 'transcript.txt')
+            if not os.path.exists(transcript_path):
+                return jsonify({'success': False, 'error': 'No transcript found for narration'}), 400
+            jobs.report_progress(3, 'Generating narration...')
+            with open(transcript_path, 'r', encoding='utf-8') as f:
+                script = narration.clean_narration_script(f.read().strip())
+            backend, chunks = narration.synthesize_narration(
+                script,
+                os.path.join(video_dir, narration.TTS_CACHE_DIR),
+                backends=narration.get_tts_backends(load_config())
+            )
+            narration_chunks = [chunk_path for _, chunk_path in chunks]
+            narration_tempo = backend.tempo
+        
+        output_path, duration = render_edl(
+            get_ffmpeg_path(), edl, media, output_path,
+            narration_chunks=narration_chunks,
+            narration_tempo=narration_tempo,
+            progress=jobs.report_progress,
+            check_cancelled=jobs.check_cancelled
+        )
+        
+        return jsonify({
+            'success': True,
+            'output_path': output_path,
+            'duration': duration,
+            'message': 'Timeline rendered successfully'
+        })
+    except EDLError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error rendering EDL: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/adjust_audio_sync', methods=['POST'])
 def adjust_audio_sync():
     """Adjust audio sync offset"""
     try:
-        import subprocess
         data = request.json
         video_path = data.get('video_path')
         audio_offset = data.get('audio_offset', 0)  # in seconds
@@ -2357,7 +3257,7 @@ def adjust_audio_sync():
             output_path
         ]
         
-        subprocess.run(cmd, capture_output=True)
+        ffmpeg_runner.run(cmd, check=False)
         
         return jsonify({
             'success': True,
@@ -2372,8 +3272,6 @@ def adjust_audio_sync():
 def replace_audio():
     """Replace video audio with new audio file"""
     try:
-        import subprocess
-        
         # Check if this is a file upload or JSON request
         if 'audio' in request.files:
             # File upload from frontend
@@ -2426,7 +3324,7 @@ def replace_audio():
             output_path
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = ffmpeg_runner.run(cmd, check=False)
         
         # Clean up temporary audio if it was uploaded
         if 'audio' in request.files and os.path.exists(audio_path):
@@ -2609,23 +3507,21 @@ def save_editor_changes():
         if not output_dir or not os.path.exists(output_dir):
             return jsonify({'success': False, 'error': 'Invalid output directory'}), 400
         
-        # Save title
-        if title:
-            title_path = os.path.join(output_dir, 'title.txt')
-            with open(title_path, 'w', encoding='utf-8') as f:
-                f.write(title)
-        
-        # Save transcript
-        transcript_path = os.path.join(output_dir, 'transcript.txt')
-        with open(transcript_path, 'w', encoding='utf-8') as f:
-            f.write(transcript)
-        
-        # Save notes if provided
-        if notes:
-            notes_path = os.path.join(output_dir, 'notes.json')
-            import json
-            with open(notes_path, 'w', encoding='utf-8') as f:
-                json.dump(notes, f, indent=2)
+        with recording_lock(output_dir):
+            # Save title
+            if title:
+                title_path = os.path.join(output_dir, 'title.txt')
+                with open(title_path, 'w', encoding='utf-8') as f:
+                    f.write(title)
+            
+            # Save transcript
+            transcript_path = os.path.join(output_dir, 'transcript.txt')
+            with open(transcript_path, 'w', encoding='utf-8') as f:
+                f.write(transcript)
+            
+            # Save notes if provided
+            if notes:
+                write_guide_notes(output_dir, notes)
         
         logging.info(f"Editor changes saved to {output_dir}")
         
@@ -2674,10 +3570,11 @@ def save_annotated_image():
 
 @app.route('/api/editor/image/<path:filepath>')
 def serve_image(filepath):
-    """Serve images for the editor"""
+    """Serve images for the editor (versioned URLs, ?v= or ?t=, are cached as immutable)"""
     try:
         if os.path.exists(filepath):
-            return send_file(filepath, mimetype='image/png')
+            versioned = 'v' in request.args or 't' in request.args
+            return send_media(filepath, 'image/png', immutable=versioned)
         return "Image not found", 404
     except Exception as e:
         logging.error(f"Error serving image: {e}", exc_info=True)
@@ -2724,6 +3621,9 @@ def restart():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/generate_sop', methods=['POST'])
+@background_capable('generate_sop')
+@coalesce_requests(sop_request_key)
+@ledger_operation('generate_sop')
 def generate_sop():
     """Generate a Standard Operating Procedure from a guide with screenshots"""
     try:
@@ -2765,16 +3665,18 @@ def generate_sop():
         
         sop_content = None
         ai_generated = False
+        ai_unavailable = False
         
         # Try to use Gemini AI to generate SOP from the guide
         try:
-            import google.generativeai as genai
-            
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if api_key:
-                genai.configure(api_key=api_key)
+            provider = get_ai_provider()
+            if provider.breaker.is_open():
+                # Don't wait on a provider that is known to be down
+                ai_unavailable = True
+                logging.warning("AI circuit breaker open, falling back to notes-based generation")
+            elif provider.is_configured():
                 model_name = config.get('GEMINI_MODEL', 'gemini-2.0-flash-exp')
-                model = genai.GenerativeModel(model_name)
+                model = provider.get_model(model_name)
                 
                 # Create prompt for SOP generation
                 prompt = f"""You are an expert technical writer. Convert the following how-to guide into a formal Standard Operating Procedure (SOP).
@@ -2791,12 +3693,15 @@ The SOP should follow this format:
 Make the language professional, clear, and concise. Each step should be actionable and specific.
 
 HERE IS THE GUIDE:
-{guide_content}
+{truncate_text(guide_content, int(config.get('SOP_GUIDE_TOKEN_BUDGET', GUIDE_TOKEN_BUDGET)), label='guide')}
 
 Generate a well-formatted SOP document in HTML format with proper headings (<h1>, <h2>), paragraphs (<p>), and ordered lists (<ol><li>). Include basic CSS styling for a professional appearance."""
                 
                 logging.info(f"Generating SOP using {model_name}")
-                response = model.generate_content(prompt)
+                jobs.report_progress(20, 'Generating SOP with AI...')
+                log_prompt_tokens('generate_sop', prompt)
+                with ai_rate_limiter.slot(sleep=jobs.sleep):
+                    response = model.generate_content(prompt)
                 sop_html = response.text
                 
                 # Strip code block markers if present
@@ -2840,6 +3745,7 @@ Generate a well-formatted SOP document in HTML format with proper headings (<h1>
             else:
                 logging.warning("GEMINI_API_KEY not configured, falling back to notes-based generation")
         except Exception as ai_error:
+            ai_unavailable = isinstance(ai_error, CircuitOpenError)
             logging.warning(f"AI generation failed: {ai_error}, falling back to notes-based generation")
         
         # Fallback: Generate SOP from notes if AI failed or not available
@@ -2900,6 +3806,9 @@ Generate a well-formatted SOP document in HTML format with proper headings (<h1>
 </body>
 </html>"""
         
+        jobs.check_cancelled()
+        jobs.report_progress(80, 'Embedding screenshots...')
+        
         # Create HTML version with embedded screenshots
         import base64
         
@@ -3144,6 +4053,7 @@ Generate a well-formatted SOP document in HTML format with proper headings (<h1>
             'filename': f'SOP_{title.replace(" ", "_")}.html',
             'ai_generated': ai_generated,
             'generation_method': 'AI' if ai_generated else 'Notes-based',
+            'ai_unavailable': ai_unavailable,
             'screenshots': image_step_count  # Return actual count of image steps
         })
     except Exception as e:
@@ -3157,7 +4067,7 @@ def serve_sop(filepath):
         # Normalize path
         filepath = os.path.normpath(filepath)
         if os.path.exists(filepath) and filepath.endswith('.html'):
-            return send_file(filepath, mimetype='text/html')
+            return send_media(filepath, 'text/html')
         return "SOP file not found", 404
     except Exception as e:
         logging.error(f"Error serving SOP: {e}", exc_info=True)